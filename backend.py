@@ -1,50 +1,101 @@
 from langgraph.graph import StateGraph, START, END
-from langgraph.checkpoint.sqlite import SqliteSaver
 from prompts import (mental_health_prompt, diet_prompt, exercise_prompt, router_prompt, 
                      language_safety_prompt, ner_prompt, mental_health_ner_prompt, 
                      diet_ner_prompt, exercise_ner_prompt, mental_health_routine_prompt,
                      diet_routine_prompt, exercise_routine_prompt)
 from langgraph.graph.message import add_messages
 from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage, AIMessage
-from langchain_openai import ChatOpenAI
 from typing import TypedDict, Literal, Annotated, Optional
 from pydantic import Field, BaseModel
 from dotenv import load_dotenv
 import operator
 import json
-import sqlite3
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import os
 import re
 import hashlib
+import threading
+from ids import new_user_id, new_plan_id, agent_from_thread_id
+from storage import (
+    USERS_DATA_FILE, WELLNESS_DATA_DIR, load_users_data, write_json_atomic, get_user_wellness_file,
+    load_user_wellness_data, wellness_file_path, find_wellness_file, session_index_path, find_session_index_file,
+    iter_wellness_files,
+    session_archive_path, write_session_archive, read_session_archive, entity_fingerprint,
+    entity_name, entity_attribute, entity_index_key, canonical_entity_name
+)
+from history_store import HISTORY_DB_FILE, queue_thread_purge, start_reclaim_job
+from search import search_tokens, entity_search_text, match_score, make_snippet, rank_results
 
 # Import SQL database functions (with fallback to JSON)
 try:
     from database import (
-        init_database, create_user_sql, get_user_sql, update_user_last_active_sql,
+        init_database, create_user_sql, get_user_sql,
         create_user_profile_sql, get_user_profile_sql, log_health_data_sql,
         get_user_health_history_sql, create_session_sql, update_session_sql,
-        get_user_sessions_sql, get_db_connection
+        get_user_sessions_sql, get_db_connection, add_message_sql, get_session_messages_sql,
+        add_session_entities_sql, add_agent_entities_sql, get_session_entities_sql,
+        get_agent_entities_sql, get_conversation_sessions_sql, user_has_conversation_data_sql,
+        delete_session_data_sql, record_user_activity_sql, get_user_last_active_sql,
+        get_session_index_sql, get_idle_sessions_sql, archive_session_sql, get_entity_summary_sql,
+        search_conversations_sql, get_entity_stats_sql, get_entity_mentions_sql, get_cooccurring_entities_sql,
+        get_user_threads_sql, get_all_thread_ids_sql, set_thread_agents_sql
     )
     SQL_AVAILABLE = True
     # Initialize database on import
     init_database()
-    print("✓ SQL Database initialized successfully")
 except ImportError:
     SQL_AVAILABLE = False
     print("⚠ SQL Database not available, using JSON fallback")
 
 load_dotenv()
 
-WELLNESS_DATA_DIR = "wellness_data"
-USERS_DATA_FILE = "users_data.json"
+USERS_LAST_ACTIVE_FILE = "users_last_active.json"
 
 # Hybrid data mode configuration
-USE_SQL_FOR_STRUCTURED = SQL_AVAILABLE  # User data, profiles, health data, sessions
-USE_JSON_FOR_CONVERSATIONS = True       # NER entities, conversation history
+USE_SQL_FOR_STRUCTURED = SQL_AVAILABLE     # User data, profiles, health data, sessions
+USE_SQL_FOR_CONVERSATIONS = SQL_AVAILABLE  # NER entities, conversation history
+USE_JSON_FOR_CONVERSATIONS = not USE_SQL_FOR_CONVERSATIONS
+
+# Sessions idle longer than this have their messages moved to cold storage
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+
+# ===== LAZY RESOURCES =====
+# LLM clients, the checkpointer and the compiled graph are created on first use instead of at
+# import, so pages and tools that never chat don't pay for them.
+
+_resources = {}
+_resources_lock = threading.RLock()
+
+def _resource(name: str, factory):
+    """Create a shared resource once per process and return it"""
+    with _resources_lock:
+        if name not in _resources:
+            _resources[name] = factory()
+        return _resources[name]
+
+def _create_models() -> dict:
+    """Chat model for agents and NER, and a short, low-temperature model for routing"""
+    from langchain_openai import ChatOpenAI
+    return {
+        "chat": ChatOpenAI(model="gpt-4o-mini", temperature=0.5, max_tokens=2000),
+        "router": ChatOpenAI(model="gpt-4o-mini", temperature=0.1, max_tokens=50)
+    }
+
+def get_models() -> dict:
+    """Get the LLM clients: "chat" for agents and NER, "router" for routing"""
+    return _resource("models", _create_models)
+
+def _create_checkpointer():
+    """SQLite checkpointer holding conversation graph state in history.db, as compressed deltas
+
+    Each Streamlit session thread gets its own WAL connection, so concurrent turns do not share one.
+    """
+    from delta_checkpointer import PooledDeltaSqliteSaver
+    return PooledDeltaSqliteSaver(HISTORY_DB_FILE)
 
-model = ChatOpenAI(model="gpt-4o-mini", temperature=0.5, max_tokens=2000)
-router_model = ChatOpenAI(model="gpt-4o-mini", temperature=0.1, max_tokens=50)
+def get_checkpointer():
+    """Get the conversation graph checkpointer"""
+    return _resource("checkpointer", _create_checkpointer)
 
 # Custom Message classes with timestamps
 class TimestampedHumanMessage(HumanMessage):
@@ -298,6 +349,7 @@ class WeeklyGoal(BaseModel):
 class RoutinePlan(BaseModel):
     """Complete routine plan for user"""
     user_id: str
+    plan_id: Optional[str] = Field(default=None, description="Assigned by the system, leave empty")
     plan_type: Literal["mental_health", "diet", "exercise", "comprehensive"] = Field(description="Type of routine plan")
     created_date: date = Field(default_factory=date.today)
     
@@ -366,7 +418,6 @@ class DailyLog(BaseModel):
     mental_health_notes: str = Field(default="")
     created_at: datetime = Field(default_factory=datetime.now)
 
-os.makedirs(WELLNESS_DATA_DIR, exist_ok=True)
 # Authentication and User Management Functions
 def hash_password(password: str) -> str:
     """Hash password using SHA-256"""
@@ -381,17 +432,123 @@ def validate_email(email: str) -> bool:
     email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     return re.match(email_pattern, email) is not None
 
-def load_users_data():
-    """Load all users data"""
-    if os.path.exists(USERS_DATA_FILE):
-        with open(USERS_DATA_FILE, "r", encoding="utf-8") as f:
+def save_users_data(users_data):
+    """Save all users data"""
+    write_json_atomic(USERS_DATA_FILE, users_data)
+    _invalidate_user_directory()
+
+# ===== INDEXED USER DIRECTORY =====
+# users_data.json is parsed once per file change and kept in memory together with
+# hash indexes on normalized email and CNIC, so logins and lookups avoid full scans.
+
+_user_directory = {"signature": None, "users": {}, "email": {}, "cnic": {}}
+_user_directory_lock = threading.RLock()
+
+def normalize_email(email: str) -> str:
+    """Normalize an email address for index lookups"""
+    return (email or "").strip().lower()
+
+def normalize_cnic(cnic: str) -> str:
+    """Normalize a CNIC to its digits for index lookups"""
+    return re.sub(r'\D', '', cnic or "")
+
+def _users_file_signature():
+    """Return (mtime, size) of the users file, or None if it does not exist"""
+    try:
+        stat = os.stat(USERS_DATA_FILE)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def _index_user(user_id: str, user_info: dict):
+    """Add a user's email and CNIC to the directory indexes"""
+    email = normalize_email(user_info.get("email"))
+    if email:
+        _user_directory["email"].setdefault(email, user_id)
+    cnic = normalize_cnic(user_info.get("cnic"))
+    if cnic:
+        _user_directory["cnic"].setdefault(cnic, user_id)
+
+def _unindex_user(user_id: str, user_info: dict):
+    """Remove a user's email and CNIC from the directory indexes"""
+    email = normalize_email(user_info.get("email"))
+    if _user_directory["email"].get(email) == user_id:
+        del _user_directory["email"][email]
+    cnic = normalize_cnic(user_info.get("cnic"))
+    if _user_directory["cnic"].get(cnic) == user_id:
+        del _user_directory["cnic"][cnic]
+
+def _invalidate_user_directory():
+    """Force the next directory lookup to reload users_data.json"""
+    with _user_directory_lock:
+        _user_directory["signature"] = None
+
+def _get_user_directory() -> dict:
+    """Return the in-memory user directory, reloading it if the users file changed"""
+    with _user_directory_lock:
+        signature = _users_file_signature()
+        if _user_directory["signature"] is None or _user_directory["signature"] != signature:
+            _user_directory["users"] = load_users_data()
+            _user_directory["email"] = {}
+            _user_directory["cnic"] = {}
+            for user_id, user_info in _user_directory["users"].items():
+                _index_user(user_id, user_info)
+            _user_directory["signature"] = signature
+        return _user_directory
+
+def _persist_user_directory():
+    """Write the directory back to users_data.json without rebuilding the indexes"""
+    write_json_atomic(USERS_DATA_FILE, _user_directory["users"])
+    _user_directory["signature"] = _users_file_signature()
+
+def find_user_by_email(email: str) -> Optional[str]:
+    """Return the user_id registered with an email, if any"""
+    return _get_user_directory()["email"].get(normalize_email(email))
+
+def find_user_by_cnic(cnic: str) -> Optional[str]:
+    """Return the user_id registered with a CNIC, if any"""
+    return _get_user_directory()["cnic"].get(normalize_cnic(cnic))
+
+def get_user_record(user_id: str) -> dict:
+    """Return a copy of a single user record from the directory"""
+    with _user_directory_lock:
+        user_info = _get_user_directory()["users"].get(user_id)
+        return json.loads(json.dumps(user_info, default=str)) if user_info else {}
+
+def count_user_records() -> int:
+    """Return the number of users in the directory"""
+    return len(_get_user_directory()["users"])
+
+def put_user_record(user_id: str, user_info: dict):
+    """Insert or replace a user record, updating the indexes incrementally"""
+    with _user_directory_lock:
+        directory = _get_user_directory()
+        previous = directory["users"].get(user_id)
+        if previous:
+            _unindex_user(user_id, previous)
+        directory["users"][user_id] = user_info
+        _index_user(user_id, user_info)
+        _persist_user_directory()
+
+# ===== LAST ACTIVE STORE =====
+
+def _load_last_active_data() -> dict:
+    """Load the JSON last-active store"""
+    if os.path.exists(USERS_LAST_ACTIVE_FILE):
+        with open(USERS_LAST_ACTIVE_FILE, "r", encoding="utf-8") as f:
             return json.load(f)
     return {}
 
-def save_users_data(users_data):
-    """Save all users data"""
-    with open(USERS_DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(users_data, f, indent=4, ensure_ascii=False, default=str)
+def get_user_last_active(user_id: str) -> Optional[str]:
+    """Get user's last active timestamp from the activity store"""
+    if USE_SQL_FOR_STRUCTURED and SQL_AVAILABLE:
+        try:
+            return get_user_last_active_sql(user_id)
+        except Exception as e:
+            print(f"SQL error, falling back to JSON: {e}")
+
+    # JSON fallback
+    return _load_last_active_data().get(user_id)
 
 def create_user_profile(profile_data: dict) -> dict:
     """Create a new user profile for wellness assistant"""
@@ -406,15 +563,12 @@ def create_user_profile(profile_data: dict) -> dict:
         if not validate_email(profile_data['email']):
             return {"success": False, "message": "Invalid email format"}
         
-        users_data = load_users_data()
-        
         # Check if email already exists
-        for user_id, user_info in users_data.items():
-            if user_info.get("email") == profile_data['email']:
-                return {"success": False, "message": "User with this email already exists"}
+        if find_user_by_email(profile_data['email']):
+            return {"success": False, "message": "User with this email already exists"}
         
         # Create new user ID
-        user_id = f"user_{len(users_data) + 1:04d}"
+        user_id = new_user_id()
         
         # Create user profile
         user_profile = {
@@ -422,7 +576,7 @@ def create_user_profile(profile_data: dict) -> dict:
             "full_name": profile_data['full_name'].strip().title(),
             "age": int(profile_data['age']),
             "gender": profile_data['gender'],
-            "email": profile_data['email'].lower(),
+            "email": normalize_email(profile_data['email']),
             "password_hash": hash_password(profile_data['password']),
             "height": float(profile_data['height']),
             "current_weight": float(profile_data['current_weight']),
@@ -442,8 +596,7 @@ def create_user_profile(profile_data: dict) -> dict:
             "last_active": datetime.now().isoformat()
         }
         
-        users_data[user_id] = user_profile
-        save_users_data(users_data)
+        put_user_record(user_id, user_profile)
         
         # Initialize wellness data for new user
         initialize_user_wellness_data(user_id)
@@ -455,37 +608,32 @@ def create_user_profile(profile_data: dict) -> dict:
 
 def authenticate_user(email: str, password: str) -> dict:
     """Authenticate user login"""
-    users_data = load_users_data()
-    
-    for user_id, user_info in users_data.items():
-        if user_info.get("email") == email.lower():
-            if verify_password(password, user_info.get("password_hash", "")):
-                # Update last active
-                user_info["last_active"] = datetime.now().isoformat()
-                users_data[user_id] = user_info
-                save_users_data(users_data)
-                
-                return {
-                    "success": True, 
-                    "message": "Authentication successful", 
-                    "user_id": user_id,
-                    "user_name": user_info.get("full_name", "User")
-                }
-            else:
-                return {"success": False, "message": "Invalid password"}
+    user_id = find_user_by_email(email)
+    if not user_id:
+        return {"success": False, "message": "User not found"}
     
-    return {"success": False, "message": "User not found"}
+    user_info = get_user_record(user_id)
+    if verify_password(password, user_info.get("password_hash", "")):
+        # Update last active
+        update_user_last_active_hybrid(user_id)
+        
+        return {
+            "success": True, 
+            "message": "Authentication successful", 
+            "user_id": user_id,
+            "user_name": user_info.get("full_name", "User")
+        }
+    else:
+        return {"success": False, "message": "Invalid password"}
 
 def update_daily_inputs(user_id: str, daily_data: dict) -> dict:
     """Update user's daily inputs"""
     try:
-        users_data = load_users_data()
+        user_profile = get_user_record(user_id)
         
-        if user_id not in users_data:
+        if not user_profile:
             return {"success": False, "message": "User not found"}
         
-        user_profile = users_data[user_id]
-        
         # Update daily fields
         if 'daily_stress_level' in daily_data:
             user_profile['daily_stress_level'] = int(daily_data['daily_stress_level'])
@@ -500,9 +648,9 @@ def update_daily_inputs(user_id: str, daily_data: dict) -> dict:
         if 'workout_duration_preference' in daily_data:
             user_profile['workout_duration_preference'] = int(daily_data['workout_duration_preference'])
         
-        user_profile['last_active'] = datetime.now().isoformat()
-        users_data[user_id] = user_profile
-        save_users_data(users_data)
+        put_user_record(user_id, user_profile)
+        invalidate_user_context(user_id)
+        update_user_last_active_hybrid(user_id)
         
         return {"success": True, "message": "Daily inputs updated successfully"}
         
@@ -512,13 +660,11 @@ def update_daily_inputs(user_id: str, daily_data: dict) -> dict:
 def update_user_profile(user_id: str, profile_data: dict) -> dict:
     """Update user's profile information"""
     try:
-        users_data = load_users_data()
+        user_profile = get_user_record(user_id)
         
-        if user_id not in users_data:
+        if not user_profile:
             return {"success": False, "message": "User not found"}
         
-        user_profile = users_data[user_id]
-        
         # Update profile fields (only allow specific fields to be updated)
         allowed_fields = [
             'full_name', 'email', 'age', 'gender', 'height', 'target_weight',
@@ -545,9 +691,9 @@ def update_user_profile(user_id: str, profile_data: dict) -> dict:
                 else:
                     user_profile[field] = value
         
-        user_profile['last_active'] = datetime.now().isoformat()
-        users_data[user_id] = user_profile
-        save_users_data(users_data)
+        put_user_record(user_id, user_profile)
+        invalidate_user_context(user_id)
+        update_user_last_active_hybrid(user_id)
         
         return {"success": True, "message": "Profile updated successfully"}
         
@@ -556,8 +702,10 @@ def update_user_profile(user_id: str, profile_data: dict) -> dict:
 
 def get_user_info(user_id: str) -> dict:
     """Get user information"""
-    users_data = load_users_data()
-    return users_data.get(user_id, {})
+    user_info = get_user_record(user_id)
+    if user_info:
+        user_info["last_active"] = get_user_last_active(user_id) or user_info.get("last_active")
+    return user_info
 
 # Legacy functions for compatibility
 def validate_cnic(cnic: str) -> bool:
@@ -585,7 +733,7 @@ def add_user_hybrid(name: str, cnic: str, email: str = None, phone: str = None)
         # Use SQL database
         try:
             # Generate user ID
-            user_id = f"user_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            user_id = new_user_id()
             
             user_data = {
                 "user_id": user_id,
@@ -612,24 +760,20 @@ def add_user_hybrid(name: str, cnic: str, email: str = None, phone: str = None)
 
 def add_user_json_fallback(name: str, formatted_cnic: str) -> dict:
     """JSON fallback for adding users"""
-    users_data = load_users_data()
-    
     # Check if CNIC already exists
-    for user_id, user_info in users_data.items():
-        if user_info.get("cnic") == formatted_cnic:
-            return {"success": False, "message": "User with this CNIC already exists."}
+    if find_user_by_cnic(formatted_cnic):
+        return {"success": False, "message": "User with this CNIC already exists."}
     
     # Create new user ID
-    user_id = f"user_{len(users_data) + 1:04d}"
+    user_id = new_user_id()
     
-    users_data[user_id] = {
+    put_user_record(user_id, {
         "name": name.strip().title(),
         "cnic": formatted_cnic,
         "created_at": datetime.now().isoformat(),
         "last_active": datetime.now().isoformat()
-    }
+    })
     
-    save_users_data(users_data)
     initialize_user_wellness_data(user_id)
     
     return {"success": True, "message": f"User {name} added successfully.", "user_id": user_id}
@@ -645,8 +789,7 @@ def get_user_hybrid(user_id: str) -> dict:
             print(f"SQL error, falling back to JSON: {e}")
     
     # JSON fallback
-    users_data = load_users_data()
-    return users_data.get(user_id, {})
+    return get_user_record(user_id)
 
 def get_all_users_hybrid() -> dict:
     """Get all users using hybrid approach"""
@@ -673,16 +816,15 @@ def update_user_last_active_hybrid(user_id: str):
     """Update user's last active timestamp using hybrid approach"""
     if USE_SQL_FOR_STRUCTURED and SQL_AVAILABLE:
         try:
-            update_user_last_active_sql(user_id)
+            record_user_activity_sql(user_id)
             return
         except Exception as e:
             print(f"SQL error, falling back to JSON: {e}")
     
-    # JSON fallback
-    users_data = load_users_data()
-    if user_id in users_data:
-        users_data[user_id]["last_active"] = datetime.now().isoformat()
-        save_users_data(users_data)
+    # JSON fallback: a small separate store, so users_data.json is not rewritten
+    last_active_data = _load_last_active_data()
+    last_active_data[user_id] = datetime.now().isoformat()
+    write_json_atomic(USERS_LAST_ACTIVE_FILE, last_active_data)
 
 def search_user_by_cnic_hybrid(cnic: str) -> str:
     """Search user by CNIC using hybrid approach"""
@@ -697,16 +839,13 @@ def search_user_by_cnic_hybrid(cnic: str) -> str:
                 cursor = conn.cursor()
                 cursor.execute("SELECT user_id FROM users WHERE cnic = ? AND is_active = TRUE", (formatted_cnic,))
                 row = cursor.fetchone()
-                return row["user_id"] if row else None
+                if row:
+                    return row["user_id"]
         except Exception as e:
             print(f"SQL error, falling back to JSON: {e}")
     
     # JSON fallback
-    users_data = load_users_data()
-    for user_id, user_info in users_data.items():
-        if user_info.get("cnic") == formatted_cnic:
-            return user_id
-    return None
+    return find_user_by_cnic(formatted_cnic)
 
 # ===== LEGACY FUNCTIONS (for backward compatibility) =====
 
@@ -723,6 +862,7 @@ def create_user_profile_hybrid(user_id: str, profile_data: dict) -> dict:
             profile_data["user_id"] = user_id
             result = create_user_profile_sql(profile_data)
             if result["success"]:
+                invalidate_user_context(user_id)
                 return result
         except Exception as e:
             print(f"SQL error, falling back to JSON: {e}")
@@ -875,7 +1015,7 @@ def create_routine_plan_hybrid(user_id: str, plan_data: dict) -> dict:
         try:
             # Generate plan ID if not provided
             if "plan_id" not in plan_data:
-                plan_data["plan_id"] = f"plan_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+                plan_data["plan_id"] = new_plan_id()
             
             plan_data["user_id"] = user_id
             
@@ -907,7 +1047,7 @@ def create_routine_plan_hybrid(user_id: str, plan_data: dict) -> dict:
         if "routine_plans" not in wellness_data:
             wellness_data["routine_plans"] = {}
         
-        plan_id = plan_data.get("plan_id", f"plan_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        plan_id = plan_data.get("plan_id") or new_plan_id()
         plan_data["plan_id"] = plan_id
         plan_data["created_at"] = datetime.now().isoformat()
         
@@ -1012,7 +1152,7 @@ def get_messages_with_timestamps_from_state(thread_id: str):
     """Extract messages with timestamps from SQLite state - Legacy compatibility"""
     try:
         # Get the state from checkpointer
-        state = chatbot.get_state(config={"configurable": {"thread_id": thread_id}})
+        state = get_chatbot().get_state(config={"configurable": {"thread_id": thread_id}})
         messages = state.values.get('messages', [])
         timestamps = state.values.get('time_stamps', [])
         
@@ -1048,10 +1188,9 @@ def get_messages_with_timestamps_from_state(thread_id: str):
 def get_user_ner_insights(user_id: str = "default_user"):
     """Get aggregated insights about entities mentioned across all user sessions"""
     try:
-        # Load NER data directly from wellness data
-        wellness_data = load_user_wellness_data(user_id)
+        session_index = get_user_session_index(user_id)
         
-        if not wellness_data or "sessions" not in wellness_data:
+        if not session_index:
             return {
                 "user_id": user_id,
                 "total_people": 0,
@@ -1064,65 +1203,21 @@ def get_user_ner_insights(user_id: str = "default_user"):
                 "unique_substances": []
             }
         
-        sessions = wellness_data["sessions"]
-        
-        # Aggregate entities from all sessions
-        all_people = set()
-        all_places = set()
-        all_events = set()
-        all_substances = set()
-        
-        for session_id, session_data in sessions.items():
-            # Extract people
-            for person in session_data.get("people", []):
-                if isinstance(person, dict):
-                    name = person.get("name", "")
-                    if name:
-                        all_people.add(name)
-                else:
-                    all_people.add(str(person))
-            
-            # Extract places
-            for place in session_data.get("places", []):
-                if isinstance(place, dict):
-                    location = place.get("location") or place.get("name") or place.get("place", "")
-                    if location:
-                        all_places.add(location)
-                else:
-                    all_places.add(str(place))
-            
-            # Extract events
-            for event in session_data.get("events", []):
-                if isinstance(event, dict):
-                    event_name = event.get("event") or event.get("name") or event.get("activity", "")
-                    if event_name:
-                        all_events.add(event_name)
-                else:
-                    all_events.add(str(event))
-            
-            # Extract substances
-            for substance in session_data.get("substances", []):
-                if isinstance(substance, dict):
-                    substance_name = substance.get("substance") or substance.get("name", "")
-                    if substance_name:
-                        all_substances.add(substance_name)
-                else:
-                    all_substances.add(str(substance))
-        
-        return {
-            "user_id": user_id,
-            "total_people": len(all_people),
-            "total_places": len(all_places),
-            "total_events": len(all_events),
-            "total_substances": len(all_substances),
-            "unique_people": sorted(list(all_people)),
-            "unique_places": sorted(list(all_places)),
-            "unique_events": sorted(list(all_events)),
-            "unique_substances": sorted(list(all_substances)),
-            "total_sessions": len(sessions),
-            "created_at": wellness_data.get("created_at"),
-            "last_updated": wellness_data.get("last_updated")
-        }
+        # Unique names come from the reference-counted summary kept up to date on every write
+        entity_summary = get_user_entity_summary(user_id)
+        insights = {"user_id": user_id}
+        for category in ["people", "places", "events", "substances"]:
+            names = sorted(entity_summary.get(category, {}))
+            insights[f"total_{category}"] = len(names)
+            insights[f"unique_{category}"] = names
+        
+        created_at, last_updated = _insight_times(user_id, session_index)
+        insights.update({
+            "total_sessions": len(session_index),
+            "created_at": created_at,
+            "last_updated": last_updated
+        })
+        return insights
         
     except Exception as e:
         print(f"Error getting NER insights for user {user_id}: {e}")
@@ -1130,9 +1225,9 @@ def get_user_ner_insights(user_id: str = "default_user"):
 def get_detailed_user_ner_insights(user_id: str = "default_user"):
     """Get detailed entity information with all attributes for conversation insights"""
     try:
-        wellness_data = load_user_wellness_data(user_id)
+        session_index = get_user_session_index(user_id)
         
-        if not wellness_data or "sessions" not in wellness_data:
+        if not session_index:
             return {
                 "user_id": user_id,
                 "detailed_people": [],
@@ -1142,88 +1237,65 @@ def get_detailed_user_ner_insights(user_id: str = "default_user"):
                 "total_sessions": 0
             }
         
-        sessions = wellness_data["sessions"]
-        
-        # Collect detailed entities from all sessions
+        # One entry per entity from the mention index, with its first mention's details
         detailed_people = []
         detailed_places = []
         detailed_events = []
         detailed_substances = []
         
-        # Track unique entities to avoid duplicates
-        seen_people = set()
-        seen_places = set()
-        seen_events = set()
-        seen_substances = set()
-        
-        for session_id, session_data in sessions.items():
-            # Process people with full details
-            for person in session_data.get("people", []):
-                if isinstance(person, dict):
-                    name = person.get("name", "")
-                    if name and name not in seen_people:
-                        detailed_people.append({
-                            "name": name,
-                            "relationship": person.get("relationship", "Unknown"),
-                            "significance": person.get("significance", ""),
-                            "emotional_charge": person.get("emotional_charge", "neutral"),
-                            "timestamp": person.get("timestamp", ""),
-                            "session_id": session_id
-                        })
-                        seen_people.add(name)
-            
-            # Process places with full details
-            for place in session_data.get("places", []):
-                if isinstance(place, dict):
-                    location = place.get("location") or place.get("name") or place.get("place", "")
-                    if location and location not in seen_places:
-                        detailed_places.append({
-                            "location": location,
-                            "context": place.get("context", ""),
-                            "emotional_association": place.get("emotional_association", ""),
-                            "timestamp": place.get("timestamp", ""),
-                            "session_id": session_id
-                        })
-                        seen_places.add(location)
-            
-            # Process events with full details
-            for event in session_data.get("events", []):
-                if isinstance(event, dict):
-                    event_name = event.get("event") or event.get("name") or event.get("activity", "")
-                    if event_name and event_name not in seen_events:
-                        detailed_events.append({
-                            "event": event_name,
-                            "timeframe": event.get("timeframe", "Unknown"),
-                            "trauma_relevance": event.get("trauma_relevance", "low"),
-                            "description": event.get("description", ""),
-                            "timestamp": event.get("timestamp", ""),
-                            "session_id": session_id
-                        })
-                        seen_events.add(event_name)
+        entity_stats = get_entity_stats(user_id, ["people", "places", "events", "substances"], general_only=True)
+        entity_stats.sort(key=lambda stat: stat.get("first_mentioned") or "")
+        for stat in entity_stats:
+            entity = stat["entity"]
+            mention_details = {
+                "timestamp": stat.get("first_mentioned") or "",
+                "session_id": stat["session_id"],
+                "mention_count": stat["mentions"],
+                "session_count": stat["sessions"],
+                "last_mentioned": stat.get("last_mentioned") or ""
+            }
             
-            # Process substances with full details
-            for substance in session_data.get("substances", []):
-                if isinstance(substance, dict):
-                    substance_name = substance.get("substance") or substance.get("name", "")
-                    if substance_name and substance_name not in seen_substances:
-                        detailed_substances.append({
-                            "substance": substance_name,
-                            "usage_pattern": substance.get("usage_pattern", ""),
-                            "context": substance.get("context", ""),
-                            "timestamp": substance.get("timestamp", ""),
-                            "session_id": session_id
-                        })
-                        seen_substances.add(substance_name)
+            if stat["entity_type"] == "people":
+                detailed_people.append({
+                    "name": stat["name"],
+                    "relationship": entity.get("relationship", "Unknown"),
+                    "significance": entity.get("significance", ""),
+                    "emotional_charge": entity.get("emotional_charge", "neutral"),
+                    **mention_details
+                })
+            elif stat["entity_type"] == "places":
+                detailed_places.append({
+                    "location": stat["name"],
+                    "context": entity.get("context", ""),
+                    "emotional_association": entity.get("emotional_association", ""),
+                    **mention_details
+                })
+            elif stat["entity_type"] == "events":
+                detailed_events.append({
+                    "event": stat["name"],
+                    "timeframe": entity.get("timeframe", "Unknown"),
+                    "trauma_relevance": entity.get("trauma_relevance", "low"),
+                    "description": entity.get("description", ""),
+                    **mention_details
+                })
+            elif stat["entity_type"] == "substances":
+                detailed_substances.append({
+                    "substance": stat["name"],
+                    "usage_pattern": entity.get("usage_pattern", ""),
+                    "context": entity.get("context", ""),
+                    **mention_details
+                })
         
+        created_at, last_updated = _insight_times(user_id, session_index)
         return {
             "user_id": user_id,
             "detailed_people": detailed_people,
             "detailed_places": detailed_places,
             "detailed_events": detailed_events,
             "detailed_substances": detailed_substances,
-            "total_sessions": len(sessions),
-            "created_at": wellness_data.get("created_at"),
-            "last_updated": wellness_data.get("last_updated")
+            "total_sessions": len(session_index),
+            "created_at": created_at,
+            "last_updated": last_updated
         }
         
     except Exception as e:
@@ -1281,59 +1353,165 @@ def initialize_user_wellness_data(user_id: str):
     }
     save_user_wellness_data(wellness_data, user_id)
 
-def get_user_wellness_file(user_id: str = "default_user"):
-    """Get the wellness file path for a specific user"""
-    return os.path.join(WELLNESS_DATA_DIR, f"{user_id}_wellness.json")
-
 def get_user_ner_file(user_id: str = "default_user"):
     """Get the NER file path for a specific user (legacy compatibility)"""
-    return os.path.join(WELLNESS_DATA_DIR, f"{user_id}_wellness.json")
+    return get_user_wellness_file(user_id)
+
+def _save_user_file(data, file_path: str, existing_path: Optional[str]):
+    """Write a per-user JSON file to the configured layout, dropping any copy under another layout"""
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    write_json_atomic(file_path, data)
+    
+    if existing_path and os.path.abspath(existing_path) != os.path.abspath(file_path):
+        os.remove(existing_path)
 
 def save_user_wellness_data(wellness_data: dict, user_id: str = "default_user"):
     """Save wellness data for a specific user"""
-    file_path = get_user_wellness_file(user_id)
     wellness_data["last_updated"] = datetime.now().isoformat()
-    with open(file_path, "w", encoding="utf-8") as f:
-        json.dump(wellness_data, f, indent=4, ensure_ascii=False, default=str)
-
-def load_user_wellness_data(user_id: str = "default_user"):
-    """Load wellness data for a specific user"""
-    file_path = get_user_wellness_file(user_id)
-    if os.path.exists(file_path):
-        with open(file_path, "r", encoding="utf-8") as f:
-            return json.load(f)
+    _save_user_file(wellness_data, wellness_file_path(user_id), find_wellness_file(user_id))
     
-    # Create default structure if doesn't exist
+    # Keep the session index in step with the sessions just written
+    save_session_index(build_session_index(wellness_data.get("sessions", {})), user_id)
+
+# ===== SESSION INDEX =====
+# Compact per-session metadata (agent, times, counts) so listings and summaries
+# never have to load message bodies. SQL keeps it on the sessions table; in JSON
+# mode it is {user_id}_sessions.json next to the wellness file.
+
+def _session_index_entry(session_id: str, session_data: dict) -> dict:
+    """Summarize one JSON session for the session index"""
+    agent_entities = session_data.get("agent_specific_entities", {})
     return {
-        "user_id": user_id,
-        "created_at": datetime.now().isoformat(),
-        "last_updated": datetime.now().isoformat(),
-        "sessions": {},
-        "daily_logs": {},
-        "agent_preferences": {
-            "MENTAL_HEALTH": {"usage_count": 0, "satisfaction_rating": 0},
-            "DIET": {"usage_count": 0, "satisfaction_rating": 0},
-            "EXERCISE": {"usage_count": 0, "satisfaction_rating": 0}
-        },
-        "wellness_summary": {
-            "total_sessions": 0,
-            "total_mental_health_interactions": 0,
-            "total_diet_interactions": 0,
-            "total_exercise_interactions": 0,
-            "current_streak": 0,
-            "goal_progress": {
-                "weight_progress": 0,
-                "fitness_progress": 0,
-                "mental_health_progress": 0
-            }
-        }
+        "session_id": session_id,
+        "agent": session_data.get("agent"),
+        "created_at": session_data.get("created_at"),
+        "last_updated": session_data.get("last_updated") or session_data.get("created_at"),
+        "message_count": len(session_data.get("messages", [])) + session_data.get("archived_message_count", 0),
+        "entity_count": sum(len(session_data.get(category, [])) for category in ["people", "places", "events", "substances"]),
+        "agent_entity_count": sum(len(items) for entities in agent_entities.values() for items in entities.values()),
+        "archived": bool(session_data.get("archived_at"))
     }
 
+def build_session_index(sessions: dict) -> list:
+    """Build the session index for a user's JSON sessions, oldest first"""
+    entries = [_session_index_entry(session_id, session_data) for session_id, session_data in sessions.items()]
+    entries.sort(key=lambda entry: entry.get("created_at") or "")
+    return entries
+
+def save_session_index(entries: list, user_id: str = "default_user"):
+    """Save a user's JSON session index"""
+    _save_user_file({"user_id": user_id, "sessions": entries},
+                    session_index_path(user_id), find_session_index_file(user_id))
+
+def get_user_session_index(user_id: str = "default_user") -> list:
+    """Get a user's session index (agent, times and counts, no bodies), oldest first"""
+    if USE_SQL_FOR_CONVERSATIONS and SQL_AVAILABLE:
+        try:
+            return get_session_index_sql(user_id)
+        except Exception as e:
+            print(f"SQL error, falling back to JSON: {e}")
+    
+    # JSON fallback
+    index_file = find_session_index_file(user_id)
+    if index_file:
+        with open(index_file, "r", encoding="utf-8") as f:
+            return json.load(f).get("sessions", [])
+    
+    # Build the index once for wellness files written before it existed
+    if not find_wellness_file(user_id):
+        return []
+    entries = build_session_index(load_user_wellness_data(user_id).get("sessions", {}))
+    save_session_index(entries, user_id)
+    return entries
+
+# ===== THREAD REGISTRY =====
+# One entry per conversation thread (agent, created, last message, message count), kept on
+# the session index and written with every message. Thread lists and agent attribution read
+# it with one query instead of scanning checkpoints or probing graph state per thread.
+
+WELLNESS_AGENTS = ("MENTAL_HEALTH", "DIET", "EXERCISE")
+
+def _resolve_thread_agent(thread_id: str) -> str:
+    """Work out the agent of a thread registered without one"""
+    agent = agent_from_thread_id(thread_id)
+    if agent is None:
+        try:
+            state = get_chatbot().get_state(config={"configurable": {"thread_id": thread_id}})
+            if state.values and state.values.get("current_agent") in WELLNESS_AGENTS:
+                agent = state.values["current_agent"]
+        except Exception as e:
+            print(f"Error reading agent of thread {thread_id}: {e}")
+    # Threads without agent info (old formats, GENERAL state) belong to Mental Health, so each is probed only once
+    return agent or "MENTAL_HEALTH"
+
+def set_thread_agents(agents: dict, user_id: str = "default_user"):
+    """Record the agent of threads registered without one"""
+    if USE_SQL_FOR_CONVERSATIONS and SQL_AVAILABLE:
+        try:
+            result = set_thread_agents_sql(user_id, agents)
+            if result["success"]:
+                return result
+        except Exception as e:
+            print(f"SQL error, falling back to JSON: {e}")
+    
+    # JSON fallback
+    wellness_data = load_user_wellness_data(user_id)
+    for thread_id, agent in agents.items():
+        session = wellness_data["sessions"].get(thread_id)
+        if session is not None and not session.get("agent"):
+            session["agent"] = agent
+    save_user_wellness_data(wellness_data, user_id)
+    return {"success": True, "message": f"Recorded agents for {len(agents)} threads"}
+
+def get_user_thread_registry(user_id: str = "default_user") -> list:
+    """Get a user's threads (agent, created, last message, message count), oldest first"""
+    threads = None
+    if USE_SQL_FOR_CONVERSATIONS and SQL_AVAILABLE:
+        try:
+            threads = get_user_threads_sql(user_id)
+        except Exception as e:
+            print(f"SQL error, falling back to JSON: {e}")
+    
+    # JSON fallback
+    if threads is None:
+        threads = [
+            {
+                "thread_id": entry["session_id"],
+                "agent": entry.get("agent"),
+                "created_at": entry.get("created_at"),
+                "last_message_at": entry.get("last_updated"),
+                "message_count": entry.get("message_count", 0)
+            }
+            for entry in get_user_session_index(user_id)
+        ]
+    
+    # Threads written before agents were recorded are attributed once, then read like the rest
+    resolved = {}
+    for thread in threads:
+        if thread["agent"] not in WELLNESS_AGENTS:
+            thread["agent"] = resolved[thread["thread_id"]] = _resolve_thread_agent(thread["thread_id"])
+    if resolved:
+        set_thread_agents(resolved, user_id)
+    return threads
+
+def get_user_threads(user_id: str = "default_user", agent: Optional[str] = None) -> list:
+    """Get a user's thread IDs, oldest first, optionally only those of one agent"""
+    return [thread["thread_id"] for thread in get_user_thread_registry(user_id)
+            if agent is None or thread["agent"] == agent]
+
+def get_user_threads_by_agent(user_id: str = "default_user") -> dict:
+    """Get a user's thread IDs grouped by agent, oldest first, from a single registry read"""
+    threads_by_agent = {agent: [] for agent in WELLNESS_AGENTS}
+    for thread in get_user_thread_registry(user_id):
+        if thread["agent"] in threads_by_agent:
+            threads_by_agent[thread["agent"]].append(thread["thread_id"])
+    return threads_by_agent
+
 def route_message_to_agent(user_input: str) -> str:
     """Route user message to appropriate agent"""
     try:
         prompt = router_prompt.format(user_input=user_input)
-        response = router_model.invoke([HumanMessage(content=prompt)])
+        response = get_models()["router"].invoke([HumanMessage(content=prompt)])
         agent = response.content.strip().upper()
         
         # Validate agent response
@@ -1349,11 +1527,46 @@ def route_message_to_agent(user_input: str) -> str:
         print(f"Error in routing: {e}")
         return "MENTAL_HEALTH"  # Default fallback
 
+# ===== AGENT CONTEXT CACHE =====
+# The formatted profile context is rebuilt only when the user's profile version
+# changes (bumped by profile writes in this process) or users_data.json changes.
+
+SQL_CONTEXT_FIELDS = ['age', 'gender', 'height', 'current_weight', 'target_weight', 'activity_level', 'diet_type']
+
+_user_context_cache = {}
+_profile_versions = {}
+
+def invalidate_user_context(user_id: str):
+    """Bump a user's profile version so the next agent turn rebuilds their context"""
+    _profile_versions[user_id] = _profile_versions.get(user_id, 0) + 1
+    _user_context_cache.pop(user_id, None)
+
+def _get_profile_for_context(user_id: str) -> dict:
+    """Get a user's profile for agent context, filling gaps from the SQL profile when available"""
+    user_profile = get_user_record(user_id)
+    
+    if USE_SQL_FOR_STRUCTURED and SQL_AVAILABLE:
+        try:
+            sql_profile = get_user_profile_sql(user_id)
+            if sql_profile:
+                # Daily inputs and profile edits are written to the JSON record, so it wins when both have a value
+                for field in SQL_CONTEXT_FIELDS:
+                    if user_profile.get(field) in (None, "") and sql_profile.get(field) is not None:
+                        user_profile[field] = sql_profile[field]
+        except Exception as e:
+            print(f"SQL error, falling back to JSON: {e}")
+    
+    return user_profile
+
 def get_user_context_for_agent(user_id: str, agent_type: str) -> str:
     """Get formatted user context for agent prompts"""
     try:
-        users_data = load_users_data()
-        user_profile = users_data.get(user_id, {})
+        version = (_profile_versions.get(user_id, 0), _get_user_directory()["signature"])
+        cached = _user_context_cache.get(user_id)
+        if cached and cached[0] == version:
+            return cached[1]
+        
+        user_profile = _get_profile_for_context(user_id)
         
         if not user_profile:
             return "User Profile: No profile information available."
@@ -1372,14 +1585,275 @@ def get_user_context_for_agent(user_id: str, agent_type: str) -> str:
 - Workout Preference: {user_profile.get('workout_duration_preference', 'N/A')} minutes
 
 """
+        _user_context_cache[user_id] = (version, context)
         return context
         
     except Exception as e:
         print(f"Error getting user context: {e}")
         return "User Profile: Error loading profile information."
 
+def _load_sql_sessions(user_id: str, include_messages: bool = True) -> dict:
+    """Assemble a user's sessions from the SQL conversation store in the JSON session layout"""
+    sessions = {}
+    for row in get_conversation_sessions_sql(user_id):
+        session = {
+            "session_id": row["session_id"],
+            "created_at": row.get("start_time") or row.get("created_at"),
+            "last_updated": row.get("end_time") or row.get("start_time"),
+            "people": [],
+            "places": [],
+            "events": [],
+            "substances": [],
+            "messages": [],
+            "agent_specific_entities": {}
+        }
+        if row.get("agent_type"):
+            session["agent"] = row["agent_type"]
+        sessions[row["session_id"]] = session
+    
+    for entity_row in get_session_entities_sql(user_id):
+        session = sessions.get(entity_row["session_id"])
+        if session is not None:
+            session.setdefault(entity_row["entity_type"], []).append(entity_row["entity"])
+    
+    for entity_row in get_agent_entities_sql(user_id):
+        session = sessions.get(entity_row["session_id"])
+        if session is not None:
+            agent_entities = session["agent_specific_entities"].setdefault(entity_row["agent"], {})
+            agent_entities.setdefault(entity_row["entity_type"], []).append(entity_row["entity"])
+    
+    if include_messages:
+        for session_id, session in sessions.items():
+            session["messages"] = get_session_messages_sql(user_id, session_id)
+    
+    return sessions
+
+def load_user_sessions(user_id: str = "default_user", include_messages: bool = True) -> dict:
+    """Load a user's conversation sessions from the active conversation store"""
+    if USE_SQL_FOR_CONVERSATIONS and SQL_AVAILABLE:
+        try:
+            return _load_sql_sessions(user_id, include_messages)
+        except Exception as e:
+            print(f"SQL error, falling back to JSON: {e}")
+    
+    # JSON fallback
+    return load_user_wellness_data(user_id).get("sessions", {})
+
+def _insight_times(user_id: str, session_index: list):
+    """Creation and last update times reported by insights"""
+    if USE_SQL_FOR_CONVERSATIONS and SQL_AVAILABLE:
+        created = [entry["created_at"] for entry in session_index if entry.get("created_at")]
+        updated = [entry["last_updated"] for entry in session_index if entry.get("last_updated")]
+        return (min(created) if created else None), (max(updated) if updated else None)
+    
+    wellness_data = load_user_wellness_data(user_id)
+    return wellness_data.get("created_at"), wellness_data.get("last_updated")
+
+def build_ner_summary(sessions: dict) -> dict:
+    """Count how many session entities mention each name, by category"""
+    ner_summary = {category: {} for category in ["people", "places", "events", "substances"]}
+    for session_data in sessions.values():
+        adjust_ner_summary(ner_summary, [
+            (category, entity) for category in ner_summary for entity in session_data.get(category, [])
+        ], 1)
+    return ner_summary
+
+def adjust_ner_summary(ner_summary: dict, entities: list, delta: int):
+    """Add delta to the reference count of each (category, entity) name, dropping names that reach zero"""
+    for category, entity in entities:
+        name = entity_name(category, entity)
+        if not name:
+            continue
+        counts = ner_summary.setdefault(category, {})
+        counts[name] = counts.get(name, 0) + delta
+        if counts[name] <= 0:
+            del counts[name]
+
+def _get_ner_summary(wellness_data: dict) -> dict:
+    """Get the maintained NER summary of a wellness document, building it once for older files"""
+    if "ner_summary" not in wellness_data:
+        wellness_data["ner_summary"] = build_ner_summary(wellness_data.get("sessions", {}))
+    return wellness_data["ner_summary"]
+
+def get_user_entity_summary(user_id: str = "default_user") -> dict:
+    """Get a user's unique entity names with their reference counts, by category"""
+    if USE_SQL_FOR_CONVERSATIONS and SQL_AVAILABLE:
+        try:
+            return get_entity_summary_sql(user_id)
+        except Exception as e:
+            print(f"SQL error, falling back to JSON: {e}")
+    
+    # JSON fallback
+    wellness_data = load_user_wellness_data(user_id)
+    if "ner_summary" not in wellness_data and find_wellness_file(user_id):
+        _get_ner_summary(wellness_data)
+        save_user_wellness_data(wellness_data, user_id)
+    return _get_ner_summary(wellness_data)
+
+def _session_entity_mentions(session_data: dict) -> list:
+    """List the (agent, entity_type, entity, timestamp) mentions stored in a session"""
+    mentions = [
+        (None, category, entity, entity.get("timestamp"))
+        for category in ["people", "places", "events", "substances"]
+        for entity in session_data.get(category, [])
+        if isinstance(entity, dict)
+    ]
+    for agent, agent_entities in session_data.get("agent_specific_entities", {}).items():
+        mentions.extend(
+            (agent, entity_type, entity, entity.get("timestamp"))
+            for entity_type, entities in agent_entities.items()
+            for entity in entities
+            if isinstance(entity, dict)
+        )
+    return mentions
+
+def build_entity_index(sessions: dict) -> dict:
+    """Build the inverted index of entity mentions and co-occurrence counts from stored sessions"""
+    entity_index = {"mentions": {}, "sessions": {}, "cooccurrence": {}}
+    for session_id, session_data in sessions.items():
+        record_entity_mentions(entity_index, session_id, _session_entity_mentions(session_data))
+    return entity_index
+
+def _adjust_cooccurrence(cooccurrence: dict, key: str, other_key: str, delta: int):
+    """Add delta to the session count of an entity pair, in both directions"""
+    for entity_key, related_key in ((key, other_key), (other_key, key)):
+        related = cooccurrence.setdefault(entity_key, {})
+        related[related_key] = related.get(related_key, 0) + delta
+        if related[related_key] <= 0:
+            del related[related_key]
+        if not related:
+            del cooccurrence[entity_key]
+
+def record_entity_mentions(entity_index: dict, session_id: str, mentions: list):
+    """Add (agent, entity_type, entity, timestamp) mentions to an entity index, pairing new entities with the session's others"""
+    session_keys = entity_index["sessions"].setdefault(session_id, [])
+    for agent, entity_type, entity, timestamp in mentions:
+        key = entity_index_key(entity_type, entity)
+        if not key:
+            continue
+        entity_index["mentions"].setdefault(key, []).append({
+            "session_id": session_id,
+            "agent": agent,
+            "attribute": entity_attribute(entity_type, entity),
+            "timestamp": timestamp,
+            "entity": {k: v for k, v in entity.items() if k != "timestamp"}
+        })
+        # Co-occurrence counts sessions, so only an entity's first mention in a session adds pairs
+        if key not in session_keys:
+            for other_key in session_keys:
+                _adjust_cooccurrence(entity_index["cooccurrence"], key, other_key, 1)
+            session_keys.append(key)
+    if not session_keys:
+        del entity_index["sessions"][session_id]
+
+def forget_session_mentions(entity_index: dict, session_id: str):
+    """Remove a session's mentions and pairs from an entity index"""
+    session_keys = entity_index["sessions"].pop(session_id, [])
+    for i, key in enumerate(session_keys):
+        for other_key in session_keys[i + 1:]:
+            _adjust_cooccurrence(entity_index["cooccurrence"], key, other_key, -1)
+    for key in session_keys:
+        remaining = [mention for mention in entity_index["mentions"].get(key, []) if mention["session_id"] != session_id]
+        if remaining:
+            entity_index["mentions"][key] = remaining
+        else:
+            entity_index["mentions"].pop(key, None)
+
+def _get_entity_index(wellness_data: dict) -> dict:
+    """Get the maintained entity index of a wellness document, building it once for older files"""
+    if "entity_index" not in wellness_data:
+        wellness_data["entity_index"] = build_entity_index(wellness_data.get("sessions", {}))
+    return wellness_data["entity_index"]
+
+def _load_user_entity_index(user_id: str) -> dict:
+    """Load a user's JSON entity index, saving it the first time it is built"""
+    wellness_data = load_user_wellness_data(user_id)
+    if "entity_index" not in wellness_data and find_wellness_file(user_id):
+        _get_entity_index(wellness_data)
+        save_user_wellness_data(wellness_data, user_id)
+    return _get_entity_index(wellness_data)
+
+def get_entity_stats(user_id: str, entity_types: Optional[list] = None, attribute: Optional[str] = None,
+                     agent: Optional[str] = None, general_only: bool = False, limit: Optional[int] = None) -> list:
+    """Get mention counts and first/last mentions of a user's entities, most mentioned first"""
+    if USE_SQL_FOR_CONVERSATIONS and SQL_AVAILABLE:
+        try:
+            return get_entity_stats_sql(user_id, entity_types, attribute, agent, general_only, limit)
+        except Exception as e:
+            print(f"SQL error, falling back to JSON: {e}")
+    
+    # JSON fallback
+    results = []
+    for key, mentions in _load_user_entity_index(user_id)["mentions"].items():
+        entity_type = key.split(":", 1)[0]
+        if entity_types and entity_type not in entity_types:
+            continue
+        mentions = [
+            mention for mention in mentions
+            if (not attribute or mention["attribute"] == attribute)
+            and (not agent or mention["agent"] == agent)
+            and (not general_only or mention["agent"] is None)
+        ]
+        if not mentions:
+            continue
+        
+        timestamps = [mention["timestamp"] for mention in mentions if mention["timestamp"]]
+        results.append({
+            "entity_type": entity_type,
+            "name": entity_name(entity_type, mentions[0]["entity"]) or key.split(":", 1)[1],
+            "key": key,
+            "mentions": len(mentions),
+            "sessions": len({mention["session_id"] for mention in mentions}),
+            "first_mentioned": mentions[0]["timestamp"],
+            "last_mentioned": max(timestamps) if timestamps else None,
+            "session_id": mentions[0]["session_id"],
+            "entity": mentions[0]["entity"]
+        })
+    
+    results.sort(key=lambda stat: (stat["mentions"], stat["last_mentioned"] or ""), reverse=True)
+    return results[:limit] if limit else results
+
+def get_entity_mentions(user_id: str, entity_type: str, name: str, limit: int = 50) -> list:
+    """Get the mentions of one entity across sessions, newest first"""
+    if USE_SQL_FOR_CONVERSATIONS and SQL_AVAILABLE:
+        try:
+            return get_entity_mentions_sql(user_id, entity_type, name, limit)
+        except Exception as e:
+            print(f"SQL error, falling back to JSON: {e}")
+    
+    # JSON fallback
+    mentions = _load_user_entity_index(user_id)["mentions"].get(f"{entity_type}:{canonical_entity_name(name)}", [])
+    return sorted(mentions, key=lambda mention: mention["timestamp"] or "", reverse=True)[:limit]
+
+def get_cooccurring_entities(user_id: str, entity_type: str, name: str, related_type: Optional[str] = None,
+                             limit: int = 10) -> list:
+    """Get the entities mentioned in the most sessions together with one entity,
+    e.g. the people who come up most alongside ("conditions", "stress")"""
+    if USE_SQL_FOR_CONVERSATIONS and SQL_AVAILABLE:
+        try:
+            return get_cooccurring_entities_sql(user_id, entity_type, name, related_type, limit)
+        except Exception as e:
+            print(f"SQL error, falling back to JSON: {e}")
+    
+    # JSON fallback
+    related = _load_user_entity_index(user_id)["cooccurrence"].get(f"{entity_type}:{canonical_entity_name(name)}", {})
+    results = []
+    for related_key, session_count in sorted(related.items(), key=lambda item: (-item[1], item[0])):
+        related_entity_type, related_name = related_key.split(":", 1)
+        if related_type and related_entity_type != related_type:
+            continue
+        results.append({"entity_type": related_entity_type, "name": related_name, "sessions": session_count})
+    return results[:limit]
+
 def load_user_ner_data(user_id: str = "default_user"):
     """Load NER data for a specific user - Updated for wellness data"""
+    ner_data = _load_json_ner_data(user_id)
+    if USE_SQL_FOR_CONVERSATIONS and SQL_AVAILABLE:
+        ner_data["sessions"] = load_user_sessions(user_id)
+    return ner_data
+
+def _load_json_ner_data(user_id: str = "default_user"):
+    """Load NER data for a specific user from the wellness JSON file"""
     # For backward compatibility, return wellness data in NER format
     wellness_data = load_user_wellness_data(user_id)
     user_info = get_user_info(user_id)
@@ -1392,17 +1866,10 @@ def load_user_ner_data(user_id: str = "default_user"):
         "created_at": wellness_data.get("created_at", datetime.now().isoformat()),
         "last_updated": wellness_data.get("last_updated", datetime.now().isoformat()),
         "sessions": wellness_data.get("sessions", {}),
-        "summary": {
-            "total_people": 0,
-            "total_places": 0,
-            "total_events": 0,
-            "total_substances": 0,
-            "unique_people": [],
-            "unique_places": [],
-            "unique_events": [],
-            "unique_substances": []
-        }
+        "ner_summary": _get_ner_summary(wellness_data),
+        "entity_index": _get_entity_index(wellness_data)
     }
+    update_user_ner_summary(ner_compatible_data)
     
     return ner_compatible_data
 
@@ -1414,41 +1881,46 @@ def save_user_ner_data(user_data, user_id: str = "default_user"):
     # Update sessions if they exist in user_data
     if "sessions" in user_data:
         wellness_data["sessions"] = user_data["sessions"]
+    if "ner_summary" in user_data:
+        wellness_data["ner_summary"] = user_data["ner_summary"]
+    if "entity_index" in user_data:
+        wellness_data["entity_index"] = user_data["entity_index"]
     
     wellness_data["last_updated"] = datetime.now().isoformat()
     save_user_wellness_data(wellness_data, user_id)
 
 def update_user_ner_summary(user_data):
-    """Update the summary statistics for the user"""
-    total_people = set()
-    total_places = set()
-    total_events = set()
-    total_substances = set()
-    
-    for session_data in user_data["sessions"].values():
-        for person in session_data.get("people", []):
-            total_people.add(person.get("name", ""))
-        for place in session_data.get("places", []):
-            total_places.add(place.get("location", ""))
-        for event in session_data.get("events", []):
-            total_events.add(event.get("event", ""))
-        for substance in session_data.get("substances", []):
-            total_substances.add(substance.get("substance", ""))
-    
-    user_data["summary"] = {
-        "total_people": len(total_people),
-        "total_places": len(total_places),
-        "total_events": len(total_events),
-        "total_substances": len(total_substances),
-        "unique_people": list(total_people),
-        "unique_places": list(total_places),
-        "unique_events": list(total_events),
-        "unique_substances": list(total_substances)
-    }
+    """Update the summary statistics for the user from the maintained reference counts"""
+    ner_summary = user_data.get("ner_summary")
+    if ner_summary is None:
+        ner_summary = user_data["ner_summary"] = build_ner_summary(user_data.get("sessions", {}))
+    
+    summary = {}
+    for category in ["people", "places", "events", "substances"]:
+        names = list(ner_summary.get(category, {}))
+        summary[f"total_{category}"] = len(names)
+        summary[f"unique_{category}"] = names
+    user_data["summary"] = summary
 
 def add_ner_to_user_session(ner_result, session_id: str, timestamp: datetime, user_id: str = "default_user"):
     """Add NER results to a specific user's session with timestamp"""
-    user_data = load_user_ner_data(user_id)
+    if hasattr(ner_result, 'dict'):
+        ner_dict = ner_result.dict()
+    else:
+        ner_dict = ner_result
+    
+    if USE_SQL_FOR_CONVERSATIONS and SQL_AVAILABLE:
+        try:
+            entities = {category: [dict(item) for item in ner_dict.get(category, [])]
+                        for category in ["people", "places", "events", "substances"]}
+            result = add_session_entities_sql(user_id, session_id, entities, timestamp)
+            if result["success"]:
+                return result
+        except Exception as e:
+            print(f"SQL error, falling back to JSON: {e}")
+    
+    # JSON fallback
+    user_data = _load_json_ner_data(user_id)
     
     if session_id not in user_data["sessions"]:
         user_data["sessions"][session_id] = {
@@ -1465,35 +1937,97 @@ def add_ner_to_user_session(ner_result, session_id: str, timestamp: datetime, us
     session_data = user_data["sessions"][session_id]
     session_data["last_updated"] = datetime.now().isoformat()
     
-    if hasattr(ner_result, 'dict'):
-        ner_dict = ner_result.dict()
-    else:
-        ner_dict = ner_result
-    
     timestamp_str = timestamp.isoformat()
     
-    # Add entities with timestamps
+    # Add entities with timestamps, skipping ones already in the session
     for category in ["people", "places", "events", "substances"]:
-        existing_items = {json.dumps({k: v for k, v in item.items() if k != 'timestamp'}, sort_keys=True) 
-                         for item in session_data[category]}
-        
-        for item in ner_dict.get(category, []):
-            item_with_timestamp = dict(item)
-            item_with_timestamp['timestamp'] = timestamp_str
-            
-            item_str = json.dumps({k: v for k, v in item.items() if k != 'timestamp'}, sort_keys=True, default=str)
-            if item_str not in existing_items:
-                session_data[category].append(item_with_timestamp)
-                existing_items.add(item_str)
+        added = _add_unique_entities(session_data, category, session_data[category], ner_dict.get(category, []), timestamp_str)
+        adjust_ner_summary(user_data["ner_summary"], [(category, entity) for entity in added], 1)
+        record_entity_mentions(user_data["entity_index"], session_id,
+                               [(None, category, entity, timestamp_str) for entity in added])
 
     update_user_ner_summary(user_data)
     save_user_ner_data(user_data, user_id)
     
     return user_data
 
-def add_message_to_session(session_id: str, message_content: str, message_type: str, timestamp: datetime, user_id: str = "default_user"):
-    """Add a message to the session conversation history"""
-    user_data = load_user_ner_data(user_id)
+def _add_unique_entities(session_data: dict, index_key: str, target: list, items: list, timestamp_str: str) -> list:
+    """Append entities to a session list unless their fingerprint is already recorded, returning the new ones"""
+    fingerprints = session_data.setdefault("entity_fingerprints", {})
+    if index_key not in fingerprints:
+        # Sessions saved before fingerprints existed get theirs built once
+        fingerprints[index_key] = [entity_fingerprint(entity) for entity in target if isinstance(entity, dict)]
+    known = set(fingerprints[index_key])
+    
+    added = []
+    for item in items:
+        fingerprint = entity_fingerprint(item)
+        if fingerprint in known:
+            continue
+        entity = dict(item)
+        entity['timestamp'] = timestamp_str
+        target.append(entity)
+        fingerprints[index_key].append(fingerprint)
+        known.add(fingerprint)
+        added.append(entity)
+    return added
+
+def dedupe_json_entities(user_id: str) -> int:
+    """Remove duplicate NER entities from a user's JSON sessions and rebuild their fingerprints"""
+    if not find_wellness_file(user_id):
+        return 0
+    
+    wellness_data = load_user_wellness_data(user_id)
+    removed = 0
+    for session_data in wellness_data.get("sessions", {}).values():
+        entity_lists = [(category, session_data.get(category, [])) for category in ["people", "places", "events", "substances"]]
+        for agent, agent_entities in session_data.get("agent_specific_entities", {}).items():
+            entity_lists.extend((f"{agent}/{entity_type}", entities) for entity_type, entities in agent_entities.items())
+        
+        fingerprints = {}
+        for index_key, entities in entity_lists:
+            unique_entities = []
+            seen = set()
+            fingerprints[index_key] = []
+            for entity in entities:
+                fingerprint = entity_fingerprint(entity) if isinstance(entity, dict) else None
+                if fingerprint is not None and fingerprint in seen:
+                    removed += 1
+                    continue
+                unique_entities.append(entity)
+                if fingerprint is not None:
+                    seen.add(fingerprint)
+                    fingerprints[index_key].append(fingerprint)
+            entities[:] = unique_entities
+        session_data["entity_fingerprints"] = fingerprints
+    
+    wellness_data["ner_summary"] = build_ner_summary(wellness_data.get("sessions", {}))
+    wellness_data["entity_index"] = build_entity_index(wellness_data.get("sessions", {}))
+    save_user_wellness_data(wellness_data, user_id)
+    return removed
+
+def add_message_to_session(session_id: str, message_content: str, message_type: str, timestamp: datetime,
+                           user_id: str = "default_user", agent: Optional[str] = None):
+    """Add a message to the session conversation history, registering the thread's agent"""
+    agent = agent_from_thread_id(session_id) or agent
+    if USE_SQL_FOR_CONVERSATIONS and SQL_AVAILABLE:
+        try:
+            result = add_message_sql({
+                "user_id": user_id,
+                "session_id": session_id,
+                "message_type": message_type,
+                "content": message_content,
+                "timestamp": timestamp,
+                "agent_type": agent
+            })
+            if result["success"]:
+                update_user_last_active(user_id)
+                return result
+        except Exception as e:
+            print(f"SQL error, falling back to JSON: {e}")
+    
+    # JSON fallback
+    user_data = _load_json_ner_data(user_id)
     
     if session_id not in user_data["sessions"]:
         user_data["sessions"][session_id] = {
@@ -1506,6 +2040,8 @@ def add_message_to_session(session_id: str, message_content: str, message_type:
             "substances": [],
             "messages": []
         }
+    if agent and not user_data["sessions"][session_id].get("agent"):
+        user_data["sessions"][session_id]["agent"] = agent
     
     # Add message to session
     user_data["sessions"][session_id]["messages"].append({
@@ -1524,17 +2060,113 @@ def add_message_to_session(session_id: str, message_content: str, message_type:
 
 def get_session_conversation(session_id: str, user_id: str = "default_user"):
     """Get conversation messages for a specific session"""
-    user_data = load_user_ner_data(user_id)
+    if USE_SQL_FOR_CONVERSATIONS and SQL_AVAILABLE:
+        try:
+            return get_session_messages_sql(user_id, session_id)
+        except Exception as e:
+            print(f"SQL error, falling back to JSON: {e}")
+    
+    # JSON fallback
+    user_data = _load_json_ner_data(user_id)
     
     if session_id in user_data["sessions"]:
-        return user_data["sessions"][session_id].get("messages", [])
+        session_data = user_data["sessions"][session_id]
+        messages = session_data.get("messages", [])
+        if session_data.get("archived_at"):
+            # Rehydrate archived messages on demand; new messages keep landing inline
+            messages = read_session_archive(session_archive_path(user_id, session_id)) + messages
+        return messages
     return []
 
+def search_user_conversations(user_id: str, query: str, limit: int = 20) -> list:
+    """Search a user's messages and extracted entities, returning ranked snippets with their session_id"""
+    if not search_tokens(query):
+        return []
+    
+    if USE_SQL_FOR_CONVERSATIONS and SQL_AVAILABLE:
+        try:
+            return search_conversations_sql(user_id, query, limit)
+        except Exception as e:
+            print(f"SQL error, falling back to JSON: {e}")
+    
+    # JSON fallback: scan the user's sessions, including archived messages
+    query_tokens = search_tokens(query)
+    results = []
+    
+    def add_result(session_id, source, text, timestamp):
+        score = match_score(text, query_tokens)
+        if score:
+            results.append({
+                "session_id": session_id,
+                "source": source,
+                "snippet": make_snippet(text, query_tokens),
+                "timestamp": timestamp,
+                "score": score
+            })
+    
+    for session_id, session_data in load_user_wellness_data(user_id).get("sessions", {}).items():
+        messages = session_data.get("messages", [])
+        if session_data.get("archived_message_count"):
+            messages = read_session_archive(session_archive_path(user_id, session_id)) + messages
+        for message in messages:
+            add_result(session_id, "message", message.get("content", ""), message.get("timestamp"))
+        
+        for category in ["people", "places", "events", "substances"]:
+            for entity in session_data.get(category, []):
+                add_result(session_id, category, entity_search_text(entity), entity.get("timestamp") if isinstance(entity, dict) else None)
+        for agent_entities in session_data.get("agent_specific_entities", {}).values():
+            for entity_type, entities in agent_entities.items():
+                for entity in entities:
+                    add_result(session_id, entity_type, entity_search_text(entity), entity.get("timestamp") if isinstance(entity, dict) else None)
+    
+    return rank_results(results, limit)
+
+def archive_idle_sessions(user_id: str, idle_days: int = ARCHIVE_AFTER_DAYS) -> dict:
+    """Move messages of sessions idle longer than idle_days out of the hot store"""
+    cutoff = (datetime.now() - timedelta(days=idle_days)).isoformat()
+    
+    if USE_SQL_FOR_CONVERSATIONS and SQL_AVAILABLE:
+        try:
+            archived_sessions = archived_messages = 0
+            for row in get_idle_sessions_sql(cutoff, user_id):
+                result = archive_session_sql(user_id, row["session_id"])
+                if result["success"] and result["archived"]:
+                    archived_sessions += 1
+                    archived_messages += result["archived"]
+            return {"success": True, "sessions": archived_sessions, "messages": archived_messages}
+        except Exception as e:
+            print(f"SQL error, falling back to JSON: {e}")
+    
+    # JSON fallback
+    if not find_wellness_file(user_id):
+        return {"success": True, "sessions": 0, "messages": 0}
+    
+    wellness_data = load_user_wellness_data(user_id)
+    archived_sessions = archived_messages = 0
+    for session_id, session_data in wellness_data.get("sessions", {}).items():
+        messages = session_data.get("messages", [])
+        last_activity = session_data.get("last_updated") or session_data.get("created_at") or ""
+        if not messages or last_activity >= cutoff:
+            continue
+        
+        archive_path = session_archive_path(user_id, session_id)
+        write_session_archive(archive_path, read_session_archive(archive_path) + messages)
+        session_data["archived_message_count"] = session_data.get("archived_message_count", 0) + len(messages)
+        session_data["archived_at"] = datetime.now().isoformat()
+        session_data["messages"] = []
+        archived_sessions += 1
+        archived_messages += len(messages)
+    
+    if archived_sessions:
+        save_user_wellness_data(wellness_data, user_id)
+    
+    return {"success": True, "sessions": archived_sessions, "messages": archived_messages}
+
 def get_messages_with_timestamps_from_state(thread_id: str):
     """Extract messages with timestamps from SQLite state"""
     try:
         # Get the state from checkpointer
-        state = chatbot.get_state(config={"configurable": {"thread_id": thread_id}})
+        state = get_chatbot().get_state(config={"configurable": {"thread_id": thread_id}})
         messages = state.values.get('messages', [])
         timestamps = state.values.get('time_stamps', [])
         
@@ -1584,7 +2216,7 @@ def ner_node(state: State):
         ner_result = extract_exercise_entities(msg)
     else:
         # Fallback to general NER
-        structured_model = model.with_structured_output(NamedEntity)
+        structured_model = get_models()["chat"].with_structured_output(NamedEntity)
         msg_prompt = f"""Extract all named entities from this Message: {msg}"""
         ner_result = structured_model.invoke([
             SystemMessage(content=ner_prompt),
@@ -1593,7 +2225,7 @@ def ner_node(state: State):
     
     try:
         add_agent_specific_ner_to_session(ner_result, session_id, timestamp, current_user, current_agent)
-        add_message_to_session(session_id, msg, "user", timestamp, current_user)
+        add_message_to_session(session_id, msg, "user", timestamp, current_user, current_agent)
         print(f"Agent-specific NER data saved for user {current_user}, agent {current_agent}, session {session_id}")
     except Exception as e:
         print(f"Error saving agent-specific NER data: {e}")
@@ -1602,7 +2234,7 @@ def ner_node(state: State):
 
 def extract_mental_health_entities(message: str) -> MentalHealthEntities:
     """Extract mental health specific entities"""
-    structured_model = model.with_structured_output(MentalHealthEntities)
+    structured_model = get_models()["chat"].with_structured_output(MentalHealthEntities)
     msg_prompt = f"""Extract mental health entities from this message: {message}"""
     
     return structured_model.invoke([
@@ -1612,7 +2244,7 @@ def extract_mental_health_entities(message: str) -> MentalHealthEntities:
 
 def extract_diet_entities(message: str) -> DietEntities:
     """Extract diet and nutrition specific entities"""
-    structured_model = model.with_structured_output(DietEntities)
+    structured_model = get_models()["chat"].with_structured_output(DietEntities)
     msg_prompt = f"""Extract diet and nutrition entities from this message: {message}"""
     
     return structured_model.invoke([
@@ -1622,7 +2254,7 @@ def extract_diet_entities(message: str) -> DietEntities:
 
 def extract_exercise_entities(message: str) -> ExerciseEntities:
     """Extract exercise and fitness specific entities"""
-    structured_model = model.with_structured_output(ExerciseEntities)
+    structured_model = get_models()["chat"].with_structured_output(ExerciseEntities)
     msg_prompt = f"""Extract exercise and fitness entities from this message: {message}"""
     
     return structured_model.invoke([
@@ -1630,8 +2262,36 @@ def extract_exercise_entities(message: str) -> ExerciseEntities:
         HumanMessage(content=msg_prompt)
     ])
 
+def _collect_agent_entities(ner_result) -> dict:
+    """Group agent-specific NER results by entity type as plain dictionaries"""
+    if isinstance(ner_result, MentalHealthEntities):
+        entity_types = ["people", "conditions", "coping_strategies", "emotional_states", "therapeutic_goals"]
+    elif isinstance(ner_result, DietEntities):
+        entity_types = ["food_items", "nutritional_goals", "eating_patterns", "dietary_restrictions", "meal_plans", "body_responses"]
+    elif isinstance(ner_result, ExerciseEntities):
+        entity_types = ["activities", "fitness_goals", "physical_limitations", "workout_preferences", "physical_responses", "fitness_environments", "performance_metrics"]
+    else:
+        return {}
+    
+    return {
+        entity_type: [entity.dict() if hasattr(entity, 'dict') else dict(entity)
+                      for entity in getattr(ner_result, entity_type, [])]
+        for entity_type in entity_types
+    }
+
 def add_agent_specific_ner_to_session(ner_result, session_id: str, timestamp: datetime, user_id: str, agent: str):
     """Add agent-specific NER results to user session"""
+    agent_entities = _collect_agent_entities(ner_result)
+    
+    if USE_SQL_FOR_CONVERSATIONS and SQL_AVAILABLE:
+        try:
+            result = add_agent_entities_sql(user_id, session_id, agent, agent_entities, timestamp)
+            if result["success"]:
+                return result
+        except Exception as e:
+            print(f"SQL error, falling back to JSON: {e}")
+    
+    # JSON fallback
     wellness_data = load_user_wellness_data(user_id)
     
     if session_id not in wellness_data["sessions"]:
@@ -1656,42 +2316,17 @@ def add_agent_specific_ner_to_session(ner_result, session_id: str, timestamp: da
         session_data["agent_specific_entities"][agent] = {}
     
     timestamp_str = timestamp.isoformat()
+    # Built before adding, so an older file's lazily built index doesn't already count the new entities
+    entity_index = _get_entity_index(wellness_data)
     
-    if isinstance(ner_result, MentalHealthEntities):
-        # Add mental health entities
-        for entity_type in ["people", "conditions", "coping_strategies", "emotional_states", "therapeutic_goals"]:
-            if entity_type not in session_data["agent_specific_entities"][agent]:
-                session_data["agent_specific_entities"][agent][entity_type] = []
-            
-            entities = getattr(ner_result, entity_type, [])
-            for entity in entities:
-                entity_dict = entity.dict() if hasattr(entity, 'dict') else dict(entity)
-                entity_dict['timestamp'] = timestamp_str
-                session_data["agent_specific_entities"][agent][entity_type].append(entity_dict)
-    
-    elif isinstance(ner_result, DietEntities):
-        # Add diet entities
-        for entity_type in ["food_items", "nutritional_goals", "eating_patterns", "dietary_restrictions", "meal_plans", "body_responses"]:
-            if entity_type not in session_data["agent_specific_entities"][agent]:
-                session_data["agent_specific_entities"][agent][entity_type] = []
-            
-            entities = getattr(ner_result, entity_type, [])
-            for entity in entities:
-                entity_dict = entity.dict() if hasattr(entity, 'dict') else dict(entity)
-                entity_dict['timestamp'] = timestamp_str
-                session_data["agent_specific_entities"][agent][entity_type].append(entity_dict)
-    
-    elif isinstance(ner_result, ExerciseEntities):
-        # Add exercise entities
-        for entity_type in ["activities", "fitness_goals", "physical_limitations", "workout_preferences", "physical_responses", "fitness_environments", "performance_metrics"]:
-            if entity_type not in session_data["agent_specific_entities"][agent]:
-                session_data["agent_specific_entities"][agent][entity_type] = []
-            
-            entities = getattr(ner_result, entity_type, [])
-            for entity in entities:
-                entity_dict = entity.dict() if hasattr(entity, 'dict') else dict(entity)
-                entity_dict['timestamp'] = timestamp_str
-                session_data["agent_specific_entities"][agent][entity_type].append(entity_dict)
+    for entity_type, entities in agent_entities.items():
+        if entity_type not in session_data["agent_specific_entities"][agent]:
+            session_data["agent_specific_entities"][agent][entity_type] = []
+        
+        added = _add_unique_entities(session_data, f"{agent}/{entity_type}",
+                                     session_data["agent_specific_entities"][agent][entity_type], entities, timestamp_str)
+        record_entity_mentions(entity_index, session_id,
+                               [(agent, entity_type, entity, timestamp_str) for entity in added])
     
     save_user_wellness_data(wellness_data, user_id)
     return wellness_data
@@ -1738,15 +2373,16 @@ def generate_routine_plan(user_id: str, plan_type: str, user_input: str = "") ->
     else:
         prompt = mental_health_routine_prompt  # Default
     
-    structured_model = model.with_structured_output(RoutinePlan)
+    structured_model = get_models()["chat"].with_structured_output(RoutinePlan)
     
     routine_plan = structured_model.invoke([
         SystemMessage(content=prompt),
         HumanMessage(content=context_prompt)
     ])
     
-    # Set user ID and plan type
+    # Set user ID, plan ID and plan type
     routine_plan.user_id = user_id
+    routine_plan.plan_id = new_plan_id()
     routine_plan.plan_type = plan_type.lower()
     
     # Save routine plan
@@ -1762,8 +2398,9 @@ def save_routine_plan(routine_plan: RoutinePlan):
     if "routine_plans" not in wellness_data:
         wellness_data["routine_plans"] = {}
     
-    plan_key = f"{routine_plan.plan_type}_{routine_plan.created_date.isoformat()}"
-    wellness_data["routine_plans"][plan_key] = routine_plan.dict()
+    if not routine_plan.plan_id:
+        routine_plan.plan_id = new_plan_id()
+    wellness_data["routine_plans"][routine_plan.plan_id] = routine_plan.dict()
     
     save_user_wellness_data(wellness_data, user_id)
 
@@ -1778,6 +2415,9 @@ def get_user_routine_plans(user_id: str, plan_type: str = None) -> list[RoutineP
             try:
                 # Clean and validate the plan data before creating RoutinePlan
                 cleaned_plan_data = clean_routine_plan_data(plan_data)
+                # Plans saved before plan IDs existed are keyed by type and date
+                if not cleaned_plan_data.get("plan_id"):
+                    cleaned_plan_data["plan_id"] = plan_key
                 plans.append(RoutinePlan(**cleaned_plan_data))
             except Exception as e:
                 # If there's an error creating the plan, skip it but log the error
@@ -1892,9 +2532,6 @@ def update_routine_progress(user_id: str, plan_key: str, progress_data: dict):
 
 def get_agent_specific_insights(user_id: str, agent_type: str):
     """Get detailed insights for specific agent type"""
-    wellness_data = load_user_wellness_data(user_id)
-    sessions = wellness_data.get("sessions", {})
-    
     agent_insights = {
         "user_id": user_id,
         "agent_type": agent_type,
@@ -1904,24 +2541,48 @@ def get_agent_specific_insights(user_id: str, agent_type: str):
         "progress_trends": {}
     }
     
-    # Aggregate data from sessions for this agent
-    for session_id, session_data in sessions.items():
-        if session_data.get("agent") == agent_type.upper():
-            agent_insights["total_sessions"] += 1
-            
-            # Get agent-specific entities
-            agent_entities = session_data.get("agent_specific_entities", {}).get(agent_type.upper(), {})
+    if USE_SQL_FOR_CONVERSATIONS and SQL_AVAILABLE:
+        # Agent entities come straight from the (user_id, agent, entity_type) index
+        agent_sessions = {
+            row["session_id"]: row for row in get_conversation_sessions_sql(user_id)
+            if row.get("agent_type") == agent_type.upper()
+        }
+        agent_insights["total_sessions"] = len(agent_sessions)
+        
+        for entity_row in get_agent_entities_sql(user_id, agent_type.upper()):
+            session_row = agent_sessions.get(entity_row["session_id"])
+            if session_row is None:
+                continue
             
-            for entity_type, entities in agent_entities.items():
-                if entity_type not in agent_insights["entities"]:
-                    agent_insights["entities"][entity_type] = []
+            entity_with_context = dict(entity_row["entity"])
+            entity_with_context["session_id"] = entity_row["session_id"]
+            entity_with_context["session_date"] = session_row.get("start_time") or ""
+            agent_insights["entities"].setdefault(entity_row["entity_type"], []).append(entity_with_context)
+    else:
+        wellness_data = load_user_wellness_data(user_id)
+        sessions = wellness_data.get("sessions", {})
+        
+        # Aggregate data from sessions for this agent
+        for session_id, session_data in sessions.items():
+            if session_data.get("agent") == agent_type.upper():
+                agent_insights["total_sessions"] += 1
                 
-                # Add entities with session context
-                for entity in entities:
-                    entity_with_context = dict(entity)
-                    entity_with_context["session_id"] = session_id
-                    entity_with_context["session_date"] = session_data.get("created_at", "")
-                    agent_insights["entities"][entity_type].append(entity_with_context)
+                # Get agent-specific entities
+                agent_entities = session_data.get("agent_specific_entities", {}).get(agent_type.upper(), {})
+                
+                for entity_type, entities in agent_entities.items():
+                    if entity_type not in agent_insights["entities"]:
+                        agent_insights["entities"][entity_type] = []
+                    
+                    # Add entities with session context
+                    for entity in entities:
+                        entity_with_context = dict(entity)
+                        entity_with_context["session_id"] = session_id
+                        entity_with_context["session_date"] = session_data.get("created_at", "")
+                        agent_insights["entities"][entity_type].append(entity_with_context)
+    
+    # Most mentioned entities for this agent, from the mention index
+    agent_insights["top_entities"] = get_entity_stats(user_id, agent=agent_type.upper(), limit=10)
     
     # Remove duplicates and sort by timestamp
     for entity_type in agent_insights["entities"]:
@@ -2090,7 +2751,7 @@ def wellness_chat_node(state: State):
     full_prompt = f"{user_context}\n{system_prompt}"
     
     # Generate response
-    response = model.invoke([SystemMessage(content=full_prompt)] + state["messages"])
+    response = get_models()["chat"].invoke([SystemMessage(content=full_prompt)] + state["messages"])
     
     # If user requested a routine, generate structured routine plan
     routine_plan = None
@@ -2144,7 +2805,7 @@ def language_safety_node(state: State):
     current_user = state.get('current_user', 'default_user')
     
     msg_prompt = f"Message: {chat_response}"
-    safe_response = model.invoke([SystemMessage(content=language_safety_prompt), HumanMessage(content=msg_prompt)])
+    safe_response = get_models()["chat"].invoke([SystemMessage(content=language_safety_prompt), HumanMessage(content=msg_prompt)])
     ai_timestamp = datetime.now()
     session_id = state.get('session_id', 'default_session')
     
@@ -2158,81 +2819,120 @@ def language_safety_node(state: State):
         "time_stamps": [ai_timestamp]
     }
 
-conn= sqlite3.connect("history.db", check_same_thread=False)
-checkpointer= SqliteSaver(conn=conn)
-
 def retrieve_all_threads():
-    """Get all threads from checkpointer"""
-    all_threads = set()
-    for checkpoint in checkpointer.list(None):
-        all_threads.add(checkpoint.config["configurable"]["thread_id"])
-    return list(all_threads)
+    """Get all threads from the thread registry"""
+    if USE_SQL_FOR_CONVERSATIONS and SQL_AVAILABLE:
+        try:
+            return get_all_thread_ids_sql()
+        except Exception as e:
+            print(f"SQL error, falling back to JSON: {e}")
+    
+    # JSON fallback
+    return [entry["session_id"] for user_id, _ in iter_wellness_files() for entry in get_user_session_index(user_id)]
 
 def retrieve_user_threads(user_id: str = "default_user"):
-    """Get threads for a specific user based on NER data"""
-    user_data = load_user_ner_data(user_id)
-    sessions = user_data.get("sessions", {})
-    return list(sessions.keys())
+    """Get threads for a specific user from the thread registry"""
+    return get_user_threads(user_id)
+
+def _delete_session_data(session_id: str, user_id: str = "default_user"):
+    """Delete a session's conversation, entities and index entry"""
+    if USE_SQL_FOR_CONVERSATIONS and SQL_AVAILABLE:
+        result = delete_session_data_sql(user_id, session_id)
+        if result["success"]:
+            return {"success": True, "message": f"Session {session_id} deleted successfully."}
+    
+    # Remove from user's NER data
+    user_data = _load_json_ner_data(user_id)
+    if session_id in user_data["sessions"]:
+        session_data = user_data["sessions"].pop(session_id)
+        adjust_ner_summary(user_data["ner_summary"], [
+            (category, entity) for category in ["people", "places", "events", "substances"]
+            for entity in session_data.get(category, [])
+        ], -1)
+        forget_session_mentions(user_data["entity_index"], session_id)
+        archive_path = session_archive_path(user_id, session_id)
+        if os.path.exists(archive_path):
+            os.remove(archive_path)
+        
+        update_user_ner_summary(user_data)
+        save_user_ner_data(user_data, user_id)
+        return {"success": True, "message": f"Session {session_id} deleted successfully."}
+    return {"success": False, "message": "Session not found."}
+
+def _purge_thread_history(thread_ids: list, background: bool = True):
+    """Queue deleted threads for purging from the checkpointer and start the reclaim job"""
+    try:
+        if queue_thread_purge(thread_ids) and background:
+            start_reclaim_job()
+    except Exception as e:
+        print(f"Error queueing checkpoint purge: {e}")
 
 def delete_session(session_id: str, user_id: str = "default_user"):
-    """Delete a session from user's NER data and optionally from checkpointer"""
+    """Delete a session from the conversation store and its checkpoints from history.db"""
     try:
-        # Remove from user's NER data
-        user_data = load_user_ner_data(user_id)
-        if session_id in user_data["sessions"]:
-            del user_data["sessions"][session_id]
-            
-            # Update summary after deletion
-            update_user_ner_summary(user_data)
-            save_user_ner_data(user_data, user_id)
-            
-            # Try to delete from checkpointer (optional, as it might be shared across users)
-            try:
-                # Note: LangGraph checkpointer doesn't have a direct delete method
-                # So we'll just remove it from our NER data
-                pass
-            except:
-                pass
-                
-            return {"success": True, "message": f"Session {session_id} deleted successfully."}
-        else:
-            return {"success": False, "message": "Session not found."}
+        result = _delete_session_data(session_id, user_id)
+        if result["success"]:
+            _purge_thread_history([session_id])
+        return result
     except Exception as e:
         return {"success": False, "message": f"Error deleting session: {str(e)}"}
 
+def delete_user_sessions(user_ids: list, background: bool = True) -> dict:
+    """Delete every session of the given users, queueing their checkpoints for one purge
+
+    With background=False the caller runs the purge itself (database_manager.py purge-history).
+    """
+    deleted_threads = []
+    errors = 0
+    for user_id in user_ids:
+        for entry in get_user_session_index(user_id):
+            thread_id = entry["session_id"]
+            try:
+                if _delete_session_data(thread_id, user_id)["success"]:
+                    deleted_threads.append(thread_id)
+            except Exception as e:
+                errors += 1
+                print(f"Error deleting session {thread_id} of {user_id}: {e}")
+    _purge_thread_history(deleted_threads, background)
+    return {
+        "success": errors == 0,
+        "sessions": len(deleted_threads),
+        "message": f"Deleted {len(deleted_threads)} sessions of {len(user_ids)} users"
+                   + (f", {errors} failed" if errors else "")
+    }
+
 def check_user_has_data(user_id: str) -> bool:
     """Check if user actually has any session data"""
     try:
-        user_data = load_user_ner_data(user_id)
-        sessions = user_data.get("sessions", {})
+        if USE_SQL_FOR_CONVERSATIONS and SQL_AVAILABLE:
+            return user_has_conversation_data_sql(user_id)
         
         # Check if there are any sessions with actual messages or entities
-        for session_data in sessions.values():
-            messages = session_data.get("messages", [])
-            people = session_data.get("people", [])
-            places = session_data.get("places", [])
-            events = session_data.get("events", [])
-            substances = session_data.get("substances", [])
-            
-            # If any session has messages or entities, user has data
-            if messages or people or places or events or substances:
+        for entry in get_user_session_index(user_id):
+            if entry.get("message_count") or entry.get("entity_count") or entry.get("agent_entity_count"):
                 return True
                 
         return False
     except:
         return False
 
-graph = StateGraph(State)
-graph.add_node("agent_router_node", agent_router_node)
-graph.add_node("wellness_chat_node", wellness_chat_node)
-graph.add_node("ner_node", ner_node)
-graph.add_node("language_safety_node", language_safety_node)
-
-graph.add_edge(START, "agent_router_node")
-graph.add_edge(START, "ner_node")
-graph.add_edge("agent_router_node", "wellness_chat_node")
-graph.add_edge("wellness_chat_node", "language_safety_node")
-graph.add_edge("ner_node", END)
-graph.add_edge("language_safety_node", END)
-
-chatbot = graph.compile(checkpointer=checkpointer)
\ No newline at end of file
+def _create_chatbot():
+    """Build the routing, chat, NER and language safety graph and compile it with the checkpointer"""
+    graph = StateGraph(State)
+    graph.add_node("agent_router_node", agent_router_node)
+    graph.add_node("wellness_chat_node", wellness_chat_node)
+    graph.add_node("ner_node", ner_node)
+    graph.add_node("language_safety_node", language_safety_node)
+    
+    graph.add_edge(START, "agent_router_node")
+    graph.add_edge(START, "ner_node")
+    graph.add_edge("agent_router_node", "wellness_chat_node")
+    graph.add_edge("wellness_chat_node", "language_safety_node")
+    graph.add_edge("ner_node", END)
+    graph.add_edge("language_safety_node", END)
+    
+    return graph.compile(checkpointer=get_checkpointer())
+
+def get_chatbot():
+    """Get the compiled conversation graph"""
+    return _resource("chatbot", _create_chatbot)
\ No newline at end of file
@@ -1,157 +1,866 @@
 import sqlite3
 import hashlib
 import json
+import zlib
 from datetime import datetime, date
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 import os
+import threading
 from contextlib import contextmanager
+from storage import (
+    entity_key, entity_fingerprint, entity_name, entity_attribute, entity_index_key, canonical_entity_name
+)
+from search import normalize_search_text, build_fts_query, search_tokens, entity_search_text, make_snippet
 
 # Database file path
 DB_FILE = "wellness_app.db"
 
+def _fts5_available() -> bool:
+    """Check whether this SQLite build includes the FTS5 extension"""
+    try:
+        sqlite3.connect(":memory:").execute("CREATE VIRTUAL TABLE probe USING fts5(content)")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+FTS5_AVAILABLE = _fts5_available()
+
+# Each thread keeps one open connection per database file instead of connecting on every call.
+# WAL lets Streamlit sessions read while another session writes; set SQLITE_CONNECTION_POOL=0
+# to go back to a fresh connection per call (used by the benchmark for comparison).
+USE_CONNECTION_POOL = os.getenv("SQLITE_CONNECTION_POOL", "1") != "0"
+BUSY_TIMEOUT_MS = 5000
+STATEMENT_CACHE_SIZE = 256
+SQLITE_PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),          # durable across app crashes; WAL fsyncs on checkpoint
+    ("busy_timeout", str(BUSY_TIMEOUT_MS)),
+    ("cache_size", "-20000"),           # ~20 MB page cache per connection
+    ("mmap_size", "268435456"),         # read through up to 256 MB of memory-mapped I/O
+    ("temp_store", "MEMORY")
+)
+
+_local = threading.local()
+
+def _open_connection(db_file: str) -> sqlite3.Connection:
+    """Open a connection with the tuned pragmas applied"""
+    conn = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT_MS / 1000, cached_statements=STATEMENT_CACHE_SIZE)
+    conn.row_factory = sqlite3.Row  # Enable column name access
+    for name, value in SQLITE_PRAGMAS:
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+def _pooled_connection() -> sqlite3.Connection:
+    """Get this thread's connection to DB_FILE, opening it on first use"""
+    # A forked child must not reuse its parent's connections
+    if getattr(_local, "pid", None) != os.getpid():
+        _local.connections = {}
+        _local.pid = os.getpid()
+
+    db_path = os.path.abspath(DB_FILE)
+    conn = _local.connections.get(db_path)
+    if conn is None:
+        conn = _local.connections[db_path] = _open_connection(DB_FILE)
+    return conn
+
+def close_db_connections():
+    """Close the calling thread's pooled connections"""
+    for conn in getattr(_local, "connections", {}).values():
+        conn.close()
+    _local.connections = {}
+
 @contextmanager
 def get_db_connection():
     """Context manager for database connections"""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row  # Enable column name access
+    if not USE_CONNECTION_POOL:
+        conn = sqlite3.connect(DB_FILE)
+        conn.row_factory = sqlite3.Row  # Enable column name access
+        try:
+            yield conn
+        finally:
+            conn.close()
+        return
+
+    conn = _pooled_connection()
+    depth = getattr(_local, "depth", 0)
+    _local.depth = depth + 1
     try:
         yield conn
     finally:
-        conn.close()
+        _local.depth = depth
+        # Work left uncommitted is discarded, as it was when each call closed its own connection
+        if depth == 0 and conn.in_transaction:
+            conn.rollback()
 
-def init_database():
-    """Initialize the database with all required tables"""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        
-        # Users table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id VARCHAR(20) UNIQUE NOT NULL,
-                full_name VARCHAR(100) NOT NULL,
-                cnic VARCHAR(15) UNIQUE,
-                email VARCHAR(100),
-                password_hash VARCHAR(255),
-                phone VARCHAR(15),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_active TIMESTAMP,
-                is_active BOOLEAN DEFAULT TRUE
-            )
-        """)
-        
-        # User profiles table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_profiles (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id VARCHAR(20) REFERENCES users(user_id),
-                age INTEGER,
-                gender TEXT CHECK (gender IN ('Male', 'Female', 'Other')),
-                height DECIMAL(5,2),
-                current_weight DECIMAL(5,2),
-                target_weight DECIMAL(5,2),
-                initial_weight DECIMAL(5,2),
-                activity_level TEXT CHECK (activity_level IN ('sedentary', 'lightly_active', 'moderately_active', 'very_active')),
-                diet_type TEXT CHECK (diet_type IN ('vegetarian', 'non_vegetarian', 'keto', 'low_carb', 'balanced', 'other')),
-                city VARCHAR(50),
-                area VARCHAR(100),
-                preferred_language TEXT CHECK (preferred_language IN ('English', 'Urdu', 'Mixed')) DEFAULT 'English',
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-        """)
-        
-        # Health data table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS health_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id VARCHAR(20) REFERENCES users(user_id),
-                date DATE,
-                weight DECIMAL(5,2),
-                blood_pressure_systolic INTEGER,
-                blood_pressure_diastolic INTEGER,
-                blood_sugar INTEGER,
-                stress_level INTEGER CHECK (stress_level BETWEEN 1 AND 5),
-                sleep_hours DECIMAL(3,1),
-                mood_rating INTEGER CHECK (mood_rating BETWEEN 1 AND 10),
-                notes TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-        """)
-        
-        # Sessions table
+# Schema migrations, applied in order by migrate_schema. Each runs once per database in its own
+# transaction and is recorded in schema_version. They must stay idempotent: databases created
+# before schema_version existed run every migration once against the tables they already have.
+
+def _migrate_core_tables(cursor):
+    """Users, profiles, health data, sessions, routine plans and local healthcare"""
+    # Users table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id VARCHAR(20) UNIQUE NOT NULL,
+            full_name VARCHAR(100) NOT NULL,
+            cnic VARCHAR(15) UNIQUE,
+            email VARCHAR(100),
+            password_hash VARCHAR(255),
+            phone VARCHAR(15),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_active TIMESTAMP,
+            is_active BOOLEAN DEFAULT TRUE
+        )
+    """)
+    
+    # User profiles table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_profiles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id VARCHAR(20) REFERENCES users(user_id),
+            age INTEGER,
+            gender TEXT CHECK (gender IN ('Male', 'Female', 'Other')),
+            height DECIMAL(5,2),
+            current_weight DECIMAL(5,2),
+            target_weight DECIMAL(5,2),
+            initial_weight DECIMAL(5,2),
+            activity_level TEXT CHECK (activity_level IN ('sedentary', 'lightly_active', 'moderately_active', 'very_active')),
+            diet_type TEXT CHECK (diet_type IN ('vegetarian', 'non_vegetarian', 'keto', 'low_carb', 'balanced', 'other')),
+            city VARCHAR(50),
+            area VARCHAR(100),
+            preferred_language TEXT CHECK (preferred_language IN ('English', 'Urdu', 'Mixed')) DEFAULT 'English',
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    """)
+    
+    # Health data table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS health_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id VARCHAR(20) REFERENCES users(user_id),
+            date DATE,
+            weight DECIMAL(5,2),
+            blood_pressure_systolic INTEGER,
+            blood_pressure_diastolic INTEGER,
+            blood_sugar INTEGER,
+            stress_level INTEGER CHECK (stress_level BETWEEN 1 AND 5),
+            sleep_hours DECIMAL(3,1),
+            mood_rating INTEGER CHECK (mood_rating BETWEEN 1 AND 10),
+            notes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    """)
+    
+    # Sessions table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id VARCHAR(50) UNIQUE NOT NULL,
+            user_id VARCHAR(20) REFERENCES users(user_id),
+            agent_type TEXT CHECK (agent_type IN ('MENTAL_HEALTH', 'DIET', 'EXERCISE')),
+            start_time TIMESTAMP,
+            end_time TIMESTAMP,
+            total_messages INTEGER DEFAULT 0,
+            entity_count INTEGER DEFAULT 0,
+            agent_entity_count INTEGER DEFAULT 0,
+            archived_at TIMESTAMP,
+            session_rating INTEGER CHECK (session_rating BETWEEN 1 AND 5),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    """)
+    
+    # Routine plans table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS routine_plans (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            plan_id VARCHAR(50) UNIQUE NOT NULL,
+            user_id VARCHAR(20) REFERENCES users(user_id),
+            plan_type TEXT CHECK (plan_type IN ('mental_health', 'diet', 'exercise', 'comprehensive')),
+            title VARCHAR(200),
+            description TEXT,
+            start_date DATE,
+            end_date DATE,
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    """)
+    
+    # Progress logs table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS progress_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            plan_id VARCHAR(50) REFERENCES routine_plans(plan_id),
+            user_id VARCHAR(20) REFERENCES users(user_id),
+            log_date DATE,
+            completed_activities INTEGER,
+            total_activities INTEGER,
+            satisfaction_level INTEGER CHECK (satisfaction_level BETWEEN 1 AND 10),
+            notes TEXT,
+            challenges TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (plan_id) REFERENCES routine_plans(plan_id),
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    """)
+    
+    # Local healthcare table (Pakistan-specific)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS local_healthcare (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name VARCHAR(200),
+            type TEXT CHECK (type IN ('hospital', 'clinic', 'pharmacy', 'lab')),
+            city VARCHAR(50),
+            area VARCHAR(100),
+            address TEXT,
+            phone VARCHAR(15),
+            emergency_services BOOLEAN DEFAULT FALSE,
+            accepts_sehat_card BOOLEAN DEFAULT FALSE,
+            specializations TEXT, -- JSON string
+            rating DECIMAL(2,1),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Last-active timestamps, kept apart from user records so logins stay cheap
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_activity (
+            user_id VARCHAR(20) PRIMARY KEY,
+            last_active TIMESTAMP NOT NULL
+        )
+    """)
+
+def _migrate_conversation_store(cursor):
+    """Messages, NER entities and archived sessions"""
+    # Conversation messages table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id VARCHAR(20) REFERENCES users(user_id),
+            session_id VARCHAR(50) NOT NULL,
+            message_type VARCHAR(20),
+            content TEXT,
+            timestamp TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    """)
+
+    # General NER entities (people, places, events, substances) per session
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS session_entities (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id VARCHAR(20) REFERENCES users(user_id),
+            session_id VARCHAR(50) NOT NULL,
+            entity_type VARCHAR(30) NOT NULL,
+            entity_data TEXT NOT NULL, -- JSON string
+            fingerprint VARCHAR(32), -- hash of the canonical entity, for deduplication
+            timestamp TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    """)
+
+    # Agent-specific NER entities per session
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS agent_entities (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id VARCHAR(20) REFERENCES users(user_id),
+            session_id VARCHAR(50) NOT NULL,
+            agent TEXT CHECK (agent IN ('MENTAL_HEALTH', 'DIET', 'EXERCISE')),
+            entity_type VARCHAR(30) NOT NULL,
+            entity_data TEXT NOT NULL, -- JSON string
+            fingerprint VARCHAR(32), -- hash of the canonical entity, for deduplication
+            timestamp TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    """)
+
+    # Messages of idle sessions, moved out of the hot messages table (zlib-compressed JSON)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS session_archives (
+            session_id VARCHAR(50) PRIMARY KEY,
+            user_id VARCHAR(20) REFERENCES users(user_id),
+            message_count INTEGER NOT NULL,
+            payload BLOB NOT NULL,
+            archived_at TIMESTAMP NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    """)
+
+    # Session index counters for databases created before they existed
+    if _add_missing_columns(cursor, "sessions", {
+        "entity_count": "INTEGER DEFAULT 0",
+        "agent_entity_count": "INTEGER DEFAULT 0",
+        "archived_at": "TIMESTAMP"
+    }):
+        _rebuild_session_counts(cursor)
+
+    # Indexes for the conversation store
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_user_session_ts
+        ON messages (user_id, session_id, timestamp)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_session_entities_user_session
+        ON session_entities (user_id, session_id, entity_type)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_agent_entities_user_agent_type
+        ON agent_entities (user_id, agent, entity_type)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_agent_entities_user_session
+        ON agent_entities (user_id, session_id)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_sessions_user_start
+        ON sessions (user_id, start_time)
+    """)
+
+def _migrate_entity_fingerprints(cursor):
+    """Entity fingerprints, with duplicate entities removed before they are made unique"""
+    added = _add_missing_columns(cursor, "session_entities", {"fingerprint": "VARCHAR(32)"})
+    added += _add_missing_columns(cursor, "agent_entities", {"fingerprint": "VARCHAR(32)"})
+    if added:
+        _dedupe_entity_rows(cursor)
+        _rebuild_session_counts(cursor)
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_session_entities_fingerprint
+        ON session_entities (user_id, session_id, entity_type, fingerprint)
+    """)
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_agent_entities_fingerprint
+        ON agent_entities (user_id, session_id, agent, entity_type, fingerprint)
+    """)
+
+def _migrate_entity_summary(cursor):
+    """Reference-counted entity names"""
+    # Reference-counted unique entity names per user, maintained on every entity write
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS entity_summary (
+            user_id VARCHAR(20) NOT NULL,
+            entity_type VARCHAR(30) NOT NULL,
+            name TEXT NOT NULL,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, entity_type, name)
+        )
+    """)
+    _rebuild_entity_summary(cursor)
+
+def _migrate_conversation_search(cursor):
+    """Full-text search index"""
+    # Full-text index over message content and extracted entity text. Search runs on the
+    # normalized column; content is only stored for snippets. Rows of archived sessions stay.
+    if FTS5_AVAILABLE:
         cursor.execute("""
-            CREATE TABLE IF NOT EXISTS sessions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id VARCHAR(50) UNIQUE NOT NULL,
-                user_id VARCHAR(20) REFERENCES users(user_id),
-                agent_type TEXT CHECK (agent_type IN ('MENTAL_HEALTH', 'DIET', 'EXERCISE')),
-                start_time TIMESTAMP,
-                end_time TIMESTAMP,
-                total_messages INTEGER DEFAULT 0,
-                session_rating INTEGER CHECK (session_rating BETWEEN 1 AND 5),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
+            CREATE VIRTUAL TABLE IF NOT EXISTS conversation_search USING fts5(
+                content UNINDEXED,
+                normalized,
+                user_id,
+                session_id UNINDEXED,
+                source UNINDEXED,
+                timestamp UNINDEXED,
+                tokenize = 'unicode61 remove_diacritics 2'
             )
         """)
-        
-        # Routine plans table
+    else:
+        print("⚠ SQLite FTS5 not available, conversation search will scan JSON data")
+    _rebuild_search_index(cursor)
+
+def _migrate_entity_index(cursor):
+    """Entity mentions and co-occurrence"""
+    # Inverted index of entity mentions across sessions, with per-session co-occurrence counts
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS entity_mentions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id VARCHAR(20) NOT NULL,
+            session_id VARCHAR(50) NOT NULL,
+            agent TEXT,
+            entity_type VARCHAR(30) NOT NULL,
+            entity_name TEXT NOT NULL,
+            attribute TEXT,
+            entity_data TEXT NOT NULL,
+            timestamp TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS entity_cooccurrence (
+            user_id VARCHAR(20) NOT NULL,
+            entity_key TEXT NOT NULL,
+            related_key TEXT NOT NULL,
+            session_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, entity_key, related_key)
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_entity_mentions_entity
+        ON entity_mentions (user_id, entity_type, entity_name, timestamp)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_entity_mentions_session
+        ON entity_mentions (user_id, session_id)
+    """)
+    _rebuild_entity_index(cursor)
+
+# Secondary indexes for the structured tables
+SECONDARY_INDEXES = (
+    ("idx_users_email", "users (email)", False),
+    ("idx_user_profiles_user", "user_profiles (user_id)", True),
+    ("idx_health_data_user_date", "health_data (user_id, date)", True),
+    ("idx_sessions_user_agent_created", "sessions (user_id, agent_type, created_at)", False),
+    ("idx_sessions_user_created", "sessions (user_id, created_at)", False),
+    ("idx_routine_plans_user_active_created", "routine_plans (user_id, is_active, created_at)", False),
+    ("idx_progress_logs_plan_date", "progress_logs (plan_id, log_date)", False)
+)
+
+def _migrate_secondary_indexes(cursor):
+    """Indexes for hot lookups, and one profile per user and health record per day"""
+    # One profile per user and one health record per user and day: keep the latest of any
+    # duplicates before enforcing it
+    cursor.execute("""
+        DELETE FROM user_profiles WHERE id NOT IN (
+            SELECT MAX(id) FROM user_profiles GROUP BY user_id
+        )
+    """)
+    cursor.execute("""
+        DELETE FROM health_data WHERE id NOT IN (
+            SELECT MAX(id) FROM health_data GROUP BY user_id, date
+        )
+    """)
+    for name, target, unique in SECONDARY_INDEXES:
+        if unique:
+            # Replace an index created without its uniqueness before it was made unique
+            cursor.execute(f"PRAGMA index_list({target.split()[0]})")
+            if any(row[1] == name and not row[2] for row in cursor.fetchall()):
+                cursor.execute(f"DROP INDEX {name}")
+        cursor.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {target}")
+
+def _migrate_migration_state(cursor):
+    """Progress of JSON to SQL migration runs, so an interrupted run can resume"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS migration_runs (
+            run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at TIMESTAMP NOT NULL,
+            finished_at TIMESTAMP,
+            stage VARCHAR(20), -- last stage started: backup, data or verify
+            status TEXT CHECK (status IN ('running', 'completed', 'failed')) NOT NULL,
+            incremental BOOLEAN DEFAULT FALSE,
+            total_sources INTEGER DEFAULT 0,
+            done_sources INTEGER DEFAULT 0,
+            rows INTEGER DEFAULT 0
+        )
+    """)
+    # One row per migrated source (user:{user_id} or ner:{file name}), written in the same
+    # transaction as the source's data
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS migration_state (
+            source TEXT PRIMARY KEY,
+            user_id VARCHAR(20),
+            run_id INTEGER REFERENCES migration_runs(run_id),
+            source_mtime REAL,
+            source_hash VARCHAR(32),
+            error TEXT,
+            migrated_at TIMESTAMP NOT NULL
+        )
+    """)
+
+def _migrate_thread_registry(cursor):
+    """The threads view over the session index, with agents recorded for threads whose ID names one"""
+    # Thread IDs carry their agent (wellness_{agent}_{id}); older names may just mention one
+    cursor.execute("""
+        UPDATE sessions SET agent_type = CASE
+            WHEN session_id GLOB 'wellness_mental_health_?*' THEN 'MENTAL_HEALTH'
+            WHEN session_id GLOB 'wellness_diet_?*' THEN 'DIET'
+            WHEN session_id GLOB 'wellness_exercise_?*' THEN 'EXERCISE'
+            WHEN LOWER(session_id) LIKE '%diet%' THEN 'DIET'
+            WHEN LOWER(session_id) LIKE '%exercise%' THEN 'EXERCISE'
+            ELSE agent_type
+        END
+    """)
+    cursor.execute("""
+        CREATE VIEW IF NOT EXISTS threads AS
+        SELECT session_id AS thread_id, user_id, agent_type AS agent,
+               start_time AS created_at, COALESCE(end_time, start_time) AS last_message_at,
+               COALESCE(total_messages, 0) AS message_count, id
+        FROM sessions
+    """)
+
+# Append new migrations with the next version number; never edit or reorder applied ones
+SCHEMA_MIGRATIONS = (
+    (1, "core tables", _migrate_core_tables),
+    (2, "conversation store", _migrate_conversation_store),
+    (3, "entity fingerprints", _migrate_entity_fingerprints),
+    (4, "entity summary", _migrate_entity_summary),
+    (5, "conversation search", _migrate_conversation_search),
+    (6, "entity index", _migrate_entity_index),
+    (7, "secondary indexes", _migrate_secondary_indexes),
+    (8, "migration state", _migrate_migration_state),
+    (9, "thread registry", _migrate_thread_registry)
+)
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+def get_schema_version() -> int:
+    """Latest migration applied to the database, 0 if it predates schema_version"""
+    with get_db_connection() as conn:
+        try:
+            row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+        except sqlite3.OperationalError:
+            return 0
+        return row[0] or 0
+
+def migrate_schema() -> Dict[str, Any]:
+    """Apply pending schema migrations in order"""
+    applied = []
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
         cursor.execute("""
-            CREATE TABLE IF NOT EXISTS routine_plans (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                plan_id VARCHAR(50) UNIQUE NOT NULL,
-                user_id VARCHAR(20) REFERENCES users(user_id),
-                plan_type TEXT CHECK (plan_type IN ('mental_health', 'diet', 'exercise', 'comprehensive')),
-                title VARCHAR(200),
-                description TEXT,
-                start_date DATE,
-                end_date DATE,
-                is_active BOOLEAN DEFAULT TRUE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP NOT NULL
             )
         """)
-        
-        # Progress logs table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS progress_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                plan_id VARCHAR(50) REFERENCES routine_plans(plan_id),
-                user_id VARCHAR(20) REFERENCES users(user_id),
-                log_date DATE,
-                completed_activities INTEGER,
-                total_activities INTEGER,
-                satisfaction_level INTEGER CHECK (satisfaction_level BETWEEN 1 AND 10),
-                notes TEXT,
-                challenges TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (plan_id) REFERENCES routine_plans(plan_id),
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
+        conn.commit()
+
+        for version, name, migrate in SCHEMA_MIGRATIONS:
+            # Take the write lock before checking, so concurrent processes apply each migration once
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("SELECT 1 FROM schema_version WHERE version = ?", (version,))
+            if cursor.fetchone():
+                conn.rollback()
+                continue
+            try:
+                migrate(cursor)
+                cursor.execute(
+                    "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                    (version, name, datetime.now().isoformat())
+                )
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                return {
+                    "success": False, "applied": applied, "version": version - 1,
+                    "message": f"Error applying schema migration {version} ({name}): {str(e)}"
+                }
+            applied.append(f"{version}: {name}")
+
+    message = f"Applied {len(applied)} migrations" if applied else "Schema is up to date"
+    return {"success": True, "applied": applied, "version": SCHEMA_VERSION, "message": message}
+
+def init_database():
+    """Bring the database schema up to date, only reading its version when it already is"""
+    if get_schema_version() >= SCHEMA_VERSION:
+        return
+    result = migrate_schema()
+    if not result["success"]:
+        raise RuntimeError(result["message"])
+    print("Database initialized successfully!")
+
+
+# Hot queries with representative parameters, checked by check_query_plans_sql
+HOT_QUERIES = {
+    "user by id": ("SELECT * FROM users WHERE user_id = ?", ("u",)),
+    "user by email": ("SELECT * FROM users WHERE email = ?", ("a@b.c",)),
+    "user by cnic": ("SELECT user_id FROM users WHERE cnic = ? AND is_active = TRUE", ("12345-1234567-1",)),
+    "profile by user": ("SELECT * FROM user_profiles WHERE user_id = ?", ("u",)),
+    "health log for day": ("SELECT id FROM health_data WHERE user_id = ? AND date = ?", ("u", "2025-01-01")),
+    "health history": ("SELECT * FROM health_data WHERE user_id = ? ORDER BY date DESC LIMIT ?", ("u", 30)),
+    "sessions by agent": ("SELECT * FROM sessions WHERE user_id = ? AND agent_type = ? ORDER BY created_at DESC",
+                          ("u", "DIET")),
+    "sessions by user": ("SELECT * FROM sessions WHERE user_id = ? ORDER BY created_at DESC", ("u",)),
+    "session index": ("SELECT * FROM sessions WHERE user_id = ? ORDER BY start_time, id", ("u",)),
+    "user threads": ("SELECT thread_id, agent FROM threads WHERE user_id = ? ORDER BY created_at, id", ("u",)),
+    "active routine plans": ("SELECT * FROM routine_plans WHERE user_id = ? AND is_active = TRUE ORDER BY created_at DESC",
+                             ("u",)),
+    "plan progress": ("SELECT * FROM progress_logs WHERE plan_id = ? AND user_id = ? ORDER BY log_date DESC LIMIT 5",
+                      ("p", "u")),
+    "session messages": ("SELECT content FROM messages WHERE user_id = ? AND session_id = ? ORDER BY timestamp, id",
+                         ("u", "s")),
+    "session entities": ("SELECT entity_data FROM session_entities WHERE user_id = ? AND session_id = ? ORDER BY id",
+                         ("u", "s")),
+    "agent entities": ("SELECT entity_data FROM agent_entities WHERE user_id = ? AND agent = ? AND entity_type = ?",
+                       ("u", "DIET", "food_items")),
+    "entity timeline": ("SELECT * FROM entity_mentions WHERE user_id = ? AND entity_type = ? AND entity_name = ? "
+                        "ORDER BY timestamp DESC", ("u", "people", "ali")),
+    "entity co-occurrence": ("SELECT * FROM entity_cooccurrence WHERE user_id = ? AND entity_key = ?", ("u", "people:ali"))
+}
+
+def check_query_plans_sql() -> List[Dict[str, Any]]:
+    """Run EXPLAIN QUERY PLAN on each hot query and report whether it avoids full table scans"""
+    results = []
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        for name, (query, params) in HOT_QUERIES.items():
+            cursor.execute(f"EXPLAIN QUERY PLAN {query}", params)
+            plan = [row[3] for row in cursor.fetchall()]
+            full_scans = [step for step in plan if step.startswith("SCAN") and " USING " not in step]
+            results.append({
+                "query": name,
+                "plan": plan,
+                "uses_index": not full_scans,
+                "sorts": any("TEMP B-TREE" in step for step in plan)
+            })
+    return results
+
+def _add_missing_columns(cursor, table: str, columns: Dict[str, str]) -> List[str]:
+    """Add columns that an existing table is missing, returning the names added"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    existing = {row[1] for row in cursor.fetchall()}
+    added = []
+    for column, definition in columns.items():
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            added.append(column)
+    return added
+
+def _rebuild_session_counts(cursor, user_id: Optional[str] = None):
+    """Recompute the message and entity counters of the session index from the stored rows"""
+    query = """
+        UPDATE sessions SET
+            total_messages = (SELECT COUNT(*) FROM messages m
+                              WHERE m.user_id = sessions.user_id AND m.session_id = sessions.session_id)
+                           + COALESCE((SELECT r.message_count FROM session_archives r
+                                       WHERE r.session_id = sessions.session_id), 0),
+            entity_count = (SELECT COUNT(*) FROM session_entities e
+                            WHERE e.user_id = sessions.user_id AND e.session_id = sessions.session_id),
+            agent_entity_count = (SELECT COUNT(*) FROM agent_entities a
+                                  WHERE a.user_id = sessions.user_id AND a.session_id = sessions.session_id)
+    """
+    if user_id:
+        cursor.execute(query + " WHERE user_id = ?", (user_id,))
+    else:
+        cursor.execute(query)
+
+def _dedupe_entity_rows(cursor) -> int:
+    """Fill in missing entity fingerprints and delete duplicate entity rows, keeping the oldest"""
+    removed = 0
+    for table, group_columns in (
+        ("session_entities", "user_id, session_id, entity_type, fingerprint"),
+        ("agent_entities", "user_id, session_id, agent, entity_type, fingerprint")
+    ):
+        cursor.execute(f"SELECT id, entity_data FROM {table} WHERE fingerprint IS NULL")
+        cursor.executemany(f"UPDATE {table} SET fingerprint = ? WHERE id = ?", [
+            (entity_fingerprint(json.loads(row[1])), row[0]) for row in cursor.fetchall()
+        ])
+        cursor.execute(f"""
+            DELETE FROM {table} WHERE id NOT IN (
+                SELECT MIN(id) FROM {table} GROUP BY {group_columns}
             )
         """)
-        
-        # Local healthcare table (Pakistan-specific)
+        removed += cursor.rowcount
+    return removed
+
+def _adjust_entity_summary(cursor, user_id: str, entities: List[tuple], delta: int):
+    """Add delta to the summary ref count of each (entity_type, entity) pair"""
+    counts = {}
+    for entity_type, entity in entities:
+        name = entity_name(entity_type, entity)
+        if name:
+            counts[(entity_type, name)] = counts.get((entity_type, name), 0) + delta
+    if not counts:
+        return
+
+    cursor.executemany("""
+        INSERT INTO entity_summary (user_id, entity_type, name, ref_count) VALUES (?, ?, ?, ?)
+        ON CONFLICT(user_id, entity_type, name) DO UPDATE SET ref_count = ref_count + excluded.ref_count
+    """, [(user_id, entity_type, name, count) for (entity_type, name), count in counts.items()])
+    if delta < 0:
+        cursor.execute("DELETE FROM entity_summary WHERE user_id = ? AND ref_count <= 0", (user_id,))
+
+def _rebuild_entity_summary(cursor, user_id: Optional[str] = None):
+    """Recompute the entity summary from the stored session entities"""
+    if user_id:
+        cursor.execute("DELETE FROM entity_summary WHERE user_id = ?", (user_id,))
+        cursor.execute("SELECT user_id, entity_type, entity_data FROM session_entities WHERE user_id = ?", (user_id,))
+    else:
+        cursor.execute("DELETE FROM entity_summary")
+        cursor.execute("SELECT user_id, entity_type, entity_data FROM session_entities")
+
+    entities_by_user = {}
+    for row in cursor.fetchall():
+        entities_by_user.setdefault(row[0], []).append((row[1], json.loads(row[2])))
+    for summary_user_id, entities in entities_by_user.items():
+        if summary_user_id is not None:
+            _adjust_entity_summary(cursor, summary_user_id, entities, 1)
+
+def _adjust_cooccurrence(cursor, user_id: str, pairs: List[tuple], delta: int):
+    """Add delta to the session count of each (entity_key, related_key) pair, in both directions"""
+    if not pairs:
+        return
+    cursor.executemany("""
+        INSERT INTO entity_cooccurrence (user_id, entity_key, related_key, session_count) VALUES (?, ?, ?, ?)
+        ON CONFLICT(user_id, entity_key, related_key) DO UPDATE SET
+            session_count = session_count + excluded.session_count
+    """, [
+        row for key, related_key in pairs
+        for row in ((user_id, key, related_key, delta), (user_id, related_key, key, delta))
+    ])
+    if delta < 0:
+        cursor.execute("DELETE FROM entity_cooccurrence WHERE user_id = ? AND session_count <= 0", (user_id,))
+
+def _record_entity_mentions(cursor, user_id: str, session_id: str, mentions: List[tuple]):
+    """Add (agent, entity_type, entity, timestamp) mentions to the entity index, pairing new entities with the session's others"""
+    rows = [(entity_index_key(entity_type, entity), agent, entity_type, entity, timestamp)
+            for agent, entity_type, entity, timestamp in mentions]
+    rows = [row for row in rows if row[0]]
+    if not rows:
+        return
+
+    cursor.execute("""
+        SELECT DISTINCT entity_type, entity_name FROM entity_mentions WHERE user_id = ? AND session_id = ?
+    """, (user_id, session_id))
+    session_keys = {f"{row[0]}:{row[1]}" for row in cursor.fetchall()}
+
+    cursor.executemany("""
+        INSERT INTO entity_mentions
+        (user_id, session_id, agent, entity_type, entity_name, attribute, entity_data, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, [
+        (user_id, session_id, agent, entity_type, key.split(":", 1)[1], entity_attribute(entity_type, entity),
+         _entity_key(entity), timestamp)
+        for key, agent, entity_type, entity, timestamp in rows
+    ])
+
+    # Co-occurrence counts sessions, so only an entity's first mention in a session adds pairs
+    pairs = []
+    for key, _agent, _entity_type, _entity, _timestamp in rows:
+        if key not in session_keys:
+            pairs.extend((key, other_key) for other_key in session_keys)
+            session_keys.add(key)
+    _adjust_cooccurrence(cursor, user_id, pairs, 1)
+
+def _forget_entity_mentions(cursor, user_id: str, session_id: str):
+    """Remove a session's mentions from the entity index and its pairs from the co-occurrence counts"""
+    cursor.execute("""
+        SELECT DISTINCT entity_type, entity_name FROM entity_mentions WHERE user_id = ? AND session_id = ?
+    """, (user_id, session_id))
+    session_keys = sorted(f"{row[0]}:{row[1]}" for row in cursor.fetchall())
+    _adjust_cooccurrence(cursor, user_id, [
+        (key, other_key) for i, key in enumerate(session_keys) for other_key in session_keys[i + 1:]
+    ], -1)
+    cursor.execute("DELETE FROM entity_mentions WHERE user_id = ? AND session_id = ?", (user_id, session_id))
+
+def _rebuild_entity_index(cursor):
+    """Rebuild entity mentions and co-occurrence counts from the stored entities"""
+    cursor.execute("DELETE FROM entity_mentions")
+    cursor.execute("DELETE FROM entity_cooccurrence")
+    cursor.execute("""
+        SELECT user_id, session_id, NULL AS agent, entity_type, entity_data, timestamp FROM session_entities
+        UNION ALL
+        SELECT user_id, session_id, agent, entity_type, entity_data, timestamp FROM agent_entities
+        ORDER BY user_id, session_id, timestamp
+    """)
+
+    mentions_by_session = {}
+    for row in cursor.fetchall():
+        if row[0] is not None:
+            mentions_by_session.setdefault((row[0], row[1]), []).append((row[2], row[3], json.loads(row[4]), row[5]))
+    for (user_id, session_id), mentions in mentions_by_session.items():
+        _record_entity_mentions(cursor, user_id, session_id, mentions)
+
+def _fts_phrase(value: str) -> str:
+    """Quote a value as an FTS5 phrase"""
+    return '"' + value.replace('"', '""') + '"'
+
+def _index_search_rows(cursor, rows: List[tuple]):
+    """Add (user_id, session_id, source, content, timestamp) rows to the full-text search index"""
+    if not FTS5_AVAILABLE:
+        return
+    cursor.executemany("""
+        INSERT INTO conversation_search (content, normalized, user_id, session_id, source, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, [
+        (content, normalize_search_text(content), user_id, session_id, source, timestamp)
+        for user_id, session_id, source, content, timestamp in rows
+        if content and user_id
+    ])
+
+def _delete_search_rows(cursor, user_id: str, session_id: str):
+    """Remove a session's rows from the full-text search index"""
+    if not FTS5_AVAILABLE:
+        return
+    cursor.execute("""
+        DELETE FROM conversation_search WHERE rowid IN (
+            SELECT rowid FROM conversation_search
+            WHERE conversation_search MATCH ? AND user_id = ? AND session_id = ?
+        )
+    """, (f"user_id : {_fts_phrase(user_id)}", user_id, session_id))
+
+def _rebuild_search_index(cursor):
+    """Re-index all messages, archived messages and entities for full-text search"""
+    if not FTS5_AVAILABLE:
+        return
+    cursor.execute("DELETE FROM conversation_search")
+
+    cursor.execute("SELECT user_id, session_id, content, timestamp FROM messages")
+    _index_search_rows(cursor, [(row[0], row[1], "message", row[2], row[3]) for row in cursor.fetchall()])
+
+    cursor.execute("SELECT user_id, session_id, payload FROM session_archives")
+    for row in cursor.fetchall():
+        _index_search_rows(cursor, [
+            (row[0], row[1], "message", message.get("content"), message.get("timestamp"))
+            for message in json.loads(zlib.decompress(row[2]).decode("utf-8"))
+        ])
+
+    for table in ("session_entities", "agent_entities"):
+        cursor.execute(f"SELECT user_id, session_id, entity_type, entity_data, timestamp FROM {table}")
+        _index_search_rows(cursor, [
+            (row[0], row[1], row[2], entity_search_text(json.loads(row[3])), row[4]) for row in cursor.fetchall()
+        ])
+
+def search_conversations_sql(user_id: str, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+    """Search a user's messages and entities, best matches first"""
+    fts_query = build_fts_query(query)
+    if not fts_query:
+        return []
+    if not FTS5_AVAILABLE:
+        raise RuntimeError("SQLite FTS5 is not available")
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
         cursor.execute("""
-            CREATE TABLE IF NOT EXISTS local_healthcare (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name VARCHAR(200),
-                type TEXT CHECK (type IN ('hospital', 'clinic', 'pharmacy', 'lab')),
-                city VARCHAR(50),
-                area VARCHAR(100),
-                address TEXT,
-                phone VARCHAR(15),
-                emergency_services BOOLEAN DEFAULT FALSE,
-                accepts_sehat_card BOOLEAN DEFAULT FALSE,
-                specializations TEXT, -- JSON string
-                rating DECIMAL(2,1),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        conn.commit()
-        print("Database initialized successfully!")
+            SELECT session_id, source, content, timestamp,
+                   bm25(conversation_search, 0.0, 1.0, 0.0) AS rank
+            FROM conversation_search
+            WHERE conversation_search MATCH ? AND user_id = ?
+            ORDER BY rank, timestamp DESC
+            LIMIT ?
+        """, (f"user_id : {_fts_phrase(user_id)} AND normalized : ({fts_query})", user_id, limit))
+
+        query_tokens = search_tokens(query)
+        return [
+            {
+                "session_id": row["session_id"],
+                "source": row["source"],
+                "snippet": make_snippet(row["content"], query_tokens),
+                "timestamp": row["timestamp"],
+                "score": round(-row["rank"], 4)
+            }
+            for row in cursor.fetchall()
+        ]
+
+def dedupe_entities_sql() -> Dict[str, Any]:
+    """Remove duplicate NER entities from the conversation store"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            removed = _dedupe_entity_rows(cursor)
+            _rebuild_session_counts(cursor)
+            _rebuild_entity_summary(cursor)
+            _rebuild_search_index(cursor)
+            _rebuild_entity_index(cursor)
+            conn.commit()
+            return {"success": True, "removed": removed, "message": f"Removed {removed} duplicate entities"}
+
+    except Exception as e:
+        return {"success": False, "removed": 0, "message": f"Error deduplicating entities: {str(e)}"}
 
 # User Management Functions
 def create_user_sql(user_data: Dict[str, Any]) -> Dict[str, Any]:
@@ -227,70 +936,70 @@ def update_user_last_active_sql(user_id: str):
     except Exception as e:
         print(f"Error updating last active for {user_id}: {e}")
 
+def record_user_activity_sql(user_id: str, timestamp: Optional[str] = None):
+    """Record user's last active timestamp in the activity table"""
+    timestamp = timestamp or datetime.now().isoformat()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO user_activity (user_id, last_active) VALUES (?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET last_active = excluded.last_active
+        """, (user_id, timestamp))
+        cursor.execute("UPDATE users SET last_active = ? WHERE user_id = ?", (timestamp, user_id))
+        conn.commit()
+
+def get_user_last_active_sql(user_id: str) -> Optional[str]:
+    """Get user's last active timestamp from the activity table"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT last_active FROM user_activity WHERE user_id = ?", (user_id,))
+        row = cursor.fetchone()
+        return row["last_active"] if row else None
+
 # Profile Management Functions
+PROFILE_FIELDS = (
+    "age", "gender", "height", "current_weight", "target_weight", "initial_weight",
+    "activity_level", "diet_type", "city", "area", "preferred_language"
+)
+
+# One statement per profile: insert, or overwrite the existing row for the user
+_UPSERT_PROFILE_SQL = f"""
+    INSERT INTO user_profiles (user_id, {", ".join(PROFILE_FIELDS)}, updated_at)
+    VALUES ({", ".join("?" * (len(PROFILE_FIELDS) + 2))})
+    ON CONFLICT (user_id) DO UPDATE SET
+        {", ".join(f"{field} = excluded.{field}" for field in PROFILE_FIELDS + ("updated_at",))}
+"""
+
+def _profile_row(profile_data: Dict[str, Any]) -> tuple:
+    """Parameters of the profile upsert for one profile"""
+    values = [profile_data.get(field) for field in PROFILE_FIELDS]
+    values[PROFILE_FIELDS.index("preferred_language")] = profile_data.get("preferred_language", "English")
+    return (profile_data["user_id"], *values, datetime.now())
+
 def create_user_profile_sql(profile_data: Dict[str, Any]) -> Dict[str, Any]:
     """Create or update user profile in SQL database"""
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
-            
-            # Check if profile exists
-            cursor.execute("SELECT id FROM user_profiles WHERE user_id = ?", (profile_data["user_id"],))
-            existing = cursor.fetchone()
-            
-            if existing:
-                # Update existing profile
-                cursor.execute("""
-                    UPDATE user_profiles 
-                    SET age = ?, gender = ?, height = ?, current_weight = ?, target_weight = ?,
-                        initial_weight = ?, activity_level = ?, diet_type = ?, city = ?, area = ?,
-                        preferred_language = ?, updated_at = ?
-                    WHERE user_id = ?
-                """, (
-                    profile_data.get("age"),
-                    profile_data.get("gender"),
-                    profile_data.get("height"),
-                    profile_data.get("current_weight"),
-                    profile_data.get("target_weight"),
-                    profile_data.get("initial_weight"),
-                    profile_data.get("activity_level"),
-                    profile_data.get("diet_type"),
-                    profile_data.get("city"),
-                    profile_data.get("area"),
-                    profile_data.get("preferred_language", "English"),
-                    datetime.now(),
-                    profile_data["user_id"]
-                ))
-                message = "Profile updated successfully"
-            else:
-                # Create new profile
-                cursor.execute("""
-                    INSERT INTO user_profiles 
-                    (user_id, age, gender, height, current_weight, target_weight, initial_weight,
-                     activity_level, diet_type, city, area, preferred_language)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    profile_data["user_id"],
-                    profile_data.get("age"),
-                    profile_data.get("gender"),
-                    profile_data.get("height"),
-                    profile_data.get("current_weight"),
-                    profile_data.get("target_weight"),
-                    profile_data.get("initial_weight"),
-                    profile_data.get("activity_level"),
-                    profile_data.get("diet_type"),
-                    profile_data.get("city"),
-                    profile_data.get("area"),
-                    profile_data.get("preferred_language", "English")
-                ))
-                message = "Profile created successfully"
-            
+            cursor.execute(_UPSERT_PROFILE_SQL, _profile_row(profile_data))
             conn.commit()
-            return {"success": True, "message": message}
+            return {"success": True, "message": "Profile saved successfully"}
     
     except Exception as e:
         return {"success": False, "message": f"Error managing profile: {str(e)}"}
 
+def create_user_profiles_batch_sql(profiles: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Create or update many user profiles in one transaction"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(_UPSERT_PROFILE_SQL, [_profile_row(profile) for profile in profiles])
+            conn.commit()
+            return {"success": True, "saved": len(profiles), "message": f"Saved {len(profiles)} profiles"}
+    
+    except Exception as e:
+        return {"success": False, "saved": 0, "message": f"Error saving profiles: {str(e)}"}
+
 def get_user_profile_sql(user_id: str) -> Optional[Dict[str, Any]]:
     """Get user profile from SQL database"""
     try:
@@ -308,67 +1017,47 @@ def get_user_profile_sql(user_id: str) -> Optional[Dict[str, Any]]:
         return None
 
 # Health Data Functions
+HEALTH_FIELDS = (
+    "weight", "blood_pressure_systolic", "blood_pressure_diastolic", "blood_sugar",
+    "stress_level", "sleep_hours", "mood_rating", "notes"
+)
+
+# One record per user and day (idx_health_data_user_date): later logs for a day replace it
+_UPSERT_HEALTH_SQL = f"""
+    INSERT INTO health_data (user_id, date, {", ".join(HEALTH_FIELDS)})
+    VALUES ({", ".join("?" * (len(HEALTH_FIELDS) + 2))})
+    ON CONFLICT (user_id, date) DO UPDATE SET
+        {", ".join(f"{field} = excluded.{field}" for field in HEALTH_FIELDS)}
+"""
+
+def _health_row(health_data: Dict[str, Any]) -> tuple:
+    """Parameters of the health data upsert for one day"""
+    return (health_data["user_id"], health_data["date"], *(health_data.get(field) for field in HEALTH_FIELDS))
+
 def log_health_data_sql(health_data: Dict[str, Any]) -> Dict[str, Any]:
     """Log daily health data"""
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
-            
-            # Check if data for this date already exists
-            cursor.execute("""
-                SELECT id FROM health_data 
-                WHERE user_id = ? AND date = ?
-            """, (health_data["user_id"], health_data["date"]))
-            
-            existing = cursor.fetchone()
-            
-            if existing:
-                # Update existing record
-                cursor.execute("""
-                    UPDATE health_data 
-                    SET weight = ?, blood_pressure_systolic = ?, blood_pressure_diastolic = ?,
-                        blood_sugar = ?, stress_level = ?, sleep_hours = ?, mood_rating = ?, notes = ?
-                    WHERE user_id = ? AND date = ?
-                """, (
-                    health_data.get("weight"),
-                    health_data.get("blood_pressure_systolic"),
-                    health_data.get("blood_pressure_diastolic"),
-                    health_data.get("blood_sugar"),
-                    health_data.get("stress_level"),
-                    health_data.get("sleep_hours"),
-                    health_data.get("mood_rating"),
-                    health_data.get("notes"),
-                    health_data["user_id"],
-                    health_data["date"]
-                ))
-                message = "Health data updated successfully"
-            else:
-                # Insert new record
-                cursor.execute("""
-                    INSERT INTO health_data 
-                    (user_id, date, weight, blood_pressure_systolic, blood_pressure_diastolic,
-                     blood_sugar, stress_level, sleep_hours, mood_rating, notes)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    health_data["user_id"],
-                    health_data["date"],
-                    health_data.get("weight"),
-                    health_data.get("blood_pressure_systolic"),
-                    health_data.get("blood_pressure_diastolic"),
-                    health_data.get("blood_sugar"),
-                    health_data.get("stress_level"),
-                    health_data.get("sleep_hours"),
-                    health_data.get("mood_rating"),
-                    health_data.get("notes")
-                ))
-                message = "Health data logged successfully"
-            
+            cursor.execute(_UPSERT_HEALTH_SQL, _health_row(health_data))
             conn.commit()
-            return {"success": True, "message": message}
+            return {"success": True, "message": "Health data saved successfully"}
     
     except Exception as e:
         return {"success": False, "message": f"Error logging health data: {str(e)}"}
 
+def log_health_data_batch_sql(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Log many days of health data in one transaction"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(_UPSERT_HEALTH_SQL, [_health_row(record) for record in records])
+            conn.commit()
+            return {"success": True, "saved": len(records), "message": f"Saved {len(records)} health records"}
+    
+    except Exception as e:
+        return {"success": False, "saved": 0, "message": f"Error logging health data: {str(e)}"}
+
 def get_user_health_history_sql(user_id: str, days: int = 30) -> List[Dict[str, Any]]:
     """Get user's health history for the last N days"""
     try:
@@ -466,6 +1155,834 @@ def get_user_sessions_sql(user_id: str, agent_type: Optional[str] = None) -> Lis
         print(f"Error getting sessions for {user_id}: {e}")
         return []
 
+# Conversation Store Functions
+VALID_AGENT_TYPES = ("MENTAL_HEALTH", "DIET", "EXERCISE")
+GENERAL_ENTITY_TYPES = ("people", "places", "events", "substances")
+
+def _to_iso(value) -> str:
+    """Normalize a timestamp value to an ISO string"""
+    if value is None:
+        return datetime.now().isoformat()
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+_entity_key = entity_key
+
+def _touch_session(cursor, user_id: str, session_id: str, timestamp: str,
+                   agent_type: Optional[str] = None, message_delta: int = 0,
+                   entity_delta: int = 0, agent_entity_delta: int = 0):
+    """Create the session row if needed and record new activity and counts on it"""
+    if agent_type not in VALID_AGENT_TYPES:
+        agent_type = None
+    cursor.execute("""
+        INSERT INTO sessions (session_id, user_id, agent_type, start_time, end_time,
+                              total_messages, entity_count, agent_entity_count)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(session_id) DO UPDATE SET
+            agent_type = COALESCE(sessions.agent_type, excluded.agent_type),
+            end_time = MAX(COALESCE(sessions.end_time, ''), excluded.end_time),
+            total_messages = COALESCE(sessions.total_messages, 0) + excluded.total_messages,
+            entity_count = COALESCE(sessions.entity_count, 0) + excluded.entity_count,
+            agent_entity_count = COALESCE(sessions.agent_entity_count, 0) + excluded.agent_entity_count
+    """, (session_id, user_id, agent_type, timestamp, timestamp,
+          message_delta, entity_delta, agent_entity_delta))
+
+def _entity_row_to_dict(row) -> Dict[str, Any]:
+    """Decode a stored entity row back into its dictionary form"""
+    entity = json.loads(row["entity_data"])
+    if row["timestamp"]:
+        entity["timestamp"] = row["timestamp"]
+    return entity
+
+def add_message_sql(message_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Append a message to a session conversation"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            timestamp = _to_iso(message_data.get("timestamp"))
+
+            cursor.execute("""
+                INSERT INTO messages (user_id, session_id, message_type, content, timestamp)
+                VALUES (?, ?, ?, ?, ?)
+            """, (
+                message_data["user_id"],
+                message_data["session_id"],
+                message_data.get("message_type"),
+                message_data.get("content", ""),
+                timestamp
+            ))
+            _touch_session(cursor, message_data["user_id"], message_data["session_id"], timestamp,
+                           message_data.get("agent_type"), message_delta=1)
+            _index_search_rows(cursor, [(message_data["user_id"], message_data["session_id"], "message",
+                                         message_data.get("content", ""), timestamp)])
+
+            conn.commit()
+            return {"success": True, "message": "Message saved successfully"}
+
+    except Exception as e:
+        return {"success": False, "message": f"Error saving message: {str(e)}"}
+
+def _load_archived_messages(cursor, user_id: str, session_id: str) -> List[Dict[str, Any]]:
+    """Decompress the archived messages of a session, if it has any"""
+    cursor.execute("SELECT payload FROM session_archives WHERE session_id = ? AND user_id = ?", (session_id, user_id))
+    row = cursor.fetchone()
+    return json.loads(zlib.decompress(row["payload"]).decode("utf-8")) if row else []
+
+def get_session_messages_sql(user_id: str, session_id: str) -> List[Dict[str, Any]]:
+    """Get the conversation messages of a session in chronological order, including archived ones"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            archived_messages = _load_archived_messages(cursor, user_id, session_id)
+            cursor.execute("""
+                SELECT content, message_type AS type, timestamp FROM messages
+                WHERE user_id = ? AND session_id = ?
+                ORDER BY timestamp, id
+            """, (user_id, session_id))
+
+            return archived_messages + [dict(row) for row in cursor.fetchall()]
+
+    except Exception as e:
+        print(f"Error getting messages for session {session_id}: {e}")
+        return []
+
+def _insert_session_entities(cursor, user_id: str, session_id: str, entities: List[tuple]) -> int:
+    """Insert (entity_type, entity, timestamp) rows, skipping duplicates, and count new ones in the summary"""
+    inserted = []
+    for entity_type, entity, timestamp in entities:
+        # The fingerprint index makes repeats a no-op
+        cursor.execute("""
+            INSERT OR IGNORE INTO session_entities
+            (user_id, session_id, entity_type, entity_data, fingerprint, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (user_id, session_id, entity_type, _entity_key(entity), entity_fingerprint(entity), timestamp))
+        if cursor.rowcount == 1:
+            inserted.append((entity_type, entity, timestamp))
+
+    _adjust_entity_summary(cursor, user_id, [(entity_type, entity) for entity_type, entity, _ in inserted], 1)
+    _record_entity_mentions(cursor, user_id, session_id, [
+        (None, entity_type, entity, timestamp) for entity_type, entity, timestamp in inserted
+    ])
+    _index_search_rows(cursor, [
+        (user_id, session_id, entity_type, entity_search_text(entity), timestamp)
+        for entity_type, entity, timestamp in inserted
+    ])
+    return len(inserted)
+
+def _insert_agent_entities(cursor, user_id: str, session_id: str, entities: List[tuple]) -> int:
+    """Insert (agent, entity_type, entity, timestamp) rows, skipping duplicates, and index new ones for search"""
+    inserted = []
+    for agent, entity_type, entity, timestamp in entities:
+        cursor.execute("""
+            INSERT OR IGNORE INTO agent_entities
+            (user_id, session_id, agent, entity_type, entity_data, fingerprint, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (user_id, session_id, agent, entity_type, _entity_key(entity), entity_fingerprint(entity), timestamp))
+        if cursor.rowcount == 1:
+            inserted.append((agent, entity_type, entity, timestamp))
+
+    _record_entity_mentions(cursor, user_id, session_id, inserted)
+    _index_search_rows(cursor, [
+        (user_id, session_id, entity_type, entity_search_text(entity), timestamp)
+        for _agent, entity_type, entity, timestamp in inserted
+    ])
+    return len(inserted)
+
+def add_session_entities_sql(user_id: str, session_id: str, entities: Dict[str, List[Dict[str, Any]]],
+                             timestamp=None) -> Dict[str, Any]:
+    """Add general NER entities to a session, skipping ones already recorded"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            timestamp = _to_iso(timestamp)
+
+            added = _insert_session_entities(cursor, user_id, session_id, [
+                (entity_type, item, timestamp)
+                for entity_type, items in entities.items()
+                for item in items
+            ])
+
+            _touch_session(cursor, user_id, session_id, timestamp, entity_delta=added)
+            conn.commit()
+            return {"success": True, "message": f"{added} entities saved successfully"}
+
+    except Exception as e:
+        return {"success": False, "message": f"Error saving session entities: {str(e)}"}
+
+def add_agent_entities_sql(user_id: str, session_id: str, agent: str,
+                           entities: Dict[str, List[Dict[str, Any]]], timestamp=None) -> Dict[str, Any]:
+    """Add agent-specific NER entities to a session"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            timestamp = _to_iso(timestamp)
+
+            added = _insert_agent_entities(cursor, user_id, session_id, [
+                (agent, entity_type, item, timestamp)
+                for entity_type, items in entities.items()
+                for item in items
+            ])
+
+            _touch_session(cursor, user_id, session_id, timestamp, agent, agent_entity_delta=added)
+            conn.commit()
+            return {"success": True, "message": f"{added} entities saved successfully"}
+
+    except Exception as e:
+        return {"success": False, "message": f"Error saving agent entities: {str(e)}"}
+
+def get_session_entities_sql(user_id: str, session_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Get general NER entities for a user, optionally limited to one session"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+
+            if session_id:
+                cursor.execute("""
+                    SELECT session_id, entity_type, entity_data, timestamp FROM session_entities
+                    WHERE user_id = ? AND session_id = ?
+                    ORDER BY id
+                """, (user_id, session_id))
+            else:
+                cursor.execute("""
+                    SELECT session_id, entity_type, entity_data, timestamp FROM session_entities
+                    WHERE user_id = ?
+                    ORDER BY id
+                """, (user_id,))
+
+            return [
+                {"session_id": row["session_id"], "entity_type": row["entity_type"], "entity": _entity_row_to_dict(row)}
+                for row in cursor.fetchall()
+            ]
+
+    except Exception as e:
+        print(f"Error getting session entities for {user_id}: {e}")
+        return []
+
+def get_agent_entities_sql(user_id: str, agent: Optional[str] = None,
+                           session_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Get agent-specific NER entities for a user, filtered by agent and/or session"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+
+            query = """
+                SELECT session_id, agent, entity_type, entity_data, timestamp FROM agent_entities
+                WHERE user_id = ?
+            """
+            params = [user_id]
+            if agent:
+                query += " AND agent = ?"
+                params.append(agent)
+            if session_id:
+                query += " AND session_id = ?"
+                params.append(session_id)
+            cursor.execute(query + " ORDER BY id", params)
+
+            return [
+                {
+                    "session_id": row["session_id"],
+                    "agent": row["agent"],
+                    "entity_type": row["entity_type"],
+                    "entity": _entity_row_to_dict(row)
+                }
+                for row in cursor.fetchall()
+            ]
+
+    except Exception as e:
+        print(f"Error getting agent entities for {user_id}: {e}")
+        return []
+
+def get_conversation_sessions_sql(user_id: str) -> List[Dict[str, Any]]:
+    """Get a user's conversation sessions, oldest first"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT * FROM sessions
+                WHERE user_id = ?
+                ORDER BY start_time, id
+            """, (user_id,))
+
+            return [dict(row) for row in cursor.fetchall()]
+
+    except Exception as e:
+        print(f"Error getting conversation sessions for {user_id}: {e}")
+        return []
+
+def get_entity_summary_sql(user_id: str) -> Dict[str, Dict[str, int]]:
+    """Get a user's unique entity names with their reference counts, by entity type"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT entity_type, name, ref_count FROM entity_summary
+                WHERE user_id = ? AND ref_count > 0
+            """, (user_id,))
+
+            summary = {entity_type: {} for entity_type in GENERAL_ENTITY_TYPES}
+            for row in cursor.fetchall():
+                summary.setdefault(row["entity_type"], {})[row["name"]] = row["ref_count"]
+            return summary
+
+    except Exception as e:
+        print(f"Error getting entity summary for {user_id}: {e}")
+        return {entity_type: {} for entity_type in GENERAL_ENTITY_TYPES}
+
+def get_entity_stats_sql(user_id: str, entity_types: Optional[List[str]] = None, attribute: Optional[str] = None,
+                         agent: Optional[str] = None, general_only: bool = False,
+                         limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Get mention counts and first/last mentions of a user's entities, most mentioned first"""
+    conditions = ["user_id = ?"]
+    params = [user_id]
+    if entity_types:
+        conditions.append(f"entity_type IN ({', '.join('?' for _ in entity_types)})")
+        params.extend(entity_types)
+    if attribute:
+        conditions.append("attribute = ?")
+        params.append(attribute)
+    if agent:
+        conditions.append("agent = ?")
+        params.append(agent)
+    if general_only:
+        conditions.append("agent IS NULL")
+
+    query = f"""
+        SELECT m.entity_type, m.entity_name, m.session_id, m.entity_data, m.timestamp AS first_mentioned,
+               g.mentions, g.sessions, g.last_mentioned
+        FROM (
+            SELECT MIN(id) AS first_id, COUNT(*) AS mentions, COUNT(DISTINCT session_id) AS sessions,
+                   MAX(timestamp) AS last_mentioned
+            FROM entity_mentions
+            WHERE {' AND '.join(conditions)}
+            GROUP BY entity_type, entity_name
+        ) g
+        JOIN entity_mentions m ON m.id = g.first_id
+        ORDER BY g.mentions DESC, g.last_mentioned DESC
+    """
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        results = []
+        for row in cursor.fetchall():
+            entity = json.loads(row["entity_data"])
+            results.append({
+                "entity_type": row["entity_type"],
+                "name": entity_name(row["entity_type"], entity) or row["entity_name"],
+                "key": f"{row['entity_type']}:{row['entity_name']}",
+                "mentions": row["mentions"],
+                "sessions": row["sessions"],
+                "first_mentioned": row["first_mentioned"],
+                "last_mentioned": row["last_mentioned"],
+                "session_id": row["session_id"],
+                "entity": entity
+            })
+        return results
+
+def get_entity_mentions_sql(user_id: str, entity_type: str, name: str, limit: int = 50) -> List[Dict[str, Any]]:
+    """Get the mentions of one entity across sessions, newest first"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT session_id, agent, attribute, entity_data, timestamp FROM entity_mentions
+            WHERE user_id = ? AND entity_type = ? AND entity_name = ?
+            ORDER BY timestamp DESC
+            LIMIT ?
+        """, (user_id, entity_type, canonical_entity_name(name), limit))
+        return [
+            {
+                "session_id": row["session_id"],
+                "agent": row["agent"],
+                "attribute": row["attribute"],
+                "timestamp": row["timestamp"],
+                "entity": json.loads(row["entity_data"])
+            }
+            for row in cursor.fetchall()
+        ]
+
+def get_cooccurring_entities_sql(user_id: str, entity_type: str, name: str, related_type: Optional[str] = None,
+                                 limit: int = 10) -> List[Dict[str, Any]]:
+    """Get the entities mentioned in the most sessions together with one entity"""
+    params = [user_id, f"{entity_type}:{canonical_entity_name(name)}"]
+    type_filter = ""
+    if related_type:
+        # Range on the primary key instead of LIKE so the lookup stays an index seek
+        type_filter = "AND related_key >= ? AND related_key < ?"
+        params.extend([f"{related_type}:", f"{related_type};"])
+    params.append(limit)
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT related_key, session_count FROM entity_cooccurrence
+            WHERE user_id = ? AND entity_key = ? {type_filter}
+            ORDER BY session_count DESC, related_key
+            LIMIT ?
+        """, params)
+        results = []
+        for row in cursor.fetchall():
+            related_entity_type, related_name = row["related_key"].split(":", 1)
+            results.append({
+                "entity_type": related_entity_type,
+                "name": related_name,
+                "sessions": row["session_count"]
+            })
+        return results
+
+def get_session_index_sql(user_id: str) -> List[Dict[str, Any]]:
+    """Get a user's session index (agent, times and counts, no bodies), oldest first"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT session_id, agent_type, start_time, end_time,
+                       total_messages, entity_count, agent_entity_count, archived_at
+                FROM sessions
+                WHERE user_id = ?
+                ORDER BY start_time, id
+            """, (user_id,))
+
+            return [
+                {
+                    "session_id": row["session_id"],
+                    "agent": row["agent_type"],
+                    "created_at": row["start_time"],
+                    "last_updated": row["end_time"] or row["start_time"],
+                    "message_count": row["total_messages"] or 0,
+                    "entity_count": row["entity_count"] or 0,
+                    "agent_entity_count": row["agent_entity_count"] or 0,
+                    "archived": row["archived_at"] is not None
+                }
+                for row in cursor.fetchall()
+            ]
+
+    except Exception as e:
+        print(f"Error getting session index for {user_id}: {e}")
+        return []
+
+def get_user_threads_sql(user_id: str) -> List[Dict[str, Any]]:
+    """Get a user's threads from the thread registry, oldest first"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT thread_id, agent, created_at, last_message_at, message_count
+                FROM threads
+                WHERE user_id = ?
+                ORDER BY created_at, id
+            """, (user_id,))
+            return [dict(row) for row in cursor.fetchall()]
+
+    except Exception as e:
+        print(f"Error getting threads for {user_id}: {e}")
+        return []
+
+def get_all_thread_ids_sql() -> List[str]:
+    """Get the ID of every registered thread"""
+    with get_db_connection() as conn:
+        return [row[0] for row in conn.execute("SELECT thread_id FROM threads")]
+
+def set_thread_agents_sql(user_id: str, agents: Dict[str, str]) -> Dict[str, Any]:
+    """Record the agent of threads registered without one"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                "UPDATE sessions SET agent_type = ? WHERE user_id = ? AND session_id = ? AND agent_type IS NULL",
+                [(agent, user_id, thread_id) for thread_id, agent in agents.items() if agent in VALID_AGENT_TYPES]
+            )
+            conn.commit()
+            return {"success": True, "message": f"Recorded agents for {cursor.rowcount} threads"}
+
+    except Exception as e:
+        return {"success": False, "message": f"Error recording thread agents: {str(e)}"}
+
+def user_has_conversation_data_sql(user_id: str) -> bool:
+    """Check whether a user has any stored messages or entities"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT EXISTS (
+                    SELECT 1 FROM sessions
+                    WHERE user_id = ?
+                      AND (total_messages > 0 OR entity_count > 0 OR agent_entity_count > 0)
+                )
+            """, (user_id,))
+            return bool(cursor.fetchone()[0])
+
+    except Exception as e:
+        print(f"Error checking conversation data for {user_id}: {e}")
+        return False
+
+def delete_session_data_sql(user_id: str, session_id: str) -> Dict[str, Any]:
+    """Delete a session with all of its messages and entities"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            deleted = 0
+
+            cursor.execute("""
+                SELECT entity_type, entity_data FROM session_entities WHERE user_id = ? AND session_id = ?
+            """, (user_id, session_id))
+            _adjust_entity_summary(cursor, user_id, [
+                (row["entity_type"], json.loads(row["entity_data"])) for row in cursor.fetchall()
+            ], -1)
+            _delete_search_rows(cursor, user_id, session_id)
+            _forget_entity_mentions(cursor, user_id, session_id)
+
+            for table in ("messages", "session_entities", "agent_entities", "session_archives"):
+                cursor.execute(f"DELETE FROM {table} WHERE user_id = ? AND session_id = ?", (user_id, session_id))
+                deleted += cursor.rowcount
+            cursor.execute("DELETE FROM sessions WHERE user_id = ? AND session_id = ?", (user_id, session_id))
+            deleted += cursor.rowcount
+
+            conn.commit()
+            if deleted:
+                return {"success": True, "message": "Session deleted successfully"}
+            return {"success": False, "message": "Session not found"}
+
+    except Exception as e:
+        return {"success": False, "message": f"Error deleting session: {str(e)}"}
+
+def get_idle_sessions_sql(cutoff: str, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Get sessions inactive since before the cutoff that still have messages in the hot table"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            query = """
+                SELECT s.user_id, s.session_id FROM sessions s
+                WHERE COALESCE(s.end_time, s.start_time) < ?
+                  AND EXISTS (SELECT 1 FROM messages m WHERE m.user_id = s.user_id AND m.session_id = s.session_id)
+            """
+            params = [cutoff]
+            if user_id:
+                query += " AND s.user_id = ?"
+                params.append(user_id)
+            cursor.execute(query, params)
+            return [dict(row) for row in cursor.fetchall()]
+
+    except Exception as e:
+        print(f"Error getting idle sessions: {e}")
+        return []
+
+def archive_session_sql(user_id: str, session_id: str) -> Dict[str, Any]:
+    """Move a session's messages into its compressed archive row"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            messages = _load_archived_messages(cursor, user_id, session_id)
+            cursor.execute("""
+                SELECT content, message_type AS type, timestamp FROM messages
+                WHERE user_id = ? AND session_id = ?
+                ORDER BY timestamp, id
+            """, (user_id, session_id))
+            hot_messages = [dict(row) for row in cursor.fetchall()]
+            if not hot_messages:
+                return {"success": True, "archived": 0, "message": "Nothing to archive"}
+
+            messages.extend(hot_messages)
+            archived_at = datetime.now().isoformat()
+            payload = zlib.compress(json.dumps(messages, ensure_ascii=False, default=str).encode("utf-8"))
+            cursor.execute("""
+                INSERT INTO session_archives (session_id, user_id, message_count, payload, archived_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(session_id) DO UPDATE SET
+                    message_count = excluded.message_count,
+                    payload = excluded.payload,
+                    archived_at = excluded.archived_at
+            """, (session_id, user_id, len(messages), payload, archived_at))
+            cursor.execute("DELETE FROM messages WHERE user_id = ? AND session_id = ?", (user_id, session_id))
+            cursor.execute("UPDATE sessions SET archived_at = ? WHERE session_id = ?", (archived_at, session_id))
+
+            conn.commit()
+            return {"success": True, "archived": len(hot_messages), "message": f"Archived {len(hot_messages)} messages"}
+
+    except Exception as e:
+        return {"success": False, "archived": 0, "message": f"Error archiving session: {str(e)}"}
+
+def _import_session(cursor, user_id: str, session_id: str, session_data: Dict[str, Any],
+                    update: bool = False) -> Tuple[str, int]:
+    """Write a JSON session's messages and entities, returning ("imported", "updated" or "skipped", messages added)
+
+    A session already in the database is skipped, or with update=True gets the messages past the
+    ones it already has and any new entities.
+    """
+    cursor.execute("""
+        SELECT (SELECT COUNT(*) FROM messages WHERE user_id = ? AND session_id = ?),
+               (SELECT message_count FROM session_archives WHERE user_id = ? AND session_id = ?),
+               EXISTS (SELECT 1 FROM session_entities WHERE user_id = ? AND session_id = ?)
+               OR EXISTS (SELECT 1 FROM agent_entities WHERE user_id = ? AND session_id = ?)
+    """, (user_id, session_id) * 4)
+    live_count, archived_count, has_entities = cursor.fetchone()
+    exists = bool(live_count or archived_count or has_entities)
+    if exists and not update:
+        return "skipped", 0
+
+    created_at = _to_iso(session_data.get("created_at"))
+    messages = session_data.get("messages", [])[live_count + (archived_count or 0):]
+    cursor.executemany("""
+        INSERT INTO messages (user_id, session_id, message_type, content, timestamp)
+        VALUES (?, ?, ?, ?, ?)
+    """, [
+        (user_id, session_id, message.get("type"), message.get("content", ""),
+         message.get("timestamp") or created_at)
+        for message in messages
+    ])
+    _index_search_rows(cursor, [
+        (user_id, session_id, "message", message.get("content", ""), message.get("timestamp") or created_at)
+        for message in messages
+    ])
+
+    entity_count = _insert_session_entities(cursor, user_id, session_id, [
+        (entity_type, item, item.get("timestamp") or created_at)
+        for entity_type in GENERAL_ENTITY_TYPES
+        for item in session_data.get(entity_type, [])
+        if isinstance(item, dict)
+    ])
+
+    agent_entity_count = _insert_agent_entities(cursor, user_id, session_id, [
+        (agent, entity_type, item, item.get("timestamp") or created_at)
+        for agent, agent_entities in session_data.get("agent_specific_entities", {}).items()
+        if agent in VALID_AGENT_TYPES
+        for entity_type, items in agent_entities.items()
+        for item in items
+        if isinstance(item, dict)
+    ])
+
+    agent_type = session_data.get("agent")
+    cursor.execute("""
+        INSERT INTO sessions (session_id, user_id, agent_type, start_time, end_time,
+                              total_messages, entity_count, agent_entity_count)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(session_id) DO UPDATE SET
+            total_messages = COALESCE(sessions.total_messages, 0) + excluded.total_messages,
+            entity_count = COALESCE(sessions.entity_count, 0) + excluded.entity_count,
+            agent_entity_count = COALESCE(sessions.agent_entity_count, 0) + excluded.agent_entity_count
+    """, (
+        session_id,
+        user_id,
+        agent_type if agent_type in VALID_AGENT_TYPES else None,
+        created_at,
+        _to_iso(session_data.get("last_updated") or created_at),
+        len(messages),
+        entity_count,
+        agent_entity_count
+    ))
+    return ("updated" if exists else "imported"), len(messages)
+
+def import_conversation_session_sql(user_id: str, session_id: str, session_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Import a JSON session (messages and entities) in a single transaction"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            status, message_count = _import_session(cursor, user_id, session_id, session_data)
+            if status == "skipped":
+                return {"success": True, "skipped": True, "message": "Session already exists"}
+
+            conn.commit()
+            return {"success": True, "skipped": False, "message": f"Imported {message_count} messages"}
+
+    except Exception as e:
+        return {"success": False, "skipped": False, "message": f"Error importing session: {str(e)}"}
+
+IMPORT_STATS = (
+    "users", "skipped_users", "profiles", "health_records", "sessions", "updated_sessions",
+    "skipped_sessions", "messages"
+)
+
+def import_row_count(stats: Dict[str, int]) -> int:
+    """Rows written by an import: users, profiles, health records, new sessions and messages"""
+    return stats["users"] + stats["profiles"] + stats["health_records"] + stats["sessions"] + stats["messages"]
+
+def _user_row(user_data: Dict[str, Any]) -> tuple:
+    """Parameters of the users insert for one migrated user"""
+    return (
+        user_data["user_id"], user_data["full_name"], user_data.get("cnic"), user_data.get("email"),
+        user_data.get("password_hash"), user_data.get("phone"), datetime.now()
+    )
+
+_UPSERT_USER_SQL = """
+    INSERT INTO users (user_id, full_name, cnic, email, password_hash, phone, last_active)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        full_name = excluded.full_name, cnic = excluded.cnic, email = excluded.email,
+        phone = excluded.phone, password_hash = excluded.password_hash
+"""
+
+def _import_users(cursor, users: List[Dict[str, Any]], update: bool = False) -> Dict[str, int]:
+    """Write parsed users' accounts, profiles, health logs and sessions, returning what was written"""
+    stats = dict.fromkeys(IMPORT_STATS, 0)
+
+    # Users already in the database, or whose CNIC is taken, are left as they are, unless update
+    # is set: then accounts changed in users_data.json are rewritten
+    user_rows = [_user_row(user["user"]) for user in users if user.get("user")]
+    cursor.executemany(_UPSERT_USER_SQL if update else """
+        INSERT OR IGNORE INTO users (user_id, full_name, cnic, email, password_hash, phone, last_active)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, user_rows)
+    stats["users"] = max(cursor.rowcount, 0)
+    stats["skipped_users"] = len(user_rows) - stats["users"]
+
+    profile_rows = [_profile_row(user["profile"]) for user in users if user.get("profile")]
+    cursor.executemany(_UPSERT_PROFILE_SQL, profile_rows)
+    stats["profiles"] = len(profile_rows)
+
+    health_rows = [_health_row(record) for user in users for record in user.get("health", [])]
+    cursor.executemany(_UPSERT_HEALTH_SQL, health_rows)
+    stats["health_records"] = len(health_rows)
+
+    for user in users:
+        for session_id, session_data in user.get("sessions", []):
+            status, message_count = _import_session(cursor, user["user_id"], session_id, session_data, update)
+            stats[{"imported": "sessions", "updated": "updated_sessions", "skipped": "skipped_sessions"}[status]] += 1
+            stats["messages"] += message_count
+    return stats
+
+def _record_migration_state(cursor, run_id: int, users: List[Dict[str, Any]], errors: Dict[str, str], rows: int):
+    """Checkpoint migrated sources and the run's progress, in the transaction that wrote them"""
+    now = datetime.now().isoformat()
+    cursor.executemany("""
+        INSERT INTO migration_state (source, user_id, run_id, source_mtime, source_hash, error, migrated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (source) DO UPDATE SET
+            user_id = excluded.user_id, run_id = excluded.run_id, source_mtime = excluded.source_mtime,
+            source_hash = excluded.source_hash, error = excluded.error, migrated_at = excluded.migrated_at
+    """, [
+        (user["source"], user["user_id"], run_id, user.get("mtime"), user.get("hash"),
+         errors.get(user["user_id"]) or "; ".join(user.get("errors", [])) or None, now)
+        for user in users
+    ])
+    failed = sum(1 for user in users if user["user_id"] in errors or user.get("errors"))
+    cursor.execute("""
+        UPDATE migration_runs SET done_sources = done_sources + ?, rows = rows + ? WHERE run_id = ?
+    """, (len(users) - failed, rows, run_id))
+
+def import_users_batch_sql(users: List[Dict[str, Any]], run_id: Optional[int] = None,
+                           update: bool = False) -> Dict[str, Any]:
+    """Import a batch of parsed JSON users in one transaction
+
+    Each user is a dict with user_id, user (account fields), profile, health (daily logs) and
+    sessions ((session_id, session_data) pairs). If SQLite rejects any row, the batch is redone
+    with a savepoint per user, so a user is imported completely or not at all. With a run_id,
+    each user's source, mtime and hash are checkpointed in migration_state in the same transaction.
+    """
+    errors = {}
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                stats = _import_users(cursor, users, update)
+            except sqlite3.Error:
+                conn.rollback()
+                stats = dict.fromkeys(IMPORT_STATS, 0)
+                cursor.execute("BEGIN")
+                for user in users:
+                    cursor.execute("SAVEPOINT import_user")
+                    try:
+                        for key, value in _import_users(cursor, [user], update).items():
+                            stats[key] += value
+                    except sqlite3.Error as e:
+                        cursor.execute("ROLLBACK TO import_user")
+                        errors[user["user_id"]] = str(e)
+                    cursor.execute("RELEASE import_user")
+
+            rows = import_row_count(stats)
+            if run_id is not None:
+                _record_migration_state(cursor, run_id, users, errors, rows)
+            conn.commit()
+            return {
+                "success": True, **stats, "rows": rows, "errors": list(errors.items()),
+                "message": f"Imported {stats['users']} users"
+            }
+
+    except Exception as e:
+        return {
+            "success": False, **dict.fromkeys(IMPORT_STATS, 0), "rows": 0, "errors": list(errors.items()),
+            "message": f"Error importing users: {str(e)}"
+        }
+
+def start_migration_run_sql(incremental: bool = False) -> int:
+    """Record the start of a JSON to SQL migration run, returning its ID"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO migration_runs (started_at, status, incremental) VALUES (?, 'running', ?)
+        """, (datetime.now().isoformat(), incremental))
+        conn.commit()
+        return cursor.lastrowid
+
+def update_migration_run_sql(run_id: int, **fields):
+    """Set the stage, status, total_sources or finished_at of a migration run"""
+    allowed = {"stage", "status", "total_sources", "finished_at"}
+    if not fields or not set(fields) <= allowed:
+        raise ValueError(f"Migration run fields must be among {sorted(allowed)}")
+    with get_db_connection() as conn:
+        conn.execute(
+            f"UPDATE migration_runs SET {', '.join(f'{field} = ?' for field in fields)} WHERE run_id = ?",
+            (*fields.values(), run_id)
+        )
+        conn.commit()
+
+def get_unfinished_migration_run_sql() -> Optional[Dict[str, Any]]:
+    """Latest migration run that did not complete, if it is also the latest run"""
+    with get_db_connection() as conn:
+        row = conn.execute("SELECT * FROM migration_runs ORDER BY run_id DESC LIMIT 1").fetchone()
+        return dict(row) if row and row["status"] != "completed" else None
+
+def get_migration_state_sql() -> Dict[str, Dict[str, Any]]:
+    """Checkpoint of every migrated source, keyed by source"""
+    with get_db_connection() as conn:
+        rows = conn.execute("SELECT * FROM migration_state").fetchall()
+        return {row["source"]: dict(row) for row in rows}
+
+def get_user_ids_sql() -> List[str]:
+    """IDs of every user with an account or sessions in the database"""
+    with get_db_connection() as conn:
+        rows = conn.execute("SELECT user_id FROM users UNION SELECT user_id FROM sessions").fetchall()
+        return [row["user_id"] for row in rows]
+
+def get_user_snapshot_sql(user_id: str) -> Dict[str, Any]:
+    """A user's account, profile, health logs by date and sessions with their messages, for verification"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT full_name, cnic, email, phone, password_hash FROM users WHERE user_id = ?", (user_id,))
+        user = cursor.fetchone()
+        cursor.execute(f"SELECT {', '.join(PROFILE_FIELDS)} FROM user_profiles WHERE user_id = ?", (user_id,))
+        profile = cursor.fetchone()
+        cursor.execute(f"SELECT date, {', '.join(HEALTH_FIELDS)} FROM health_data WHERE user_id = ?", (user_id,))
+        health = {row["date"]: {field: row[field] for field in HEALTH_FIELDS} for row in cursor.fetchall()}
+
+        cursor.execute("SELECT session_id, agent_type, start_time, archived_at FROM sessions WHERE user_id = ?",
+                       (user_id,))
+        sessions = {
+            row["session_id"]: {
+                "agent": row["agent_type"],
+                "start_time": row["start_time"],
+                "messages": _load_archived_messages(cursor, user_id, row["session_id"]) if row["archived_at"] else []
+            }
+            for row in cursor.fetchall()
+        }
+        cursor.execute("""
+            SELECT session_id, message_type AS type, content, timestamp FROM messages
+            WHERE user_id = ?
+            ORDER BY session_id, timestamp, id
+        """, (user_id,))
+        for row in cursor.fetchall():
+            session = sessions.setdefault(row["session_id"], {"agent": None, "start_time": None, "messages": []})
+            session["messages"].append({"type": row["type"], "content": row["content"], "timestamp": row["timestamp"]})
+
+        return {
+            "user": dict(user) if user else None,
+            "profile": dict(profile) if profile else None,
+            "health": health,
+            "sessions": sessions
+        }
+
 # Migration Functions
 def migrate_json_to_sql():
     """Migrate existing JSON data to SQL database"""
@@ -474,12 +1991,12 @@ def migrate_json_to_sql():
     # Initialize database first
     init_database()
     
-    # Import the existing backend functions
+    # Import the JSON data access functions
     try:
-        from backend import load_users_data, load_user_wellness_data, get_all_users
+        from storage import load_users_data, load_user_wellness_data
         
         # Migrate users
-        users_data = get_all_users()
+        users_data = load_users_data()
         migrated_users = 0
         
         for user_id, user_info in users_data.items():
@@ -510,7 +2027,7 @@ def migrate_json_to_sql():
         print(f"Successfully migrated {migrated_users} users to SQL database")
         
     except ImportError:
-        print("Cannot import backend functions. Make sure backend.py is available.")
+        print("Cannot import storage functions. Make sure storage.py is available.")
     except Exception as e:
         print(f"Migration error: {e}")
 
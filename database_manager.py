@@ -5,59 +5,41 @@ Handles migration, backup, and maintenance operations
 """
 
 import os
-import json
 import sqlite3
 import shutil
+import sys
 from datetime import datetime, date
 from typing import Dict, Any, List
 import argparse
+import random
+import tempfile
+import threading
+import time
 
 # Import our database module
 try:
+    import database
     from database import (
-        init_database, create_user_sql, create_user_profile_sql,
-        log_health_data_sql, create_session_sql, get_db_connection
+        init_database, create_user_sql,
+        log_health_data_sql, create_session_sql, get_db_connection,
+        dedupe_entities_sql, get_user_sql, check_query_plans_sql,
+        get_schema_version, migrate_schema, SCHEMA_VERSION, start_migration_run_sql,
+        update_migration_run_sql, get_unfinished_migration_run_sql
     )
+    from migration import run_bulk_migration, run_verification
     DATABASE_AVAILABLE = True
 except ImportError:
     DATABASE_AVAILABLE = False
     print("Database module not available")
 
-# Import existing backend functions
-try:
-    import sys
-    import os
-    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-    
-    from backend import (
-        load_users_data, load_user_wellness_data, 
-        get_all_users, WELLNESS_DATA_DIR, USERS_DATA_FILE
-    )
-    BACKEND_AVAILABLE = True
-except ImportError as e:
-    BACKEND_AVAILABLE = False
-    print(f"Backend module not available: {e}")
-    # Set fallback values
-    WELLNESS_DATA_DIR = "wellness_data"
-    USERS_DATA_FILE = "users_data.json"
-    
-    # Fallback functions
-    def get_all_users():
-        """Fallback function to load users from JSON"""
-        if os.path.exists(USERS_DATA_FILE):
-            with open(USERS_DATA_FILE, 'r') as f:
-                return json.load(f)
-        return {}
-    
-    def load_user_wellness_data(user_id):
-        """Fallback function to load user wellness data"""
-        wellness_file = os.path.join(WELLNESS_DATA_DIR, f"{user_id}_wellness.json")
-        if os.path.exists(wellness_file):
-            with open(wellness_file, 'r') as f:
-                return json.load(f)
-        return {}
-    
-    BACKEND_AVAILABLE = True  # We have fallback functions
+# JSON data access lives in storage, so the CLI starts without importing backend and its models
+from storage import (
+    USERS_DATA_FILE, WELLNESS_DATA_DIR, WELLNESS_SHARD_LEVELS, MAX_SHARD_LEVELS,
+    iter_wellness_files, reshard_wellness_data, load_users_data
+)
+from history_store import (
+    HISTORY_DB_FILE, CHECKPOINT_RETENTION, prune_checkpoints, compact_history_db, reclaim_history_space
+)
 
 def backup_json_data():
     """Backup existing JSON data before migration"""
@@ -77,222 +59,60 @@ def backup_json_data():
     
     # Backup wellness data directory
     if os.path.exists(WELLNESS_DATA_DIR):
-        shutil.copytree(WELLNESS_DATA_DIR, os.path.join(backup_dir, WELLNESS_DATA_DIR))
+        shutil.copytree(WELLNESS_DATA_DIR, os.path.join(backup_dir, WELLNESS_DATA_DIR), dirs_exist_ok=True)
         print(f"✓ Backed up {WELLNESS_DATA_DIR}/")
     
     # Backup ner_data directory if it exists
     if os.path.exists("ner_data"):
-        shutil.copytree("ner_data", os.path.join(backup_dir, "ner_data"))
+        shutil.copytree("ner_data", os.path.join(backup_dir, "ner_data"), dirs_exist_ok=True)
         print(f"✓ Backed up ner_data/")
     
     # Backup existing database if it exists
     if os.path.exists("wellness_app.db"):
-        shutil.copy2("wellness_app.db", os.path.join(backup_dir, "wellness_app.db"))
+        # Online backup, so commits still in the WAL file are included
+        source = sqlite3.connect("wellness_app.db")
+        target = sqlite3.connect(os.path.join(backup_dir, "wellness_app.db"))
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
         print(f"✓ Backed up wellness_app.db")
     
     return backup_dir
 
-def migrate_users_to_sql():
-    """Migrate user data from JSON to SQL"""
-    if not (DATABASE_AVAILABLE and BACKEND_AVAILABLE):
-        print("❌ Cannot migrate: Required modules not available")
+def migrate_json_data(workers=None, run_id=None, resume=False, incremental=False, since=None):
+    """Migrate users, profiles, health logs and conversations from JSON to SQL in bulk"""
+    if not DATABASE_AVAILABLE:
+        print("❌ Cannot migrate: Database module not available")
         return False
     
-    print("🔄 Migrating users from JSON to SQL...")
-    
+    print("🔄 Migrating JSON data to SQL...")
     try:
-        users_data = get_all_users()
-        migrated_count = 0
-        skipped_count = 0
-        error_count = 0
-        
-        print(f"Found {len(users_data)} users in JSON file")
-        
-        for user_id, user_info in users_data.items():
-            try:
-                # Handle different JSON structures
-                if "full_name" in user_info:
-                    # New format (user_0006 style)
-                    full_name = user_info.get("full_name", "Unknown User")
-                    email = user_info.get("email")
-                    phone = user_info.get("phone")
-                    cnic = user_info.get("cnic")
-                    password_hash = user_info.get("password_hash")
-                else:
-                    # Old format (user_0001-0005 style)
-                    full_name = user_info.get("name", "Unknown User")
-                    email = user_info.get("email")
-                    phone = user_info.get("phone")
-                    cnic = user_info.get("cnic")
-                    password_hash = None
-                
-                # Prepare user data for SQL
-                user_sql_data = {
-                    "user_id": user_id,
-                    "full_name": full_name,
-                    "cnic": cnic,
-                    "email": email,
-                    "phone": phone
-                }
-                
-                # Add password hash if available
-                if password_hash:
-                    user_sql_data["password_hash"] = password_hash  # Already hashed
-                
-                print(f"Attempting to migrate: {user_id} ({full_name})")
-                result = create_user_sql(user_sql_data)
-                
-                if result["success"]:
-                    migrated_count += 1
-                    print(f"✓ Migrated user: {user_id} ({full_name})")
-                else:
-                    if "already exists" in result["message"]:
-                        skipped_count += 1
-                        print(f"⚠ Skipped user {user_id}: {result['message']}")
-                    else:
-                        error_count += 1
-                        print(f"❌ Failed to migrate user {user_id}: {result['message']}")
-                        
-            except Exception as e:
-                error_count += 1
-                print(f"❌ Error processing user {user_id}: {e}")
-        
-        print(f"\n📊 Migration Summary:")
-        print(f"✓ Migrated: {migrated_count} users")
-        print(f"⚠ Skipped: {skipped_count} users (already exist)")
-        print(f"❌ Errors: {error_count} users")
-        
-        return migrated_count > 0 or error_count == 0
-        
+        result = run_bulk_migration(workers, run_id=run_id, resume=resume, incremental=incremental, since=since)
     except Exception as e:
         print(f"❌ Migration failed: {e}")
         import traceback
         traceback.print_exc()
         return False
-
-def migrate_profiles_to_sql():
-    """Migrate user profiles from JSON to SQL"""
-    if not (DATABASE_AVAILABLE and BACKEND_AVAILABLE):
-        print("❌ Cannot migrate profiles: Required modules not available")
-        return False
-        
-    print("🔄 Migrating profiles from JSON to SQL...")
     
-    try:
-        users_data = get_all_users()
-        migrated_count = 0
-        skipped_count = 0
-        error_count = 0
-        
-        for user_id, user_info in users_data.items():
-            try:
-                profile_data = {}
-                
-                # Check if profile data is embedded in users_data (new format)
-                if "age" in user_info or "height" in user_info:
-                    # Extract profile from user_info directly
-                    profile_data = {
-                        "user_id": user_id,
-                        "age": user_info.get("age"),
-                        "gender": user_info.get("gender"),
-                        "height": user_info.get("height"),
-                        "current_weight": user_info.get("current_weight"),
-                        "target_weight": user_info.get("target_weight"),
-                        "initial_weight": user_info.get("initial_weight"),
-                        "activity_level": user_info.get("activity_level"),
-                        "diet_type": user_info.get("diet_type"),
-                        "city": user_info.get("city"),
-                        "area": user_info.get("area"),
-                        "preferred_language": user_info.get("preferred_language", "English")
-                    }
-                    
-                    # Remove None values
-                    profile_data = {k: v for k, v in profile_data.items() if v is not None}
-                
-                # Also check wellness_data folder for separate profile data
-                try:
-                    wellness_data = load_user_wellness_data(user_id)
-                    wellness_profile = wellness_data.get("profile", {})
-                    
-                    # Merge wellness profile data (wellness data takes precedence)
-                    if wellness_profile:
-                        profile_data.update(wellness_profile)
-                        profile_data["user_id"] = user_id
-                        
-                except Exception as e:
-                    print(f"⚠ Could not load wellness data for {user_id}: {e}")
-                
-                if profile_data and len(profile_data) > 1:  # More than just user_id
-                    result = create_user_profile_sql(profile_data)
-                    
-                    if result["success"]:
-                        migrated_count += 1
-                        print(f"✓ Migrated profile for user: {user_id}")
-                    else:
-                        error_count += 1
-                        print(f"❌ Failed to migrate profile for {user_id}: {result['message']}")
-                else:
-                    skipped_count += 1
-                    print(f"⚠ Skipped {user_id}: No profile data found")
-                    
-            except Exception as e:
-                error_count += 1
-                print(f"❌ Error processing profile for {user_id}: {e}")
-        
-        print(f"\n📊 Profile Migration Summary:")
-        print(f"✓ Migrated: {migrated_count} profiles")
-        print(f"⚠ Skipped: {skipped_count} profiles (no data)")
-        print(f"❌ Errors: {error_count} profiles")
-        
-        return migrated_count > 0 or error_count == 0
-        
-    except Exception as e:
-        print(f"❌ Profile migration failed: {e}")
-        import traceback
-        traceback.print_exc()
-        return False
-
-def migrate_health_data_to_sql():
-    """Migrate health data from JSON to SQL"""
-    if not (DATABASE_AVAILABLE and BACKEND_AVAILABLE):
-        print("❌ Cannot migrate health data: Required modules not available")
-        return False
-        
-    print("🔄 Migrating health data from JSON to SQL...")
+    for user_id, message in result["errors"]:
+        print(f"❌ {user_id}: {message}")
     
-    try:
-        users_data = get_all_users()
-        migrated_count = 0
-        
-        for user_id in users_data.keys():
-            try:
-                wellness_data = load_user_wellness_data(user_id)
-                health_logs = wellness_data.get("health_logs", {})
-                
-                for log_date, log_data in health_logs.items():
-                    log_data["user_id"] = user_id
-                    log_data["date"] = log_date
-                    
-                    result = log_health_data_sql(log_data)
-                    if result["success"]:
-                        migrated_count += 1
-                    else:
-                        print(f"❌ Failed to migrate health data for {user_id} on {log_date}")
-                        
-            except Exception as e:
-                print(f"⚠ Error processing health data for {user_id}: {e}")
-        
-        print(f"\n📊 Health Data Migration Summary:")
-        print(f"✓ Migrated: {migrated_count} health records")
-        
-        return True
-        
-    except Exception as e:
-        print(f"❌ Health data migration failed: {e}")
-        return False
+    print(f"\n📊 Migration Summary:")
+    print(f"✓ Users: {result['users']} migrated, {result['skipped_users']} skipped (already exist)")
+    print(f"✓ Profiles: {result['profiles']}")
+    print(f"✓ Health Records: {result['health_records']}")
+    print(f"✓ Sessions: {result['sessions']} migrated, {result['updated_sessions']} updated, "
+          f"{result['skipped_sessions']} skipped (already exist)")
+    print(f"✓ Messages: {result['messages']}")
+    print(f"⏱️ {result['message']} ({result['rows_per_second']:,.0f} rows/s)")
+    print(f"❌ Errors: {len(result['errors'])}")
+    
+    return result["success"]
 
-def verify_migration():
-    """Verify that migration was successful"""
+def verify_migration(workers=None):
+    """Verify that migration was successful: table counts, then per-user checksums against the JSON data"""
     if not DATABASE_AVAILABLE:
         print("❌ Cannot verify: Database module not available")
         return False
@@ -319,20 +139,43 @@ def verify_migration():
             cursor.execute("SELECT COUNT(*) FROM sessions")
             session_count = cursor.fetchone()[0]
             
+            # Count conversation messages and entities
+            cursor.execute("SELECT COUNT(*) FROM messages")
+            message_count = cursor.fetchone()[0]
+            cursor.execute("SELECT (SELECT COUNT(*) FROM session_entities) + (SELECT COUNT(*) FROM agent_entities)")
+            entity_count = cursor.fetchone()[0]
+            
             print(f"\n📊 Database Contents:")
             print(f"👥 Users: {user_count}")
             print(f"📋 Profiles: {profile_count}")
             print(f"🏥 Health Records: {health_count}")
             print(f"💬 Sessions: {session_count}")
-            
-            return True
+            print(f"🗨️ Messages: {message_count}")
+            print(f"🏷️ Entities: {entity_count}")
+        
+        print(f"\n🔐 Comparing checksums with the JSON data...")
+        result = run_verification(workers)
             
     except Exception as e:
         print(f"❌ Verification failed: {e}")
         return False
+    
+    for category, count in result["mismatches"].items():
+        if count:
+            print(f"⚠️ {category}: {count} users differ")
+    for user_id, error in result["errors"][:10]:
+        print(f"⚠️ {user_id}: {error}")
+    print(f"{'✓' if result['success'] else '❌'} {result['message']}")
+    return result["success"]
 
-def full_migration():
-    """Perform complete migration from JSON to SQL"""
+MIGRATION_STAGES = ("backup", "data", "verify")
+
+def full_migration(workers=None, since=None):
+    """Perform complete migration from JSON to SQL, resuming an interrupted run
+
+    since selects an incremental run: "last" migrates sources changed since they were last
+    migrated, an ISO timestamp those whose wellness file was modified at or after it.
+    """
     print("🚀 Starting Full Migration Process")
     print("=" * 50)
     
@@ -349,40 +192,67 @@ def full_migration():
         print(f"❌ Database initialization failed: {e}")
         return False
     
-    # Step 2: Create backup
-    print("\n2️⃣ Creating backup...")
-    backup_dir = backup_json_data()
+    since_timestamp = None
+    if since and since != "last":
+        try:
+            since_timestamp = datetime.fromisoformat(since).timestamp()
+        except ValueError:
+            print(f"❌ --since must be an ISO date or time, got: {since}")
+            return False
     
-    # Step 3: Migrate users
-    print("\n3️⃣ Migrating users...")
-    if not migrate_users_to_sql():
-        print("❌ User migration failed")
-        return False
+    # An explicit --since starts a new incremental run rather than resuming an unfinished one
+    run = None if since else get_unfinished_migration_run_sql()
+    if run:
+        run_id = run["run_id"]
+        incremental = bool(run["incremental"])
+        first_stage = MIGRATION_STAGES.index(run["stage"]) if run["stage"] in MIGRATION_STAGES else 0
+        print(f"↩️ Resuming migration run {run_id} at stage '{MIGRATION_STAGES[first_stage]}' "
+              f"({run['done_sources']}/{run['total_sources']} sources done)")
+    else:
+        incremental = since is not None
+        run_id = start_migration_run_sql(incremental)
+        first_stage = 0
+        if incremental:
+            print(f"⏩ Incremental run {run_id}: only sources changed since {since if since_timestamp else 'the last run'}")
     
-    # Step 4: Migrate profiles
-    print("\n4️⃣ Migrating profiles...")
-    if not migrate_profiles_to_sql():
-        print("❌ Profile migration failed")
-        return False
+    def start_stage(stage):
+        update_migration_run_sql(run_id, stage=stage)
+        return MIGRATION_STAGES.index(stage) >= first_stage
     
-    # Step 5: Migrate health data
-    print("\n5️⃣ Migrating health data...")
-    if not migrate_health_data_to_sql():
-        print("❌ Health data migration failed")
+    def fail(message):
+        update_migration_run_sql(run_id, status="failed")
+        print(message)
+        print(f"↩️ Run 'python database_manager.py migrate' again to resume run {run_id}")
         return False
     
-    # Step 6: Verify migration
-    print("\n6️⃣ Verifying migration...")
-    if not verify_migration():
-        print("❌ Migration verification failed")
-        return False
+    # Step 2: Create backup
+    print("\n2️⃣ Creating backup...")
+    backup_dir = None
+    if start_stage("backup"):
+        backup_dir = backup_json_data()
+    else:
+        print("✓ Backup already created by this run")
+    
+    # Step 3: Migrate users, profiles, health data and conversations
+    print("\n3️⃣ Migrating data...")
+    if start_stage("data") and not migrate_json_data(workers, run_id, resume=bool(run), incremental=incremental,
+                                                     since=since_timestamp):
+        return fail("❌ Data migration failed")
     
+    # Step 4: Verify migration
+    print("\n4️⃣ Verifying migration...")
+    if start_stage("verify") and not verify_migration(workers):
+        return fail("❌ Migration verification failed")
+    
+    update_migration_run_sql(run_id, status="completed", finished_at=datetime.now().isoformat())
     print(f"\n🎉 Migration completed successfully!")
-    print(f"📁 Backup created in: {backup_dir}")
+    if backup_dir:
+        print(f"📁 Backup created in: {backup_dir}")
     print(f"💾 New database: wellness_app.db")
     print("\n⚠️  Important Notes:")
-    print("- JSON files are still preserved for conversation data")
+    print("- JSON files are still preserved as a backup of conversation data")
     print("- SQL database now handles structured data (users, profiles, health)")
+    print("- Conversations and NER entities are now served from SQL")
     print("- The app will use hybrid SQL+JSON mode automatically")
     
     return True
@@ -426,6 +296,16 @@ def show_database_stats():
             users_with_sessions = cursor.fetchone()[0]
             print(f"💬 Sessions: {sessions} ({users_with_sessions} users)")
             
+            # Conversation store
+            cursor.execute("SELECT COUNT(*) FROM messages")
+            messages = cursor.fetchone()[0]
+            cursor.execute("SELECT COUNT(*) FROM session_entities")
+            session_entities = cursor.fetchone()[0]
+            cursor.execute("SELECT COUNT(*) FROM agent_entities")
+            agent_entities = cursor.fetchone()[0]
+            print(f"🗨️ Messages: {messages}")
+            print(f"🏷️ Entities: {session_entities} general / {agent_entities} agent-specific")
+            
             # Routine plans
             cursor.execute("SELECT COUNT(*) FROM routine_plans WHERE is_active = TRUE")
             active_plans = cursor.fetchone()[0]
@@ -439,15 +319,337 @@ def show_database_stats():
     except Exception as e:
         print(f"❌ Error retrieving stats: {e}")
 
+def reshard_wellness_files(levels: int, dry_run: bool = False):
+    """Move wellness files into the hash-sharded layout with the given depth"""
+    print(f"🗂️ Re-sharding {WELLNESS_DATA_DIR}/ to {levels} level(s){' (dry run)' if dry_run else ''}...")
+    if not os.path.exists(WELLNESS_DATA_DIR):
+        print(f"❌ {WELLNESS_DATA_DIR}/ not found")
+        return
+    
+    stats = reshard_wellness_data(levels, dry_run=dry_run)
+    print(f"✓ Moved: {stats['moved']}, already in place: {stats['unchanged']}, conflicts resolved: {stats['conflicts']}")
+    if levels != WELLNESS_SHARD_LEVELS:
+        print(f"⚠ Set WELLNESS_SHARD_LEVELS={levels} so new files are written to this layout")
+
+def archive_idle_sessions_all(idle_days: int):
+    """Archive messages of sessions idle longer than idle_days for every user"""
+    print(f"🧊 Archiving sessions idle for more than {idle_days} days...")
+    try:
+        from backend import archive_idle_sessions
+    except ImportError as e:
+        print(f"❌ Backend module not available: {e}")
+        return
+    
+    user_ids = set(load_users_data().keys())
+    if os.path.exists(WELLNESS_DATA_DIR):
+        user_ids.update(user_id for user_id, _path in iter_wellness_files())
+    if DATABASE_AVAILABLE:
+        with get_db_connection() as conn:
+            user_ids.update(row[0] for row in conn.execute("SELECT DISTINCT user_id FROM sessions WHERE user_id IS NOT NULL"))
+    
+    total_sessions = total_messages = 0
+    for user_id in sorted(user_ids):
+        result = archive_idle_sessions(user_id, idle_days)
+        total_sessions += result["sessions"]
+        total_messages += result["messages"]
+    
+    print(f"✓ Archived {total_messages} messages from {total_sessions} sessions")
+
+def dedupe_entities():
+    """Remove duplicate NER entities from SQL and from the JSON wellness files"""
+    print("🧹 Removing duplicate NER entities...")
+    if DATABASE_AVAILABLE:
+        result = dedupe_entities_sql()
+        print(f"{'✓' if result['success'] else '❌'} SQL: {result['message']}")
+    
+    try:
+        from backend import dedupe_json_entities
+    except ImportError as e:
+        print(f"❌ Backend module not available: {e}")
+        return
+    
+    removed = 0
+    if os.path.exists(WELLNESS_DATA_DIR):
+        for user_id, _path in list(iter_wellness_files()):
+            removed += dedupe_json_entities(user_id)
+    print(f"✓ JSON: Removed {removed} duplicate entities")
+
+def benchmark_connections(threads: int = 8, seconds: float = 3.0, users: int = 50):
+    """Compare get_user_sql/log_health_data_sql throughput with per-call and pooled connections"""
+    if not DATABASE_AVAILABLE:
+        print("❌ Database module not available")
+        return
+    
+    print(f"⏱️ Benchmarking {threads} threads for {seconds:g}s each (4 reads : 1 write)...")
+    original_db_file, original_pool = database.DB_FILE, database.USE_CONNECTION_POOL
+    results = {}
+    try:
+        for label, use_pool in (("per-call connections", False), ("pooled WAL connections", True)):
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                database.DB_FILE = os.path.join(tmp_dir, "bench.db")
+                database.USE_CONNECTION_POOL = use_pool
+                init_database()
+                user_ids = [f"bench_user_{i}" for i in range(users)]
+                for user_id in user_ids:
+                    create_user_sql({"user_id": user_id, "full_name": "Bench User"})
+                
+                counts = {"reads": 0, "writes": 0, "errors": 0}
+                lock = threading.Lock()
+                deadline = time.perf_counter() + seconds
+                
+                def worker():
+                    reads = writes = errors = 0
+                    rng = random.Random()
+                    while time.perf_counter() < deadline:
+                        for _ in range(4):
+                            get_user_sql(rng.choice(user_ids))
+                            reads += 1
+                        result = log_health_data_sql({
+                            "user_id": rng.choice(user_ids),
+                            "date": f"2025-01-{rng.randint(1, 28):02d}",
+                            "stress_level": rng.randint(1, 5)
+                        })
+                        writes += 1
+                        errors += 0 if result["success"] else 1
+                    database.close_db_connections()
+                    with lock:
+                        counts["reads"] += reads
+                        counts["writes"] += writes
+                        counts["errors"] += errors
+                
+                workers = [threading.Thread(target=worker) for _ in range(threads)]
+                for thread in workers:
+                    thread.start()
+                for thread in workers:
+                    thread.join()
+                database.close_db_connections()
+                
+                results[label] = counts
+                print(f"  {label}: {counts['reads'] / seconds:,.0f} reads/s, "
+                      f"{counts['writes'] / seconds:,.0f} writes/s, {counts['errors']} failed writes")
+    finally:
+        database.DB_FILE, database.USE_CONNECTION_POOL = original_db_file, original_pool
+    
+    before, after = results["per-call connections"], results["pooled WAL connections"]
+    if before["reads"] and before["writes"]:
+        print(f"✓ Pooled: {after['reads'] / before['reads']:.1f}x reads, {after['writes'] / before['writes']:.1f}x writes")
+
+def run_concurrent_conversations(saver_factory, path: str, threads: int = 50, turns: int = 3,
+                                 latency: float = 0.02) -> Dict[str, Any]:
+    """Run concurrent conversations against a fake LLM on a checkpoint database and check each thread's state
+
+    saver_factory opens a checkpointer on path; a second one, with nothing cached, reads the threads back.
+    Returns the failed turns, the number of threads with wrong state, the integrity check result and turns/s.
+    """
+    import operator
+    from typing import Annotated, TypedDict
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    from langchain_core.messages import HumanMessage
+    from langgraph.graph import StateGraph, START, END
+    from langgraph.graph.message import add_messages
+    
+    class ChatState(TypedDict):
+        messages: Annotated[list, add_messages]
+        time_stamps: Annotated[list, operator.add]
+    
+    model = FakeListChatModel(responses=["Take a short walk and drink some water."])
+    
+    def chat_node(state: ChatState):
+        time.sleep(latency)  # Stands in for the API round trip
+        return {"messages": [model.invoke(state["messages"])], "time_stamps": [datetime.now()]}
+    
+    def build_graph(checkpointer):
+        graph = StateGraph(ChatState)
+        graph.add_node("chat", chat_node)
+        graph.add_edge(START, "chat")
+        graph.add_edge("chat", END)
+        return graph.compile(checkpointer=checkpointer)
+    
+    saver = saver_factory(path)
+    saver.setup()
+    chatbot = build_graph(saver)
+    errors = []
+    start = threading.Barrier(threads)
+    
+    def conversation(index):
+        config = {"configurable": {"thread_id": f"check_{index}"}}
+        start.wait()
+        for turn in range(turns):
+            try:
+                chatbot.invoke({"messages": [HumanMessage(content=f"{index}:{turn}")],
+                                "time_stamps": [datetime.now()]}, config)
+            except Exception as e:
+                errors.append(f"check_{index} turn {turn}: {e}")
+    
+    workers = [threading.Thread(target=conversation, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    
+    # Read every thread back through a fresh checkpointer, with nothing cached
+    reader = build_graph(saver_factory(path))
+    mismatched = 0
+    for index in range(threads):
+        values = reader.get_state({"configurable": {"thread_id": f"check_{index}"}}).values
+        questions = [message.content for message in values.get("messages", [])[::2]]
+        if questions != [f"{index}:{turn}" for turn in range(turns)] \
+                or len(values.get("messages", [])) != 2 * turns or len(values.get("time_stamps", [])) != 2 * turns:
+            mismatched += 1
+    with sqlite3.connect(path) as conn:
+        integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+    
+    return {
+        "errors": errors,
+        "mismatched": mismatched,
+        "integrity": integrity,
+        "turns_per_second": threads * turns / elapsed
+    }
+
+def check_checkpointer_concurrency(threads: int = 50, turns: int = 3, latency: float = 0.02) -> bool:
+    """Run concurrent conversations against a fake LLM and check each thread's checkpointed state"""
+    try:
+        from langgraph.checkpoint.sqlite import SqliteSaver
+        from delta_checkpointer import PooledDeltaSqliteSaver
+    except ImportError as e:
+        print(f"❌ LangGraph not available: {e}")
+        return False
+    
+    print(f"⏱️ Running {threads} concurrent conversations of {turns} turns against a fake LLM...")
+    savers = (
+        ("shared connection (SqliteSaver)",
+         lambda path: SqliteSaver(sqlite3.connect(path, check_same_thread=False))),
+        ("per-thread WAL connections (PooledDeltaSqliteSaver)", PooledDeltaSqliteSaver)
+    )
+    passed = True
+    for label, saver_factory in savers:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            result = run_concurrent_conversations(saver_factory, os.path.join(tmp_dir, "history.db"),
+                                                  threads, turns, latency)
+        ok = not result["errors"] and not result["mismatched"] and result["integrity"] == "ok"
+        print(f"  {'✓' if ok else '❌'} {label}: {result['turns_per_second']:,.0f} turns/s, "
+              f"{len(result['errors'])} failed turns, {result['mismatched']} threads with wrong state, "
+              f"integrity {result['integrity']}")
+        for error in result["errors"][:5]:
+            print(f"     {error}")
+        if saver_factory is PooledDeltaSqliteSaver:
+            passed = ok
+    
+    return passed
+
+def migrate_database_schema() -> bool:
+    """Apply pending schema migrations to the SQL database"""
+    print("🔧 Migrating database schema...")
+    if not DATABASE_AVAILABLE:
+        print("❌ Database module not available")
+        return False
+    
+    print(f"Current schema version: {get_schema_version()} (latest: {SCHEMA_VERSION})")
+    result = migrate_schema()
+    for name in result["applied"]:
+        print(f"✓ Applied migration {name}")
+    
+    if not result["success"]:
+        print(f"❌ {result['message']}")
+        return False
+    print(f"✓ {result['message']}, schema version {result['version']}")
+    return True
+
+def check_query_plans() -> bool:
+    """Verify with EXPLAIN QUERY PLAN that every hot query is served by an index"""
+    print("🔎 Checking query plans...")
+    if not DATABASE_AVAILABLE:
+        print("❌ Database module not available")
+        return False
+    
+    init_database()
+    results = check_query_plans_sql()
+    for result in results:
+        status = "✓" if result["uses_index"] else "❌"
+        note = " (sorts in a temp b-tree)" if result["sorts"] else ""
+        print(f"{status} {result['query']}: {' / '.join(result['plan'])}{note}")
+    
+    failures = [result["query"] for result in results if not result["uses_index"]]
+    if failures:
+        print(f"❌ Full table scans in: {', '.join(failures)}")
+        return False
+    print(f"✓ All {len(results)} hot queries use an index")
+    return True
+
+def compact_history(keep: int = CHECKPOINT_RETENTION, daily_snapshots: bool = False) -> bool:
+    """Prune old LangGraph checkpoints from history.db and compact it, reporting its size"""
+    if keep < 1:
+        print("❌ --keep must be at least 1: the latest checkpoint holds each conversation's state")
+        return False
+    
+    print(f"🗜️ Compacting {HISTORY_DB_FILE}: keeping the latest {keep} checkpoints per thread"
+          f"{' and one per day' if daily_snapshots else ''}...")
+    
+    result = prune_checkpoints(keep, daily_snapshots)
+    print(f"{'✓' if result['success'] else '❌'} {result['message']}")
+    if not result["success"]:
+        return False
+    
+    result = compact_history_db()
+    print(f"{'✓' if result['success'] else '❌'} {result['message']}")
+    if result["success"] and result["size_before"]:
+        saved = result["size_before"] - result["size_after"]
+        print(f"💾 Reclaimed {saved / 1024:,.0f} KB ({saved / result['size_before']:.0%})")
+    return result["success"]
+
+def purge_history(user_ids: List[str] = None) -> bool:
+    """Delete the given users' sessions, then purge every queued thread from history.db"""
+    if user_ids:
+        print(f"🗑️ Deleting all sessions of {len(user_ids)} users...")
+        try:
+            from backend import delete_user_sessions
+        except ImportError as e:
+            print(f"❌ Backend module not available: {e}")
+            return False
+        result = delete_user_sessions(user_ids, background=False)
+        print(f"{'✓' if result['success'] else '❌'} {result['message']}")
+    
+    print(f"🧹 Purging deleted conversations from {HISTORY_DB_FILE}...")
+    result = reclaim_history_space()
+    print(f"{'✓' if result['success'] else '❌'} {result['message']}")
+    if result["success"] and result.get("size_before"):
+        saved = result["size_before"] - result["size_after"]
+        print(f"💾 Reclaimed {saved / 1024:,.0f} KB ({saved / result['size_before']:.0%})")
+    return result["success"]
+
 def main():
     """Main function for command line interface"""
     parser = argparse.ArgumentParser(description="Wellness App Database Manager")
     parser.add_argument("action", choices=[
-        "init", "migrate", "verify", "stats", "backup"
+        "init", "migrate", "verify", "stats", "backup", "reshard", "archive", "dedupe", "bench", "explain",
+        "migrate-schema", "compact-history", "purge-history", "check-checkpointer"
     ], help="Action to perform")
+    parser.add_argument("--levels", type=int, default=WELLNESS_SHARD_LEVELS, choices=range(MAX_SHARD_LEVELS + 1),
+                        help="Shard depth for reshard (0 = flat layout)")
+    parser.add_argument("--dry-run", action="store_true", help="Report what reshard would move without moving files")
+    parser.add_argument("--days", type=int, default=90, help="Idle days before a session is archived")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Concurrent threads for bench (default 8) and check-checkpointer (default 50)")
+    parser.add_argument("--seconds", type=float, default=3.0, help="Duration of each bench run")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Processes parsing JSON files for migrate and verify (default: CPU count)")
+    parser.add_argument("--since", nargs="?", const="last", default=None,
+                        help="Incremental migrate: sources changed since the last run, or since an ISO date")
+    parser.add_argument("--keep", type=int, default=CHECKPOINT_RETENTION,
+                        help="Checkpoints kept per conversation thread by compact-history")
+    parser.add_argument("--daily", action="store_true",
+                        help="compact-history also keeps the last checkpoint of each day")
+    parser.add_argument("--users", nargs="+", default=None,
+                        help="purge-history first deletes every session of these user IDs")
     
     args = parser.parse_args()
     
+    # Actions reading the database bring its schema up to date first (a version check when it is current)
+    if DATABASE_AVAILABLE and args.action in ("verify", "stats", "dedupe"):
+        init_database()
+    
     if args.action == "init":
         print("🔧 Initializing database...")
         if DATABASE_AVAILABLE:
@@ -457,10 +659,12 @@ def main():
             print("❌ Database module not available")
             
     elif args.action == "migrate":
-        full_migration()
+        if not full_migration(args.workers, args.since):
+            sys.exit(1)
         
     elif args.action == "verify":
-        verify_migration()
+        if not verify_migration(args.workers):
+            sys.exit(1)
         
     elif args.action == "stats":
         show_database_stats()
@@ -468,6 +672,38 @@ def main():
     elif args.action == "backup":
         backup_dir = backup_json_data()
         print(f"✓ Backup created in: {backup_dir}")
+        
+    elif args.action == "reshard":
+        reshard_wellness_files(args.levels, dry_run=args.dry_run)
+        
+    elif args.action == "archive":
+        archive_idle_sessions_all(args.days)
+        
+    elif args.action == "dedupe":
+        dedupe_entities()
+        
+    elif args.action == "bench":
+        benchmark_connections(args.threads or 8, args.seconds)
+        
+    elif args.action == "explain":
+        if not check_query_plans():
+            sys.exit(1)
+        
+    elif args.action == "migrate-schema":
+        if not migrate_database_schema():
+            sys.exit(1)
+        
+    elif args.action == "compact-history":
+        if not compact_history(args.keep, args.daily):
+            sys.exit(1)
+        
+    elif args.action == "purge-history":
+        if not purge_history(args.users):
+            sys.exit(1)
+        
+    elif args.action == "check-checkpointer":
+        if not check_checkpointer_concurrency(args.threads or 50):
+            sys.exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
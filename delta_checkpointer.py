@@ -0,0 +1,272 @@
+"""
+LangGraph checkpointer storing conversation history as deltas.
+
+SqliteSaver serializes every channel of every checkpoint, so each step of a long thread
+rewrites its whole message list. DeltaSqliteSaver stores list channels (messages,
+time_stamps, ner_entities) as the items appended since the parent checkpoint, writes a
+full snapshot every CHECKPOINT_SNAPSHOT_INTERVAL checkpoints, and rebuilds the lists on
+read. Checkpoint and write payloads are compressed with zlib. Checkpoints written by
+SqliteSaver are read as they are.
+
+PooledDeltaSqliteSaver opens one WAL connection per thread, so concurrent Streamlit
+sessions no longer share a single connection and lock.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Tuple
+
+from langgraph.checkpoint.base import get_checkpoint_metadata
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+# Longest chain of delta checkpoints before the next one is a full snapshot
+CHECKPOINT_SNAPSHOT_INTERVAL = int(os.getenv("CHECKPOINT_SNAPSHOT_INTERVAL", "20"))
+
+# Payloads smaller than this are stored uncompressed; zlib would only add overhead
+COMPRESS_MIN_BYTES = 256
+
+# Rebuilt list channels of recently read or written checkpoints, across all threads
+CACHED_CHECKPOINTS = 512
+
+# Per-thread connections wait this long for another thread's write instead of failing
+CHECKPOINT_BUSY_TIMEOUT_MS = 30000
+CHECKPOINT_PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("busy_timeout", str(CHECKPOINT_BUSY_TIMEOUT_MS))
+)
+
+DELTA_BASE_KEY = "__delta_base__"
+DELTA_ITEMS_KEY = "__delta_items__"
+
+def _is_delta(value: Any) -> bool:
+    """Whether a stored channel value is a delta on a base checkpoint"""
+    return isinstance(value, dict) and DELTA_BASE_KEY in value
+
+class ZlibSerializer(SerializerProtocol):
+    """Serializer compressing another serializer's payloads with zlib"""
+
+    def __init__(self, serde: Optional[SerializerProtocol] = None, level: int = 6):
+        self.serde = serde or JsonPlusSerializer()
+        self.level = level
+
+    def dumps_typed(self, obj: Any) -> Tuple[str, bytes]:
+        type_, data = self.serde.dumps_typed(obj)
+        if len(data) < COMPRESS_MIN_BYTES:
+            return type_, data
+        return f"{type_}+zlib", zlib.compress(data, self.level)
+
+    def loads_typed(self, data: Tuple[str, bytes]) -> Any:
+        type_, payload = data
+        if type_.endswith("+zlib"):
+            return self.serde.loads_typed((type_[:-len("+zlib")], zlib.decompress(payload)))
+        return self.serde.loads_typed(data)
+
+class DeltaSqliteSaver(SqliteSaver):
+    """SqliteSaver storing list channels as the items appended since the parent checkpoint
+
+    Each checkpoint row records its delta_depth: 0 for a full snapshot, otherwise the number
+    of delta checkpoints back to one. history_store keeps those bases when pruning.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, *, serde: Optional[SerializerProtocol] = None,
+                 snapshot_interval: int = CHECKPOINT_SNAPSHOT_INTERVAL):
+        super().__init__(conn, serde=ZlibSerializer(serde))
+        self.snapshot_interval = snapshot_interval
+        self._cache_lock = threading.Lock()
+        self._recent = OrderedDict()
+
+    def setup(self) -> None:
+        if self.is_setup:
+            return
+        super().setup()
+        try:
+            self.conn.execute("ALTER TABLE checkpoints ADD COLUMN delta_depth INTEGER NOT NULL DEFAULT 0")
+        except sqlite3.OperationalError as e:
+            if "duplicate column name" not in str(e) and "readonly database" not in str(e):
+                raise
+
+    def _remember(self, key: Tuple[str, str, str], depth: int, lists: Dict[str, list]):
+        """Cache the rebuilt list channels of a checkpoint"""
+        with self._cache_lock:
+            self._recent[key] = (depth, lists)
+            self._recent.move_to_end(key)
+            while len(self._recent) > CACHED_CHECKPOINTS:
+                self._recent.popitem(last=False)
+
+    def _recall(self, key: Tuple[str, str, str]) -> Optional[Tuple[int, Dict[str, list]]]:
+        """Cached delta depth and list channels of a checkpoint, if any"""
+        with self._cache_lock:
+            return self._recent.get(key)
+
+    def _list_channels(self, thread_id: str, checkpoint_ns: str,
+                       checkpoint_id: str) -> Optional[Tuple[int, Dict[str, list]]]:
+        """Delta depth and full list channels of a stored checkpoint, or None if it does not exist"""
+        key = (thread_id, checkpoint_ns, checkpoint_id)
+        cached = self._recall(key)
+        if cached is not None:
+            return cached
+        with self.cursor(transaction=False) as cur:
+            cur.execute(
+                "SELECT type, checkpoint, delta_depth FROM checkpoints "
+                "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                key
+            )
+            row = cur.fetchone()
+        if row is None:
+            return None
+        checkpoint = self.serde.loads_typed((row[0], row[1]))
+        lists = self._rebuild(thread_id, checkpoint_ns, checkpoint["channel_values"])
+        self._remember(key, row[2], lists)
+        return row[2], lists
+
+    def _rebuild(self, thread_id: str, checkpoint_ns: str, channel_values: Dict[str, Any]) -> Dict[str, list]:
+        """Replace delta channel values with full lists in place, returning copies of all list channels"""
+        for channel, value in channel_values.items():
+            if not _is_delta(value):
+                continue
+            base = self._list_channels(thread_id, checkpoint_ns, value[DELTA_BASE_KEY])
+            if base is None or channel not in base[1]:
+                raise ValueError(f"Base checkpoint {value[DELTA_BASE_KEY]} of thread {thread_id} is missing")
+            channel_values[channel] = base[1][channel] + value[DELTA_ITEMS_KEY]
+        return {channel: list(value) for channel, value in channel_values.items() if isinstance(value, list)}
+
+    def _rebuild_tuple(self, checkpoint_tuple):
+        """Rebuild the delta channels of a checkpoint tuple read by SqliteSaver"""
+        configurable = checkpoint_tuple.config["configurable"]
+        self._rebuild(str(configurable["thread_id"]), configurable.get("checkpoint_ns", ""),
+                      checkpoint_tuple.checkpoint["channel_values"])
+        return checkpoint_tuple
+
+    def get_tuple(self, config):
+        checkpoint_tuple = super().get_tuple(config)
+        if checkpoint_tuple is not None:
+            self._rebuild_tuple(checkpoint_tuple)
+        return checkpoint_tuple
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        # SqliteSaver holds the connection lock while iterating, so read first and rebuild after
+        checkpoint_tuples = [*super().list(config, filter=filter, before=before, limit=limit)]
+        for checkpoint_tuple in checkpoint_tuples:
+            yield self._rebuild_tuple(checkpoint_tuple)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        parent_id = config["configurable"].get("checkpoint_id")
+        channel_values = checkpoint["channel_values"]
+        lists = {channel: list(value) for channel, value in channel_values.items() if isinstance(value, list)}
+
+        # Lists that extend the parent's are stored as their new items, until the chain is due a snapshot
+        depth = 0
+        stored_values = dict(channel_values)
+        base = None
+        if parent_id and parent_id != checkpoint["id"]:
+            try:
+                base = self._list_channels(thread_id, checkpoint_ns, parent_id)
+            except ValueError:
+                base = None  # A broken chain gets a fresh snapshot
+        if base is not None and base[0] + 1 < self.snapshot_interval:
+            for channel, value in lists.items():
+                previous = base[1].get(channel)
+                if previous and len(value) >= len(previous) and value[:len(previous)] == previous:
+                    stored_values[channel] = {DELTA_BASE_KEY: parent_id, DELTA_ITEMS_KEY: value[len(previous):]}
+                    depth = base[0] + 1
+
+        type_, serialized_checkpoint = self.serde.dumps_typed({**checkpoint, "channel_values": stored_values})
+        serialized_metadata = json.dumps(
+            get_checkpoint_metadata(config, metadata), ensure_ascii=False
+        ).encode("utf-8", "ignore")
+        with self.cursor() as cur:
+            cur.execute(
+                "INSERT OR REPLACE INTO checkpoints (thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, "
+                "type, checkpoint, metadata, delta_depth) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, checkpoint_ns, checkpoint["id"], parent_id,
+                 type_, serialized_checkpoint, serialized_metadata, depth)
+            )
+        self._remember((thread_id, checkpoint_ns, checkpoint["id"]), depth, lists)
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+class PooledDeltaSqliteSaver(DeltaSqliteSaver):
+    """DeltaSqliteSaver with one WAL connection per thread instead of one shared connection
+
+    SqliteSaver runs every call through a single connection behind a lock, so concurrent
+    turns wait for each other. Here each thread reads through its own connection, and
+    writers queue on SQLite's lock for up to CHECKPOINT_BUSY_TIMEOUT_MS.
+    """
+
+    def __init__(self, path: str, *, serde: Optional[SerializerProtocol] = None,
+                 snapshot_interval: int = CHECKPOINT_SNAPSHOT_INTERVAL):
+        self.path = path
+        self._local = threading.local()
+        self._setup_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._ready = False
+        super().__init__(None, serde=serde, snapshot_interval=snapshot_interval)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """This thread's connection to the checkpoint database, opened on first use"""
+        # A forked child must not reuse its parent's connection
+        if getattr(self._local, "pid", None) != os.getpid():
+            self._local.conn = None
+            self._local.pid = os.getpid()
+        if self._local.conn is None:
+            conn = sqlite3.connect(self.path, timeout=CHECKPOINT_BUSY_TIMEOUT_MS / 1000)
+            for name, value in CHECKPOINT_PRAGMAS:
+                conn.execute(f"PRAGMA {name} = {value}")
+            self._local.conn = conn
+        return self._local.conn
+
+    @conn.setter
+    def conn(self, value):
+        # SqliteSaver.__init__ assigns its shared connection; connections are opened per thread instead
+        pass
+
+    def close(self):
+        """Close the calling thread's connection"""
+        if getattr(self._local, "conn", None) is not None:
+            self._local.conn.close()
+            self._local.conn = None
+
+    def setup(self) -> None:
+        # is_setup turns true before DeltaSqliteSaver adds delta_depth, so other threads wait on _ready
+        if self._ready:
+            return
+        with self._setup_lock:
+            if not self._ready:
+                super().setup()
+                self._ready = True
+
+    @contextmanager
+    def cursor(self, transaction: bool = True):
+        self.setup()
+        conn = self.conn
+        if not transaction:
+            cur = conn.cursor()
+            try:
+                yield cur
+            finally:
+                cur.close()
+            return
+        # Writers in this process take turns on a lock, which hands over faster than SQLite's busy retries
+        with self._write_lock:
+            cur = conn.cursor()
+            try:
+                yield cur
+            finally:
+                conn.commit()
+                cur.close()
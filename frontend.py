@@ -12,15 +12,16 @@ import datetime
 from datetime import date
 import time
 import os
+from ids import new_thread_id, agent_from_thread_id
 from backend import (
-    chatbot, State, authenticate_user, create_user_profile, 
+    get_chatbot, State, authenticate_user, create_user_profile, 
     load_user_wellness_data, get_user_info, update_daily_inputs,
     get_user_context_for_agent, route_message_to_agent, WELLNESS_DATA_DIR,
     add_message_to_session, get_session_conversation, load_users_data,
-    retrieve_user_threads, delete_session, check_user_has_data,
+    delete_session, check_user_has_data, get_user_session_index, load_user_sessions,
     get_all_users, NER_DATA_DIR, get_messages_with_timestamps_from_state,
     get_user_ner_insights, get_detailed_user_ner_insights, search_user_by_cnic, 
-    validate_cnic, add_user, load_user_ner_data, get_user_wellness_file, 
+    validate_cnic, add_user, get_user_wellness_file, 
     load_user_wellness_data, save_user_wellness_data, update_user_profile,
     get_agent_specific_insights, get_comprehensive_user_insights, 
     get_user_routine_plans, generate_routine_plan, update_routine_progress,
@@ -31,11 +32,17 @@ from backend import (
     log_daily_health_data_hybrid, get_user_health_history_hybrid,
     create_session_hybrid, get_user_sessions_hybrid,
     create_routine_plan_hybrid, get_user_routine_plans_hybrid, log_progress_hybrid,
-    SQL_AVAILABLE, USE_SQL_FOR_STRUCTURED
+    SQL_AVAILABLE, USE_SQL_FOR_STRUCTURED, search_user_conversations, get_cooccurring_entities,
+    get_user_threads, get_user_threads_by_agent
 )
 from langchain_core.messages import HumanMessage, AIMessage
 from langchain_core.runnables import RunnableConfig
 
+@st.cache_resource
+def load_chatbot():
+    """Compiled conversation graph, built on the first chat and shared by all sessions and reruns"""
+    return get_chatbot()
+
 def format_timestamp(timestamp_str):
     """Format timestamp for display"""
     try:
@@ -640,8 +647,7 @@ def initialize_session_state():
 
 def generate_thread_id():
     """Generate unique thread ID"""
-    current_time = datetime.datetime.now()
-    return f"wellness_{current_time.strftime('%Y%m%d_%H%M%S')}"
+    return new_thread_id(st.session_state.get('current_agent', 'MENTAL_HEALTH'))
 
 def new_chat():
     """Create a new chat session"""
@@ -651,66 +657,13 @@ def new_chat():
 
 def get_agent_specific_threads(user_id: str, agent: str):
     """Get threads specific to an agent"""
-    all_threads = retrieve_user_threads(user_id)
-    agent_threads = []
-    
-    for thread_id in all_threads:
-        belongs_to_agent = False
-        
-        # Method 1: Check new agent-specific thread naming pattern (MOST RELIABLE)
-        agent_name = agent.lower()
-        expected_prefix = f"wellness_{agent_name}_"
-        if thread_id.startswith(expected_prefix):
-            belongs_to_agent = True
-        
-        # Method 2: For other agents, check if thread name suggests it belongs to them
-        elif agent == "DIET" and "diet" in thread_id.lower():
-            belongs_to_agent = True
-        elif agent == "EXERCISE" and "exercise" in thread_id.lower():
-            belongs_to_agent = True
-        
-        # Method 3: Check conversation state for current_agent (BUT be careful with GENERAL)
-        elif not belongs_to_agent:
-            try:
-                state = chatbot.get_state(config={"configurable": {"thread_id": thread_id}})
-                if state.values and 'current_agent' in state.values:
-                    state_agent = state.values['current_agent']
-                    
-                    # For Mental Health: Only accept if state is MENTAL_HEALTH AND thread doesn't belong to other agents
-                    if agent == "MENTAL_HEALTH" and state_agent == "MENTAL_HEALTH":
-                        # Make sure this thread doesn't have diet/exercise in the name
-                        if not ("diet" in thread_id.lower() or "exercise" in thread_id.lower()):
-                            belongs_to_agent = True
-                    
-                    # For Diet/Exercise: Accept if state matches AND thread name matches
-                    elif agent == "DIET" and state_agent == "DIET":
-                        belongs_to_agent = True
-                    elif agent == "EXERCISE" and state_agent == "EXERCISE":
-                        belongs_to_agent = True
-            except:
-                pass
-        
-        # Method 4: For old threads without agent info, only show in MENTAL_HEALTH
-        if not belongs_to_agent and agent == "MENTAL_HEALTH":
-            # Only include old format threads that are truly unassigned
-            if (thread_id.startswith("chat_") or 
-                (thread_id.startswith("wellness_") and len(thread_id.split("_")) == 2)):
-                
-                # Make sure it doesn't belong to other agents by name
-                if not ("diet" in thread_id.lower() or "exercise" in thread_id.lower()):
-                    belongs_to_agent = True
-        
-        if belongs_to_agent:
-            agent_threads.append(thread_id)
-    
-    return agent_threads
+    return get_user_threads(user_id, agent)
 
 def generate_agent_thread_id(agent: str):
     """Generate agent-specific thread ID"""
-    current_time = datetime.datetime.now()
-    return f"wellness_{agent.lower()}_{current_time.strftime('%Y%m%d_%H%M%S')}"
+    return new_thread_id(agent)
 
-def load_conversation(thread_id):
+def load_conversation(thread_id, user_id=None):
     """Load conversation from the backend state with timestamps"""
     try:
         # Try to get messages with timestamps from our custom function
@@ -718,8 +671,23 @@ def load_conversation(thread_id):
         if processed_messages:
             return processed_messages
         
+        # Fall back to the conversation store, which rehydrates archived sessions
+        if user_id is None and st.session_state.get("user_profile"):
+            user_id = st.session_state.user_profile.get("user_id")
+        if user_id:
+            stored_messages = get_session_conversation(thread_id, user_id)
+            if stored_messages:
+                return [
+                    {
+                        "role": "user" if message.get("type") == "user" else "assistant",
+                        "content": message.get("content", ""),
+                        "timestamp": message.get("timestamp", "Unknown")
+                    }
+                    for message in stored_messages
+                ]
+        
         # Fallback to regular state loading
-        state = chatbot.get_state(config={"configurable": {"thread_id": thread_id}})
+        state = load_chatbot().get_state(config={"configurable": {"thread_id": thread_id}})
         messages = state.values.get('messages', [])
         timestamps = state.values.get('time_stamps', [])
         
@@ -1249,7 +1217,7 @@ def get_agent_response(user_input, agent_type, user_profile):
         }
         
         config: RunnableConfig = {"configurable": {"thread_id": st.session_state.thread_id}}
-        final_result = chatbot.invoke(state_input, config=config)
+        final_result = load_chatbot().invoke(state_input, config=config)
         
         if 'messages' in final_result and len(final_result['messages']) > 1:
             ai_message = final_result['messages'][-1]
@@ -1267,9 +1235,10 @@ def get_agent_response(user_input, agent_type, user_profile):
 def show_wellness_overview(user_id):
     """Show wellness overview metrics"""
     # Get session counts by agent
-    mental_sessions = len(get_agent_specific_threads(user_id, "MENTAL_HEALTH"))
-    diet_sessions = len(get_agent_specific_threads(user_id, "DIET"))
-    exercise_sessions = len(get_agent_specific_threads(user_id, "EXERCISE"))
+    threads_by_agent = get_user_threads_by_agent(user_id)
+    mental_sessions = len(threads_by_agent["MENTAL_HEALTH"])
+    diet_sessions = len(threads_by_agent["DIET"])
+    exercise_sessions = len(threads_by_agent["EXERCISE"])
     # Total should be sum of actual agent sessions
     total_sessions = mental_sessions + diet_sessions + exercise_sessions
     
@@ -1528,6 +1497,15 @@ def show_ner_insights(user_id):
                                     st.write(f"**Significance:** {person.get('significance')}")
                                 if person.get('timestamp'):
                                     st.write(f"**First Mentioned:** {format_timestamp(person.get('timestamp'))}")
+                                if person.get('mention_count', 0) > 1:
+                                    st.write(f"**Mentioned:** {person['mention_count']} times in {person.get('session_count', 1)} sessions, "
+                                             f"last on {format_timestamp(person.get('last_mentioned', ''))}")
+                            
+                            related = get_cooccurring_entities(user_id, "people", name, limit=5)
+                            if related:
+                                st.write("**Often comes up with:** " + ", ".join(
+                                    f"{item['name']} ({item['sessions']})" for item in related
+                                ))
                             
                             # Close button for details
                             if st.button("Hide Details", key=f"hide_{person_key}"):
@@ -1698,16 +1676,17 @@ def show_session_analysis(user_id):
     st.markdown("#### 💬 Session Analysis by Agent")
     
     # Get all sessions
-    all_threads = retrieve_user_threads(user_id)
-    
-    if not all_threads:
+    if not get_user_session_index(user_id):
         st.info("No conversation sessions found. Start chatting to see session analysis!")
         return
     
+    show_conversation_search(user_id)
+    
     # Organize sessions by agent
-    mental_threads = get_agent_specific_threads(user_id, "MENTAL_HEALTH")
-    diet_threads = get_agent_specific_threads(user_id, "DIET")
-    exercise_threads = get_agent_specific_threads(user_id, "EXERCISE")
+    threads_by_agent = get_user_threads_by_agent(user_id)
+    mental_threads = threads_by_agent["MENTAL_HEALTH"]
+    diet_threads = threads_by_agent["DIET"]
+    exercise_threads = threads_by_agent["EXERCISE"]
     
     # Create tabs for each agent
     tab1, tab2, tab3 = st.tabs([f"🧠 Mental Health ({len(mental_threads)})", 
@@ -1723,6 +1702,38 @@ def show_session_analysis(user_id):
     with tab3:
         show_agent_sessions(user_id, exercise_threads, "Exercise & Fitness", "💪")
 
+def show_conversation_search(user_id):
+    """Search box over the user's messages and mentioned entities"""
+    query = st.text_input("🔍 Search your conversations", placeholder="e.g. saas, biryani recipe, gym",
+                          key="conversation_search_query")
+    if not query.strip():
+        return
+    
+    results = search_user_conversations(user_id, query)
+    if not results:
+        st.info(f"No matches found for \"{query}\".")
+        return
+    
+    st.caption(f"{len(results)} best matches")
+    for i, result in enumerate(results):
+        thread_id = result["session_id"]
+        col1, col2 = st.columns([5, 1])
+        with col1:
+            source = "💬 Message" if result["source"] == "message" else f"🏷️ {result['source'].replace('_', ' ').title()}"
+            st.markdown(f"{source} · Session `{thread_id[-12:]}` · {format_timestamp(result.get('timestamp') or '')}")
+            st.write(result["snippet"])
+        with col2:
+            if st.button("Open", key=f"search_open_{i}_{thread_id}"):
+                st.session_state.current_agent = agent_from_thread_id(thread_id) or "MENTAL_HEALTH"
+                st.session_state.thread_id = thread_id
+                st.session_state.message_history = load_conversation(thread_id, user_id)
+                
+                st.session_state.show_profile_analysis = False
+                st.session_state.show_dashboard = False
+                st.session_state.show_chat = True
+                st.rerun()
+    st.markdown("---")
+
 def show_agent_sessions(user_id, threads, agent_name, icon):
     """Show sessions for a specific agent"""
     if not threads:
@@ -1731,14 +1742,18 @@ def show_agent_sessions(user_id, threads, agent_name, icon):
     
     st.markdown(f"### {icon} {agent_name} Sessions")
     
+    # Load the session index and entities once, without message bodies
+    session_index = {entry["session_id"]: entry for entry in get_user_session_index(user_id)}
+    sessions = load_user_sessions(user_id, include_messages=False)
+    
     for thread_id in threads[::-1]:  # Most recent first
         try:
-            # Get session summary from NER data
-            ner_data = load_user_ner_data(user_id)
-            session_data = ner_data.get("sessions", {}).get(thread_id, {})
+            index_entry = session_index.get(thread_id, {})
+            session_data = sessions.get(thread_id, {})
+            message_count = index_entry.get("message_count", 0)
             
             # Create expandable session card
-            with st.expander(f"💬 Session: {thread_id[-12:]} | Messages: {len(session_data.get('messages', []))}"):
+            with st.expander(f"💬 Session: {thread_id[-12:]} | Messages: {message_count}"):
                 
                 if session_data:
                     col1, col2 = st.columns(2)
@@ -1746,9 +1761,9 @@ def show_agent_sessions(user_id, threads, agent_name, icon):
                     with col1:
                         st.markdown("**Session Info**")
                         st.write(f"**Session ID:** {thread_id}")
-                        st.write(f"**Created:** {session_data.get('created_at', 'N/A')}")
-                        st.write(f"**Last Updated:** {session_data.get('last_updated', 'N/A')}")
-                        st.write(f"**Total Messages:** {len(session_data.get('messages', []))}")
+                        st.write(f"**Created:** {index_entry.get('created_at', 'N/A')}")
+                        st.write(f"**Last Updated:** {index_entry.get('last_updated', 'N/A')}")
+                        st.write(f"**Total Messages:** {message_count}")
                     
                     with col2:
                         st.markdown("**Entities Mentioned**")
@@ -2407,9 +2422,10 @@ def show_main_dashboard_content():
         st.markdown('<div class="metric-card"><h4>Activity Level</h4><h2>{}</h2></div>'.format(activity_level), unsafe_allow_html=True)
     with col4:
         # Get actual session count by agent
-        mental_sessions = len(get_agent_specific_threads(user_profile["user_id"], "MENTAL_HEALTH"))
-        diet_sessions = len(get_agent_specific_threads(user_profile["user_id"], "DIET"))
-        exercise_sessions = len(get_agent_specific_threads(user_profile["user_id"], "EXERCISE"))
+        threads_by_agent = get_user_threads_by_agent(user_profile["user_id"])
+        mental_sessions = len(threads_by_agent["MENTAL_HEALTH"])
+        diet_sessions = len(threads_by_agent["DIET"])
+        exercise_sessions = len(threads_by_agent["EXERCISE"])
         total_sessions = mental_sessions + diet_sessions + exercise_sessions
         st.markdown('<div class="metric-card"><h4>Total Sessions</h4><h2>{}</h2></div>'.format(total_sessions), unsafe_allow_html=True)
     
@@ -2641,7 +2657,7 @@ def show_routine_type_section(user_id, plans, plan_type, icon):
             
             # Get from hybrid system if available
             try:
-                plan_id = getattr(plan, 'plan_id', f"{plan.plan_type}_{plan.created_date.isoformat()}")
+                plan_id = plan.plan_id
                 
                 # Try to get from SQL database via hybrid system
                 if SQL_AVAILABLE:
@@ -2698,14 +2714,14 @@ def show_routine_type_section(user_id, plans, plan_type, icon):
             col1, col2, col3 = st.columns(3)
             
             with col1:
-                show_progress_button = st.button(f"📝 Log Progress", key=f"progress_{plan.created_date}_{plan.plan_type}")
+                show_progress_button = st.button(f"📝 Log Progress", key=f"progress_{plan.plan_id}")
             
             with col2:
-                if st.button(f"📋 View Full Routine", key=f"view_{plan.created_date}_{plan.plan_type}"):
+                if st.button(f"📋 View Full Routine", key=f"view_{plan.plan_id}"):
                     show_full_routine_details(plan)
             
             with col3:
-                update_routine_button = st.button(f"🔄 Update Routine", key=f"update_{plan.created_date}_{plan.plan_type}")
+                update_routine_button = st.button(f"🔄 Update Routine", key=f"update_{plan.plan_id}")
                 if update_routine_button:
                     update_routine_plan(user_id, plan)
             
@@ -2717,7 +2733,7 @@ def show_progress_logging_form(user_id, plan):
     """Show form for logging progress on routine"""
     st.markdown("#### 📝 Log Your Progress")
     
-    with st.form(f"progress_form_{plan.created_date}_{plan.plan_type}"):
+    with st.form(f"progress_form_{plan.plan_id}"):
         progress_notes = st.text_area("How did today go with your routine?", height=100)
         completed_activities = st.number_input("Activities completed today", min_value=0, max_value=len(plan.daily_schedule), value=0)
         satisfaction_level = st.slider("Satisfaction with today's progress", 1, 10, 5)
@@ -2735,8 +2751,7 @@ def show_progress_logging_form(user_id, plan):
             
             # Try hybrid logging first, then fallback to original method
             try:
-                # Generate plan_id based on plan attributes
-                plan_id = getattr(plan, 'plan_id', f"{plan.plan_type}_{plan.created_date.isoformat()}")
+                plan_id = plan.plan_id
                 
                 # Use hybrid logging
                 result = log_progress_hybrid(user_id, plan_id, progress_data)
@@ -2747,7 +2762,7 @@ def show_progress_logging_form(user_id, plan):
                     st.rerun()  # Refresh to show updated progress
                 else:
                     # Fallback to original method
-                    plan_key = f"{plan.plan_type}_{plan.created_date.isoformat()}"
+                    plan_key = plan.plan_id
                     success = update_routine_progress(user_id, plan_key, progress_data)
                     
                     if success:
@@ -2758,7 +2773,7 @@ def show_progress_logging_form(user_id, plan):
                         
             except Exception as e:
                 # Fallback to original method
-                plan_key = f"{plan.plan_type}_{plan.created_date.isoformat()}"
+                plan_key = plan.plan_id
                 success = update_routine_progress(user_id, plan_key, progress_data)
                 
                 if success:
@@ -2785,7 +2800,7 @@ def update_routine_plan(user_id, plan):
             if new_routine and hasattr(new_routine, 'daily_schedule'):
                 # Update the existing plan with new routine data
                 wellness_data = load_user_wellness_data(user_id)
-                plan_key = f"{plan.plan_type}_{plan.created_date.isoformat()}"
+                plan_key = plan.plan_id
                 
                 if "routine_plans" in wellness_data and plan_key in wellness_data["routine_plans"]:
                     # Convert Pydantic objects to dictionaries for JSON storage
@@ -2830,7 +2845,7 @@ def update_routine_plan(user_id, plan):
                                 "title": new_routine.title,
                                 "description": new_routine.description
                             }
-                            plan_id = getattr(plan, 'plan_id', plan_key)
+                            plan_id = plan.plan_id
                             create_routine_plan_hybrid(user_id, updated_plan_data)
                     except:
                         pass  # SQL update is optional
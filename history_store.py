@@ -0,0 +1,298 @@
+"""
+Maintenance of history.db, the LangGraph checkpoint store.
+
+SqliteSaver writes a checkpoint for every graph super-step, each holding the full message
+list, and never deletes one. Pruning keeps the latest checkpoints of each thread (optionally
+plus the last checkpoint of each day) and the pending writes that belong to them, and
+compaction hands the freed pages back to the filesystem. Deleted conversations are queued
+for purging, and a background reclaim job removes all of their checkpoints and writes.
+
+Only sqlite3 is used, so database_manager.py can run this without importing langgraph. All
+work is done in short transactions, so it can run while the app is serving chats.
+"""
+
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+HISTORY_DB_FILE = "history.db"
+
+# Checkpoints kept per thread by pruning; the latest one is all get_state needs
+CHECKPOINT_RETENTION = int(os.getenv("CHECKPOINT_RETENTION", "10"))
+
+# Threads pruned per transaction, and free pages released per incremental vacuum step
+PRUNE_BATCH_SIZE = 50
+VACUUM_STEP_PAGES = 1000
+
+# Offset between the UUID epoch (1582-10-15) and the Unix epoch, in 100 ns intervals
+_UUID_EPOCH_OFFSET = 0x01B21DD213814000
+
+def connect_history_db(path: str = HISTORY_DB_FILE) -> sqlite3.Connection:
+    """Open history.db for maintenance, waiting for the app's writes instead of failing"""
+    return sqlite3.connect(path, timeout=30, isolation_level=None)
+
+def history_db_size(path: str = HISTORY_DB_FILE) -> int:
+    """Bytes used by history.db, including its WAL"""
+    return sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix))
+
+def checkpoint_time(checkpoint_id: str) -> Optional[datetime]:
+    """Creation time encoded in a checkpoint ID (a time-ordered UUIDv6), or None for other IDs"""
+    try:
+        value = uuid.UUID(checkpoint_id)
+    except ValueError:
+        return None
+    if value.version != 6:
+        return None
+    ticks = ((value.int >> 96) << 28) | (((value.int >> 80) & 0xFFFF) << 12) | ((value.int >> 64) & 0x0FFF)
+    return datetime.fromtimestamp((ticks - _UUID_EPOCH_OFFSET) / 1e7, timezone.utc)
+
+def checkpoints_to_keep(checkpoint_ids: List[str], keep: int, daily_snapshots: bool = False) -> set:
+    """The latest keep checkpoint IDs of a thread, plus the last one of each day if daily_snapshots"""
+    newest_first = sorted(checkpoint_ids, reverse=True)
+    kept = set(newest_first[:keep])
+    if daily_snapshots:
+        days = set()
+        for checkpoint_id in newest_first:
+            created = checkpoint_time(checkpoint_id)
+            if created and created.date() not in days:
+                days.add(created.date())
+                kept.add(checkpoint_id)
+    return kept
+
+# Reclaim job running in this process, and whether more threads were queued while it ran
+_reclaim_lock = threading.Lock()
+_reclaim_state = {"worker": None, "pending": False}
+
+def with_delta_bases(kept: set, chain: Dict[str, tuple]) -> set:
+    """Add the checkpoints that kept delta checkpoints are rebuilt from
+
+    chain maps each checkpoint ID of a thread to (parent_checkpoint_id, delta_depth).
+    """
+    for checkpoint_id in list(kept):
+        parent_id, depth = chain.get(checkpoint_id, (None, 0))
+        while depth and parent_id in chain and parent_id not in kept:
+            kept.add(parent_id)
+            parent_id, depth = chain[parent_id]
+    return kept
+
+def _has_delta_depth(conn: sqlite3.Connection) -> bool:
+    """Whether checkpoints were written by DeltaSqliteSaver, which records each one's delta depth"""
+    return any(row[1] == "delta_depth" for row in conn.execute("PRAGMA table_info(checkpoints)"))
+
+def _tables_exist(conn: sqlite3.Connection) -> bool:
+    """Whether SqliteSaver has created its tables in this database yet"""
+    row = conn.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN ('checkpoints', 'writes')"
+    ).fetchone()
+    return row[0] == 2
+
+def prune_checkpoints(keep: int = CHECKPOINT_RETENTION, daily_snapshots: bool = False,
+                      path: str = HISTORY_DB_FILE, batch_size: int = PRUNE_BATCH_SIZE) -> Dict[str, Any]:
+    """Delete all but the latest keep checkpoints of every thread, with their pending writes"""
+    if keep < 1:
+        raise ValueError("At least the latest checkpoint of each thread must be kept")
+    stats = {"threads": 0, "deleted_checkpoints": 0, "deleted_writes": 0}
+    if not os.path.exists(path):
+        return {"success": True, **stats, "message": f"{path} not found"}
+
+    conn = connect_history_db(path)
+    try:
+        if not _tables_exist(conn):
+            return {"success": True, **stats, "message": "No checkpoints yet"}
+        threads = conn.execute("SELECT DISTINCT thread_id, checkpoint_ns FROM checkpoints").fetchall()
+        depth_column = "delta_depth" if _has_delta_depth(conn) else "0"
+        for start in range(0, len(threads), batch_size):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for thread_id, checkpoint_ns in threads[start:start + batch_size]:
+                    chain = {row[0]: (row[1], row[2]) for row in conn.execute(
+                        f"SELECT checkpoint_id, parent_checkpoint_id, {depth_column} FROM checkpoints "
+                        "WHERE thread_id = ? AND checkpoint_ns = ?",
+                        (thread_id, checkpoint_ns)
+                    )}
+                    checkpoint_ids = list(chain)
+                    # Delta checkpoints keep the chain back to their last full snapshot
+                    kept = with_delta_bases(checkpoints_to_keep(checkpoint_ids, keep, daily_snapshots), chain)
+                    removed = [(thread_id, checkpoint_ns, checkpoint_id)
+                               for checkpoint_id in checkpoint_ids if checkpoint_id not in kept]
+                    if not removed:
+                        continue
+                    conn.executemany(
+                        "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                        removed
+                    )
+                    stats["deleted_checkpoints"] += len(removed)
+                    cursor = conn.executemany(
+                        "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                        removed
+                    )
+                    stats["deleted_writes"] += max(cursor.rowcount, 0)
+                    stats["threads"] += 1
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+        return {
+            "success": True, **stats,
+            "message": f"Deleted {stats['deleted_checkpoints']} checkpoints and {stats['deleted_writes']} writes "
+                       f"from {stats['threads']} threads"
+        }
+    except sqlite3.Error as e:
+        return {"success": False, **stats, "message": f"Error pruning checkpoints: {str(e)}"}
+    finally:
+        conn.close()
+
+def _ensure_purge_queue(conn: sqlite3.Connection):
+    """Create the queue of threads waiting to be purged"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS purge_queue (
+            thread_id TEXT PRIMARY KEY,
+            queued_at TEXT NOT NULL
+        )
+    """)
+
+def _delete_threads(conn: sqlite3.Connection, thread_ids: List[str]) -> Dict[str, int]:
+    """Delete every checkpoint and pending write of the given threads"""
+    params = [(thread_id,) for thread_id in thread_ids]
+    deleted_checkpoints = conn.executemany("DELETE FROM checkpoints WHERE thread_id = ?", params).rowcount
+    deleted_writes = conn.executemany("DELETE FROM writes WHERE thread_id = ?", params).rowcount
+    return {"deleted_checkpoints": max(deleted_checkpoints, 0), "deleted_writes": max(deleted_writes, 0)}
+
+def queue_thread_purge(thread_ids: List[str], path: str = HISTORY_DB_FILE) -> int:
+    """Queue threads of deleted conversations for purging, returning how many were queued"""
+    if not thread_ids or not os.path.exists(path):
+        return 0
+    conn = connect_history_db(path)
+    try:
+        _ensure_purge_queue(conn)
+        queued_at = datetime.now(timezone.utc).isoformat()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany("INSERT OR IGNORE INTO purge_queue (thread_id, queued_at) VALUES (?, ?)",
+                         [(thread_id, queued_at) for thread_id in thread_ids])
+        conn.execute("COMMIT")
+        return len(thread_ids)
+    finally:
+        conn.close()
+
+def purge_queued_threads(path: str = HISTORY_DB_FILE, batch_size: int = PRUNE_BATCH_SIZE) -> Dict[str, Any]:
+    """Delete the checkpoints and writes of queued threads, batch_size threads per transaction"""
+    stats = {"threads": 0, "deleted_checkpoints": 0, "deleted_writes": 0}
+    if not os.path.exists(path):
+        return {"success": True, **stats, "message": f"{path} not found"}
+
+    conn = connect_history_db(path)
+    try:
+        _ensure_purge_queue(conn)
+        has_checkpoints = _tables_exist(conn)
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                thread_ids = [row[0] for row in conn.execute(
+                    "SELECT thread_id FROM purge_queue ORDER BY queued_at LIMIT ?", (batch_size,)
+                )]
+                if not thread_ids:
+                    conn.execute("COMMIT")
+                    break
+                if has_checkpoints:
+                    for key, count in _delete_threads(conn, thread_ids).items():
+                        stats[key] += count
+                conn.executemany("DELETE FROM purge_queue WHERE thread_id = ?", [(t,) for t in thread_ids])
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+            stats["threads"] += len(thread_ids)
+        return {
+            "success": True, **stats,
+            "message": f"Purged {stats['threads']} threads: {stats['deleted_checkpoints']} checkpoints "
+                       f"and {stats['deleted_writes']} writes"
+        }
+    except sqlite3.Error as e:
+        return {"success": False, **stats, "message": f"Error purging threads: {str(e)}"}
+    finally:
+        conn.close()
+
+def compact_history_db(path: str = HISTORY_DB_FILE, step_pages: int = VACUUM_STEP_PAGES,
+                       enable_incremental: bool = True) -> Dict[str, Any]:
+    """Return history.db's free pages to the filesystem and truncate its WAL
+
+    The first run switches the database to incremental auto-vacuum, which takes one full
+    VACUUM (skipped when enable_incremental is False). Later runs release free pages
+    step_pages at a time, so the app's writes only ever wait for one short step.
+    """
+    if not os.path.exists(path):
+        return {"success": True, "size_before": 0, "size_after": 0, "message": f"{path} not found"}
+
+    size_before = history_db_size(path)
+    conn = connect_history_db(path)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            if not enable_incremental:
+                # Free pages are reused by later checkpoints until compact-history converts the file
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                return {"success": True, "size_before": size_before, "size_after": history_db_size(path),
+                        "message": f"{path} is not in incremental auto-vacuum mode yet"}
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        while free_pages:
+            # execute() steps the pragma once, freeing a single page; executescript runs it to completion
+            conn.executescript(f"PRAGMA incremental_vacuum({int(step_pages)});")
+            remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if remaining >= free_pages:
+                break
+            free_pages = remaining
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    except sqlite3.Error as e:
+        return {"success": False, "size_before": size_before, "size_after": history_db_size(path),
+                "message": f"Error compacting {path}: {str(e)}"}
+    finally:
+        conn.close()
+
+    size_after = history_db_size(path)
+    return {
+        "success": True, "size_before": size_before, "size_after": size_after,
+        "message": f"{path}: {size_before / 1024:,.0f} KB -> {size_after / 1024:,.0f} KB"
+    }
+
+def reclaim_history_space(path: str = HISTORY_DB_FILE, enable_incremental: bool = True) -> Dict[str, Any]:
+    """Purge queued threads, then release the pages they used"""
+    purged = purge_queued_threads(path)
+    if not purged["success"]:
+        return purged
+    compacted = compact_history_db(path, enable_incremental=enable_incremental)
+    return {**purged, **compacted, "message": f"{purged['message']}; {compacted['message']}"}
+
+def _run_reclaim_job(path: str):
+    """Reclaim space until no more threads were queued during the last pass"""
+    while True:
+        try:
+            result = reclaim_history_space(path, enable_incremental=False)
+            if not result["success"]:
+                print(result["message"])
+        except Exception as e:
+            print(f"Error reclaiming {path}: {e}")
+        with _reclaim_lock:
+            if not _reclaim_state["pending"]:
+                _reclaim_state["worker"] = None
+                return
+            _reclaim_state["pending"] = False
+
+def start_reclaim_job(path: str = HISTORY_DB_FILE) -> bool:
+    """Purge queued threads on a background thread, returning False if one is already running
+
+    A job already running makes one more pass instead, so threads queued meanwhile are
+    purged too. It never runs the full VACUUM that compact-history uses to switch the
+    database to incremental auto-vacuum.
+    """
+    with _reclaim_lock:
+        if _reclaim_state["worker"] is not None:
+            _reclaim_state["pending"] = True
+            return False
+        worker = threading.Thread(target=_run_reclaim_job, args=(path,), name="history-reclaim", daemon=True)
+        _reclaim_state["worker"] = worker
+        worker.start()
+        return True
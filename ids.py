@@ -0,0 +1,101 @@
+"""
+ID generation for users, chat threads and routine plans.
+
+IDs are ULID-style: 26 Crockford base32 characters encoding a 48-bit millisecond
+timestamp, a 32-bit per-process node and a 48-bit per-process sequence. They sort
+by creation time, increase monotonically within a process and do not collide
+across processes, so no file or table has to be read to allocate one.
+"""
+
+import itertools
+import os
+import random
+import re
+import time
+from datetime import datetime
+from typing import Optional
+
+CROCKFORD_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+ID_LENGTH = 26
+
+AGENT_TYPES = ("MENTAL_HEALTH", "DIET", "EXERCISE")
+
+_NODE_BITS = 32
+_SEQUENCE_BITS = 48
+_SEQUENCE_MASK = (1 << _SEQUENCE_BITS) - 1
+
+_node = 0
+_sequence = itertools.count()
+
+def _reseed():
+    """Pick a fresh node and sequence start for this process"""
+    global _node, _sequence
+    rng = random.SystemRandom()
+    _node = rng.getrandbits(_NODE_BITS)
+    # Start low in the sequence space so it never wraps within a process lifetime
+    _sequence = itertools.count(rng.getrandbits(_SEQUENCE_BITS - 8))
+
+_reseed()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reseed)
+
+def _encode(value: int) -> str:
+    """Encode a 128-bit integer as 26 Crockford base32 characters"""
+    chars = []
+    for _ in range(ID_LENGTH):
+        chars.append(CROCKFORD_ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+def new_ulid() -> str:
+    """Generate a time-sortable, collision-free ID"""
+    # next() on itertools.count is atomic under the GIL, so no lock is needed
+    sequence = next(_sequence) & _SEQUENCE_MASK
+    millis = time.time_ns() // 1_000_000
+    value = (millis << (_NODE_BITS + _SEQUENCE_BITS)) | (_node << _SEQUENCE_BITS) | sequence
+    return _encode(value)
+
+def ulid_timestamp(ulid: str) -> Optional[datetime]:
+    """Return the creation time encoded in an ID, or None if it is not a valid ID"""
+    ulid = ulid.upper()
+    if len(ulid) != ID_LENGTH or any(ch not in CROCKFORD_ALPHABET for ch in ulid):
+        return None
+    value = 0
+    for ch in ulid:
+        value = (value << 5) | CROCKFORD_ALPHABET.index(ch)
+    return datetime.fromtimestamp((value >> (_NODE_BITS + _SEQUENCE_BITS)) / 1000)
+
+def new_user_id() -> str:
+    """Generate a user ID"""
+    return f"user_{new_ulid()}"
+
+def new_plan_id() -> str:
+    """Generate a routine plan ID"""
+    return f"plan_{new_ulid()}"
+
+def new_thread_id(agent: str) -> str:
+    """Generate an agent-specific conversation thread ID"""
+    return f"wellness_{agent.lower()}_{new_ulid()}"
+
+_THREAD_ID_PATTERN = re.compile(r"^wellness_(mental_health|diet|exercise)_(.+)$")
+
+def agent_from_thread_id(thread_id: str) -> Optional[str]:
+    """Return the agent a thread belongs to, or None if its ID carries no agent
+
+    Understands both the current wellness_{agent}_{ulid} IDs and the legacy
+    wellness_{agent}_{%Y%m%d_%H%M%S} IDs, plus older names mentioning an agent.
+    """
+    match = _THREAD_ID_PATTERN.match(thread_id)
+    if match:
+        return match.group(1).upper()
+
+    lowered = thread_id.lower()
+    if "diet" in lowered:
+        return "DIET"
+    if "exercise" in lowered:
+        return "EXERCISE"
+    return None
+
+def is_legacy_thread_id(thread_id: str) -> bool:
+    """Check whether a thread ID uses a pre-agent format (chat_* or wellness_{timestamp})"""
+    return thread_id.startswith("chat_") or bool(re.match(r"^wellness_(\d{8}_\d{6}|[^_]+)$", thread_id))
@@ -0,0 +1,469 @@
+"""
+Bulk JSON to SQL migration.
+
+users_data.json, the per-user wellness files and legacy ner_data files are parsed in a
+process pool, and the parsed rows are written from the main process in batches of users,
+one transaction per batch. Parsing only reads JSON, so workers never import backend or
+open the database.
+
+Each batch also checkpoints its sources in migration_state, with the file mtime and a hash
+of the users_data.json entry. An interrupted run resumes after its last committed batch, and
+an incremental run only migrates sources that changed since they were last migrated.
+
+Verification compares the two sides per user: workers read one user's JSON files and SQL rows
+at a time, hash each category (account, profile, health logs, sessions, messages) and only
+return diffs for the categories whose hashes differ.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from storage import USERS_DATA_FILE, find_wellness_file, session_archive_path, read_session_archive
+from database import (
+    import_users_batch_sql, get_migration_state_sql, update_migration_run_sql, import_row_count,
+    get_user_ids_sql, get_user_snapshot_sql, PROFILE_FIELDS, HEALTH_FIELDS, VALID_AGENT_TYPES, IMPORT_STATS
+)
+
+NER_DATA_DIR = "ner_data"
+
+# Users per write transaction, and per task handed to a parsing worker
+MIGRATION_BATCH_SIZE = 200
+PARSE_CHUNK_SIZE = 25
+
+# Categories hashed per user by verification, and how many mismatched users are printed in full
+VERIFY_CATEGORIES = ("user", "profile", "health", "sessions", "messages")
+VERIFY_REPORT_LIMIT = 20
+
+def _load_json(path: Optional[str]) -> Dict[str, Any]:
+    """Load a JSON file, or an empty dict if there is none"""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _user_account(user_id: str, user_info: Dict[str, Any]) -> Dict[str, Any]:
+    """Account fields of a users_data.json entry, in either of its formats"""
+    if "full_name" in user_info:
+        # New format (user_0006 style)
+        full_name = user_info.get("full_name", "Unknown User")
+        password_hash = user_info.get("password_hash")
+    else:
+        # Old format (user_0001-0005 style)
+        full_name = user_info.get("name", "Unknown User")
+        password_hash = None
+    return {
+        "user_id": user_id,
+        "full_name": full_name,
+        "cnic": user_info.get("cnic"),
+        "email": user_info.get("email"),
+        "phone": user_info.get("phone"),
+        "password_hash": password_hash
+    }
+
+def _user_profile(user_id: str, user_info: Dict[str, Any], wellness_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Profile embedded in users_data.json, overridden by the wellness file's profile"""
+    profile = {}
+    if "age" in user_info or "height" in user_info:
+        profile = {field: user_info.get(field) for field in PROFILE_FIELDS if user_info.get(field) is not None}
+    profile.update(wellness_data.get("profile") or {})
+    profile["user_id"] = user_id
+    return profile if len(profile) > 1 else None
+
+def _session_items(user_id: str, sessions: Dict[str, Any]) -> List[tuple]:
+    """(session_id, session_data) pairs, with archived messages put back in front of the inline ones"""
+    items = []
+    for session_id, session_data in sessions.items():
+        if session_data.get("archived_message_count"):
+            archived = read_session_archive(session_archive_path(user_id, session_id))
+            session_data = {**session_data, "messages": archived + session_data.get("messages", [])}
+        items.append((session_id, session_data))
+    return items
+
+def parse_user(user_id: str, user_info: Dict[str, Any]) -> Dict[str, Any]:
+    """Everything to migrate for one user, read from users_data.json and their wellness file"""
+    parsed = {"user_id": user_id, "user": _user_account(user_id, user_info), "profile": None,
+              "health": [], "sessions": [], "errors": []}
+    try:
+        wellness_data = _load_json(find_wellness_file(user_id))
+    except (OSError, ValueError) as e:
+        parsed["errors"].append(f"Could not load wellness data: {e}")
+        wellness_data = {}
+
+    parsed["profile"] = _user_profile(user_id, user_info, wellness_data)
+    parsed["health"] = [
+        {**log_data, "user_id": user_id, "date": log_date}
+        for log_date, log_data in (wellness_data.get("health_logs") or {}).items()
+    ]
+    try:
+        parsed["sessions"] = _session_items(user_id, wellness_data.get("sessions") or {})
+    except (OSError, ValueError) as e:
+        parsed["errors"].append(f"Could not load archived sessions: {e}")
+    return parsed
+
+def parse_ner_file(path: str) -> Dict[str, Any]:
+    """Sessions of a legacy ner_data/{user_id}_ner.json file"""
+    user_id = os.path.basename(path)[:-len("_ner.json")]
+    parsed = {"user_id": user_id, "user": None, "profile": None, "health": [], "sessions": [], "errors": []}
+    try:
+        ner_data = _load_json(path)
+        parsed["user_id"] = ner_data.get("user_id") or user_id
+        parsed["sessions"] = list((ner_data.get("sessions") or {}).items())
+    except (OSError, ValueError) as e:
+        parsed["errors"].append(f"Could not load {path}: {e}")
+    return parsed
+
+def parse_sources(chunk: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Parse a chunk of sources, carrying each source's checkpoint fields through"""
+    parsed_chunk = []
+    for source in chunk:
+        if source["kind"] == "user":
+            parsed = parse_user(source["user_id"], source["info"])
+        else:
+            parsed = parse_ner_file(source["path"])
+        parsed.update(source=source["source"], mtime=source["mtime"], hash=source["hash"])
+        parsed_chunk.append(parsed)
+    return parsed_chunk
+
+def _mtime(path: Optional[str]) -> float:
+    """Modification time of a file, or 0 if it does not exist"""
+    try:
+        return os.path.getmtime(path) if path else 0.0
+    except OSError:
+        return 0.0
+
+def migration_sources(users_data: Dict[str, Any], ner_data_dir: str = NER_DATA_DIR) -> List[Dict[str, Any]]:
+    """Sources to migrate: every user in users_data.json, then every legacy NER file"""
+    sources = [
+        {
+            "source": f"user:{user_id}", "kind": "user", "user_id": user_id, "info": user_info,
+            "mtime": _mtime(find_wellness_file(user_id)),
+            "hash": hashlib.md5(json.dumps(user_info, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        }
+        for user_id, user_info in users_data.items()
+    ]
+    if os.path.isdir(ner_data_dir):
+        for file_name in sorted(os.listdir(ner_data_dir)):
+            if file_name.endswith("_ner.json"):
+                path = os.path.join(ner_data_dir, file_name)
+                sources.append({"source": f"ner:{file_name}", "kind": "ner", "path": path,
+                                "mtime": _mtime(path), "hash": None})
+    return sources
+
+def _needs_migration(source: Dict[str, Any], state: Dict[str, Dict[str, Any]], run_id: Optional[int],
+                     resume: bool, incremental: bool, since: Optional[float]) -> bool:
+    """Check a source against its checkpoint: done in the resumed run, or unchanged for an incremental run"""
+    record = state.get(source["source"])
+    if not record or record["error"]:
+        return True
+    if resume and record["run_id"] == run_id:
+        return False
+    if not incremental:
+        return True
+    if since is not None:
+        return source["mtime"] >= since or source["hash"] != record["source_hash"]
+    return source["mtime"] != record["source_mtime"] or source["hash"] != record["source_hash"]
+
+def _chunks(items: List[Any], size: int) -> Iterator[List[Any]]:
+    """Split a list into consecutive chunks of at most size items"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def _exit_with_parent(parent_pid: int):
+    """Pool initializer: stop the worker if the migration process is killed mid-run
+
+    Workers share the task queue's pipe, so they never see it close when the parent dies.
+    """
+    def watch():
+        while os.getppid() == parent_pid:
+            time.sleep(1)
+        os._exit(1)
+    threading.Thread(target=watch, daemon=True).start()
+
+def parse_in_pool(chunks: Iterable[Any], parse: Callable, workers: int) -> Iterator[Any]:
+    """Yield parse(chunk) for each chunk in order, parsing ahead in a bounded number of processes"""
+    if workers <= 1:
+        for chunk in chunks:
+            yield parse(chunk)
+        return
+
+    # Imported here since multiprocessing is a noticeable share of the CLI's startup time
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers, initializer=_exit_with_parent, initargs=(os.getpid(),)) as pool:
+        # Bound the parsed results waiting for the writer, so memory stays flat on large datasets
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(parse, chunk))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def _rate(count: int, elapsed: float) -> float:
+    """Items per second, guarding against a zero elapsed time"""
+    return count / elapsed if elapsed > 0 else 0.0
+
+def _eta(done: int, total: int, elapsed: float) -> str:
+    """Estimated time left at the current pace, as m:ss"""
+    if not done:
+        return "?"
+    seconds = int(elapsed / done * (total - done))
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+def run_bulk_migration(workers: Optional[int] = None, batch_size: int = MIGRATION_BATCH_SIZE,
+                       users_file: str = USERS_DATA_FILE, ner_data_dir: str = NER_DATA_DIR,
+                       run_id: Optional[int] = None, resume: bool = False, incremental: bool = False,
+                       since: Optional[float] = None) -> Dict[str, Any]:
+    """Migrate JSON users, profiles, health logs and conversations to SQL
+
+    With a run_id, batches are checkpointed under that run. resume skips sources already
+    checkpointed by the run. incremental only migrates sources whose wellness file or
+    users_data.json entry changed since they were last migrated (or whose file was modified
+    at or after since, a Unix timestamp), adding new messages to sessions already migrated.
+    """
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    sources = migration_sources(_load_json(users_file), ner_data_dir)
+    if run_id is not None:
+        update_migration_run_sql(run_id, total_sources=len(sources))
+    if run_id is not None and (resume or incremental):
+        state = get_migration_state_sql()
+        total = len(sources)
+        sources = [source for source in sources if _needs_migration(source, state, run_id, resume, incremental, since)]
+        print(f"Skipping {total - len(sources)} of {total} sources already migrated")
+
+    stats = dict.fromkeys(IMPORT_STATS, 0)
+    errors = []
+    print(f"Migrating {len(sources)} sources, parsing with {workers} workers")
+
+    started = time.perf_counter()
+    batch = []
+    done = 0
+
+    def write_batch():
+        result = import_users_batch_sql(batch, run_id, update=incremental)
+        if not result["success"]:
+            errors.extend((user["user_id"], result["message"]) for user in batch)
+        for key in IMPORT_STATS:
+            stats[key] += result[key]
+        errors.extend(result["errors"])
+
+    for parsed_chunk in parse_in_pool(_chunks(sources, PARSE_CHUNK_SIZE), parse_sources, workers):
+        for parsed in parsed_chunk:
+            errors.extend((parsed["user_id"], error) for error in parsed["errors"])
+            batch.append(parsed)
+        if len(batch) >= batch_size:
+            write_batch()
+            done += len(batch)
+            batch = []
+            elapsed = time.perf_counter() - started
+            rows = import_row_count(stats)
+            print(f"  {done}/{len(sources)} sources, {rows} rows ({_rate(rows, elapsed):,.0f} rows/s, "
+                  f"ETA {_eta(done, len(sources), elapsed)})")
+    if batch:
+        write_batch()
+        done += len(batch)
+
+    elapsed = time.perf_counter() - started
+    rows = import_row_count(stats)
+    return {
+        "success": not errors, **stats, "rows": rows, "sources": done, "errors": errors,
+        "seconds": round(elapsed, 2), "rows_per_second": round(_rate(rows, elapsed), 1),
+        "message": f"Migrated {rows} rows from {done} sources in {elapsed:.1f}s"
+    }
+
+# Verification
+USER_FIELDS = ("full_name", "cnic", "email", "phone", "password_hash")
+_NUMERIC_FIELDS = {"age", "height", "current_weight", "target_weight", "initial_weight"} | (set(HEALTH_FIELDS) - {"notes"})
+
+def _numeric(value: Any) -> Any:
+    """A number as SQLite's numeric column affinity stores it, so 70, 70.0 and "70" compare equal"""
+    if value is None:
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return value
+    return int(number) if number.is_integer() else number
+
+def _fields(record: Optional[Dict[str, Any]], fields: Iterable[str]) -> Optional[Dict[str, Any]]:
+    """The given fields of a record, with numeric ones normalized"""
+    if record is None:
+        return None
+    return {field: _numeric(record.get(field)) if field in _NUMERIC_FIELDS else record.get(field) for field in fields}
+
+def _canonical_messages(messages: List[Dict[str, Any]], fallback: Optional[str]) -> List[list]:
+    """Messages as [timestamp, type, content] rows in a fixed order, whatever order they were stored in"""
+    rows = [[message.get("timestamp") or fallback, message.get("type"), message.get("content", "")]
+            for message in messages]
+    return sorted(rows, key=lambda row: [str(value) for value in row])
+
+def _json_snapshot(user_id: str, user_info: Optional[Dict[str, Any]], ner_path: Optional[str],
+                   stored_sessions: Dict[str, Dict[str, Any]]) -> tuple:
+    """What the migration writes for a user, per verified category, and any errors reading their files"""
+    parsed = {"user": None, "profile": None, "health": [], "sessions": [], "errors": []}
+    if user_info is not None:
+        parsed = parse_user(user_id, user_info)
+    sessions = dict(parsed["sessions"])
+    errors = list(parsed["errors"])
+    if ner_path:
+        # Sessions already in the wellness file win, as they are migrated first
+        ner = parse_ner_file(ner_path)
+        errors.extend(ner["errors"])
+        for session_id, session_data in ner["sessions"]:
+            sessions.setdefault(session_id, session_data)
+
+    profile = parsed["profile"]
+    if profile is not None:
+        profile = {**profile, "preferred_language": profile.get("preferred_language", "English")}
+
+    messages = {}
+    for session_id, session_data in sessions.items():
+        # Messages without a timestamp were stamped with the session start, or the import time if it had none
+        fallback = session_data.get("created_at") or stored_sessions.get(session_id, {}).get("start_time")
+        messages[session_id] = _canonical_messages(session_data.get("messages", []), fallback)
+    return {
+        "user": _fields(parsed["user"], USER_FIELDS),
+        "profile": _fields(profile, PROFILE_FIELDS),
+        "health": {record["date"]: _fields(record, HEALTH_FIELDS) for record in parsed["health"]},
+        "sessions": {
+            session_id: session_data.get("agent") if session_data.get("agent") in VALID_AGENT_TYPES else None
+            for session_id, session_data in sessions.items()
+        },
+        "messages": messages
+    }, errors
+
+def _sql_snapshot(stored: Dict[str, Any]) -> Dict[str, Any]:
+    """A user's SQL rows per verified category, in the same form as _json_snapshot"""
+    return {
+        "user": _fields(stored["user"], USER_FIELDS),
+        "profile": _fields(stored["profile"], PROFILE_FIELDS),
+        "health": {log_date: _fields(record, HEALTH_FIELDS) for log_date, record in stored["health"].items()},
+        "sessions": {session_id: session["agent"] for session_id, session in stored["sessions"].items()},
+        "messages": {
+            session_id: _canonical_messages(session["messages"], None)
+            for session_id, session in stored["sessions"].items()
+        }
+    }
+
+def _digest(value: Any) -> str:
+    """Content hash of a canonical value"""
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def _short(value: Any, limit: int = 80) -> str:
+    """repr of a value, truncated for reports"""
+    text = repr(value)
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+def _diff(expected: Any, actual: Any, path: str) -> List[str]:
+    """Differences between a JSON value and its SQL counterpart, one line each"""
+    if expected is None and actual is not None:
+        return [f"{path}: only in SQL"]
+    if actual is None and expected is not None:
+        return [f"{path}: missing in SQL"]
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        lines = []
+        for key in sorted(set(expected) | set(actual), key=str):
+            where = f"{path}.{key}"
+            if key not in actual:
+                lines.append(f"{where}: missing in SQL")
+            elif key not in expected:
+                lines.append(f"{where}: only in SQL")
+            else:
+                lines.extend(_diff(expected[key], actual[key], where))
+        return lines
+    if isinstance(expected, list) and isinstance(actual, list):
+        lines = [f"{path}: {len(expected)} in JSON, {len(actual)} in SQL"] if len(expected) != len(actual) else []
+        for index in range(max(len(expected), len(actual))):
+            json_value = expected[index] if index < len(expected) else None
+            sql_value = actual[index] if index < len(actual) else None
+            if json_value != sql_value:
+                lines.append(f"{path}[{index}]: JSON {_short(json_value)}, SQL {_short(sql_value)}")
+                break
+        return lines
+    return [f"{path}: JSON {_short(expected)}, SQL {_short(actual)}"] if expected != actual else []
+
+def verify_user(user_id: str, user_info: Optional[Dict[str, Any]], ner_path: Optional[str]) -> Dict[str, Any]:
+    """Hash a user's JSON data and SQL rows per category, with diffs of the categories that differ"""
+    result = {"user_id": user_id, "mismatches": {}, "errors": []}
+    try:
+        stored = get_user_snapshot_sql(user_id)
+    except Exception as e:
+        result["errors"].append(f"Could not read SQL rows: {e}")
+        return result
+
+    expected, result["errors"] = _json_snapshot(user_id, user_info, ner_path, stored["sessions"])
+    if result["errors"]:
+        return result
+    actual = _sql_snapshot(stored)
+    for category in VERIFY_CATEGORIES:
+        if _digest(expected[category]) != _digest(actual[category]):
+            result["mismatches"][category] = _diff(expected[category], actual[category], category)
+    return result
+
+def verify_users(chunk: List[tuple]) -> List[Dict[str, Any]]:
+    """Verify a chunk of (user_id, users_data.json entry, NER file) tuples"""
+    return [verify_user(*item) for item in chunk]
+
+def _print_mismatch(result: Dict[str, Any], lines_per_category: int = 5):
+    """Print the diffs of one mismatched user"""
+    print(f"  ✗ {result['user_id']}")
+    for category, lines in result["mismatches"].items():
+        for line in lines[:lines_per_category]:
+            print(f"      {line}")
+        if len(lines) > lines_per_category:
+            print(f"      ... {len(lines) - lines_per_category} more {category} differences")
+
+def run_verification(workers: Optional[int] = None, users_file: str = USERS_DATA_FILE,
+                     ner_data_dir: str = NER_DATA_DIR, report_limit: int = VERIFY_REPORT_LIMIT) -> Dict[str, Any]:
+    """Check that every user's SQL rows match their JSON source, in parallel across users
+
+    Users only in the database are checked too, so rows without a JSON source show up as
+    "only in SQL". Diffs are printed for the first report_limit mismatched users.
+    """
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    users_data = _load_json(users_file)
+    ner_paths = {}
+    if os.path.isdir(ner_data_dir):
+        for file_name in sorted(os.listdir(ner_data_dir)):
+            if file_name.endswith("_ner.json"):
+                ner_paths[file_name[:-len("_ner.json")]] = os.path.join(ner_data_dir, file_name)
+
+    user_ids = list(users_data) + [user_id for user_id in ner_paths if user_id not in users_data]
+    user_ids += sorted(set(get_user_ids_sql()) - set(user_ids))
+    items = [(user_id, users_data.get(user_id), ner_paths.get(user_id)) for user_id in user_ids]
+    print(f"Verifying {len(items)} users, hashing with {workers} workers")
+
+    mismatches = dict.fromkeys(VERIFY_CATEGORIES, 0)
+    mismatched_users = 0
+    reported = []
+    errors = []
+    started = time.perf_counter()
+    done = 0
+    for results in parse_in_pool(_chunks(items, PARSE_CHUNK_SIZE), verify_users, workers):
+        for result in results:
+            errors.extend((result["user_id"], error) for error in result["errors"])
+            if result["mismatches"]:
+                mismatched_users += 1
+                if len(reported) < report_limit:
+                    _print_mismatch(result)
+                    reported.append(result)
+                for category in result["mismatches"]:
+                    mismatches[category] += 1
+        previous, done = done, done + len(results)
+        if done // MIGRATION_BATCH_SIZE > previous // MIGRATION_BATCH_SIZE:
+            elapsed = time.perf_counter() - started
+            print(f"  {done}/{len(items)} users verified ({_rate(done, elapsed):,.0f} users/s, "
+                  f"ETA {_eta(done, len(items), elapsed)})")
+    if mismatched_users > len(reported):
+        print(f"  ... and {mismatched_users - len(reported)} more mismatched users")
+
+    elapsed = time.perf_counter() - started
+    return {
+        "success": not mismatched_users and not errors, "users": done, "mismatched_users": mismatched_users,
+        "mismatches": mismatches, "reported": reported, "errors": errors, "seconds": round(elapsed, 2),
+        "message": f"Verified {done} users in {elapsed:.1f}s: {mismatched_users} mismatched, {len(errors)} errors"
+    }
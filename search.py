@@ -0,0 +1,93 @@
+"""
+Text normalization and ranking helpers for conversation search.
+
+Messages are mostly Roman Urdu mixed with English, where one word is spelled
+several ways ("khaana"/"khana", "theek"/"thik", "yeh"/"ye", "achha"/"acha").
+Indexed text and queries are folded through the same rules so these variants
+match, and query terms are prefix-matched to tolerate suffix changes.
+"""
+
+import re
+import unicodedata
+from typing import Any, Dict, Iterable, List
+
+_WORD_PATTERN = re.compile(r"[^\W_]+")
+
+# Applied in order to each lowercased token
+_ROMAN_URDU_FOLDS = [
+    (re.compile(r"chh|cch"), "ch"),          # achha / accha -> acha, kuchh -> kuch
+    (re.compile(r"ee"), "i"),                # theek -> thik
+    (re.compile(r"oo"), "u"),                # hoon -> hun
+    (re.compile(r"q"), "k"),                 # qeema -> keema
+    (re.compile(r"v"), "w"),                 # vazan -> wazan
+    (re.compile(r"(\w)\1+"), r"\1"),         # khaana -> khana, biryaani -> biryani
+    (re.compile(r"(?<=[aeiou])h$"), ""),     # yeh -> ye, woh -> wo
+    (re.compile(r"(ay|ae)$"), "ai"),         # hay / hae -> hai
+]
+
+def _strip_diacritics(text: str) -> str:
+    """Drop accents and optional vowel marks (zer, zabar, pesh)"""
+    return "".join(ch for ch in unicodedata.normalize("NFKD", text) if not unicodedata.combining(ch))
+
+def fold_token(token: str) -> str:
+    """Fold one lowercased word to its canonical Roman Urdu spelling"""
+    if not token.isascii():
+        return token
+    for pattern, replacement in _ROMAN_URDU_FOLDS:
+        token = pattern.sub(replacement, token)
+    return token
+
+def search_tokens(text: str) -> List[str]:
+    """Split text into normalized search tokens"""
+    return [fold_token(word) for word in _WORD_PATTERN.findall(_strip_diacritics(text or "").lower())]
+
+def normalize_search_text(text: str) -> str:
+    """Normalized form of text as stored in the search index"""
+    return " ".join(search_tokens(text))
+
+def build_fts_query(query: str) -> str:
+    """Build an FTS5 expression requiring every query term as a prefix"""
+    return " ".join(f'"{token}"*' for token in search_tokens(query))
+
+def entity_search_text(entity: Any) -> str:
+    """Searchable text of an extracted entity: its values, without the timestamp"""
+    if not isinstance(entity, dict):
+        return str(entity)
+    values = []
+    for key, value in entity.items():
+        if key == "timestamp" or value in (None, "", []):
+            continue
+        if isinstance(value, list):
+            values.extend(str(item) for item in value)
+        else:
+            values.append(str(value))
+    return " ".join(values)
+
+def _matches(token: str, query_tokens: Iterable[str]) -> bool:
+    """Check whether a normalized token starts with any query term"""
+    return any(token.startswith(query_token) for query_token in query_tokens)
+
+def match_score(text: str, query_tokens: List[str]) -> int:
+    """Number of matching terms in text, or 0 unless every query term occurs"""
+    tokens = search_tokens(text)
+    if not query_tokens or not all(any(token.startswith(q) for token in tokens) for q in query_tokens):
+        return 0
+    return sum(1 for token in tokens if _matches(token, query_tokens))
+
+def make_snippet(text: str, query_tokens: List[str], width: int = 12) -> str:
+    """Excerpt of text around the first match, with matched words in [brackets]"""
+    words = (text or "").split()
+    hits = [i for i, word in enumerate(words) if any(_matches(token, query_tokens) for token in search_tokens(word))]
+    if not hits:
+        return " ".join(words[:width]) + (" …" if len(words) > width else "")
+
+    start = max(0, hits[0] - width // 3)
+    end = min(len(words), start + width)
+    excerpt = [f"[{word}]" if i in hits else word for i, word in enumerate(words[start:end], start)]
+    return ("… " if start > 0 else "") + " ".join(excerpt) + (" …" if end < len(words) else "")
+
+def rank_results(results: List[Dict[str, Any]], limit: int) -> List[Dict[str, Any]]:
+    """Order search results best first, newest first among equal scores"""
+    results.sort(key=lambda result: result.get("timestamp") or "", reverse=True)
+    results.sort(key=lambda result: result["score"], reverse=True)
+    return results[:limit]
@@ -0,0 +1,278 @@
+"""
+File layout for per-user JSON data in wellness_data/.
+
+Files are either flat (wellness_data/{user_id}_wellness.json) or sharded into
+hash-prefix subdirectories (wellness_data/ab/cd/{user_id}_wellness.json) so no
+single directory grows with the user count. Reads fall back across layouts, so a
+re-shard can run while the app is serving requests.
+
+Only the standard library is imported here, so tools like database_manager.py can
+read users_data.json and wellness files without importing backend and its models.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+USERS_DATA_FILE = "users_data.json"
+WELLNESS_DATA_DIR = "wellness_data"
+WELLNESS_FILE_SUFFIX = "_wellness.json"
+SESSION_INDEX_SUFFIX = "_sessions.json"
+USER_FILE_SUFFIXES = (WELLNESS_FILE_SUFFIX, SESSION_INDEX_SUFFIX)
+
+# Archived session messages, always sharded two levels deep so they can be found
+# regardless of the configured layout
+ARCHIVE_DIR = os.path.join(WELLNESS_DATA_DIR, "archive")
+ARCHIVE_SHARD_LEVELS = 2
+
+# Number of 2-hex-character directory levels (0 = flat layout, 256 dirs per level)
+WELLNESS_SHARD_LEVELS = int(os.getenv("WELLNESS_SHARD_LEVELS", "0"))
+MAX_SHARD_LEVELS = 3
+
+def wellness_shard_dir(user_id: str, levels: Optional[int] = None, base_dir: str = WELLNESS_DATA_DIR) -> str:
+    """Get the directory holding a user's wellness file for a given shard depth"""
+    levels = WELLNESS_SHARD_LEVELS if levels is None else levels
+    digest = hashlib.md5(user_id.encode("utf-8")).hexdigest()
+    parts = [digest[i * 2:i * 2 + 2] for i in range(levels)]
+    return os.path.join(base_dir, *parts)
+
+def user_file_path(user_id: str, suffix: str, levels: Optional[int] = None, base_dir: str = WELLNESS_DATA_DIR) -> str:
+    """Get the path a per-user file should live at for a given shard depth"""
+    return os.path.join(wellness_shard_dir(user_id, levels, base_dir), f"{user_id}{suffix}")
+
+def find_user_file(user_id: str, suffix: str, base_dir: str = WELLNESS_DATA_DIR) -> Optional[str]:
+    """Find an existing per-user file, checking the configured layout first and then the others"""
+    levels_to_check = [WELLNESS_SHARD_LEVELS] + [
+        levels for levels in range(MAX_SHARD_LEVELS + 1) if levels != WELLNESS_SHARD_LEVELS
+    ]
+    for levels in levels_to_check:
+        path = user_file_path(user_id, suffix, levels, base_dir)
+        if os.path.exists(path):
+            return path
+    return None
+
+def wellness_file_path(user_id: str, levels: Optional[int] = None, base_dir: str = WELLNESS_DATA_DIR) -> str:
+    """Get the path a user's wellness file should live at for a given shard depth"""
+    return user_file_path(user_id, WELLNESS_FILE_SUFFIX, levels, base_dir)
+
+def find_wellness_file(user_id: str, base_dir: str = WELLNESS_DATA_DIR) -> Optional[str]:
+    """Find an existing wellness file in any layout"""
+    return find_user_file(user_id, WELLNESS_FILE_SUFFIX, base_dir)
+
+def session_index_path(user_id: str, levels: Optional[int] = None, base_dir: str = WELLNESS_DATA_DIR) -> str:
+    """Get the path a user's session index should live at for a given shard depth"""
+    return user_file_path(user_id, SESSION_INDEX_SUFFIX, levels, base_dir)
+
+def find_session_index_file(user_id: str, base_dir: str = WELLNESS_DATA_DIR) -> Optional[str]:
+    """Find an existing session index file in any layout"""
+    return find_user_file(user_id, SESSION_INDEX_SUFFIX, base_dir)
+
+def session_archive_path(user_id: str, session_id: str, archive_dir: str = ARCHIVE_DIR) -> str:
+    """Get the path of the compressed archive holding a session's messages"""
+    safe_session_id = re.sub(r"[^A-Za-z0-9_.-]", "_", session_id)
+    user_dir = os.path.join(wellness_shard_dir(user_id, ARCHIVE_SHARD_LEVELS, archive_dir), user_id)
+    return os.path.join(user_dir, f"{safe_session_id}.json.gz")
+
+def write_session_archive(path: str, messages: List[Dict[str, Any]]):
+    """Write archived session messages as gzip-compressed JSON"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump(messages, f, ensure_ascii=False, default=str)
+    os.replace(tmp_path, path)
+
+def read_session_archive(path: str) -> List[Dict[str, Any]]:
+    """Read archived session messages, or an empty list if there is no archive"""
+    if not os.path.exists(path):
+        return []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+def write_json_atomic(path: str, data: Any):
+    """Write JSON to a temp file and swap it in so readers never see a partial file"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=4, ensure_ascii=False, default=str)
+    os.replace(tmp_path, path)
+
+def load_users_data() -> Dict[str, Any]:
+    """Load all users data"""
+    if os.path.exists(USERS_DATA_FILE):
+        with open(USERS_DATA_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+def get_user_wellness_file(user_id: str = "default_user") -> str:
+    """Get the wellness file path for a specific user (existing file, or where a new one goes)"""
+    return find_wellness_file(user_id) or wellness_file_path(user_id)
+
+def load_user_wellness_data(user_id: str = "default_user") -> Dict[str, Any]:
+    """Load wellness data for a specific user"""
+    file_path = get_user_wellness_file(user_id)
+    if os.path.exists(file_path):
+        with open(file_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    
+    # Create default structure if doesn't exist
+    return {
+        "user_id": user_id,
+        "created_at": datetime.now().isoformat(),
+        "last_updated": datetime.now().isoformat(),
+        "sessions": {},
+        "daily_logs": {},
+        "agent_preferences": {
+            "MENTAL_HEALTH": {"usage_count": 0, "satisfaction_rating": 0},
+            "DIET": {"usage_count": 0, "satisfaction_rating": 0},
+            "EXERCISE": {"usage_count": 0, "satisfaction_rating": 0}
+        },
+        "wellness_summary": {
+            "total_sessions": 0,
+            "total_mental_health_interactions": 0,
+            "total_diet_interactions": 0,
+            "total_exercise_interactions": 0,
+            "current_streak": 0,
+            "goal_progress": {
+                "weight_progress": 0,
+                "fitness_progress": 0,
+                "mental_health_progress": 0
+            }
+        }
+    }
+
+def entity_key(entity: Dict[str, Any]) -> str:
+    """Canonical JSON form of an entity, ignoring its timestamp"""
+    return json.dumps({k: v for k, v in entity.items() if k != 'timestamp'}, sort_keys=True, default=str)
+
+def entity_fingerprint(entity: Dict[str, Any]) -> str:
+    """Short hash of an entity's canonical form, used to deduplicate NER results"""
+    return hashlib.blake2b(entity_key(entity).encode("utf-8"), digest_size=16).hexdigest()
+
+# Field naming each entity type, in order of preference (general NER types first, then agent types)
+ENTITY_NAME_FIELDS = {
+    "people": ("name",),
+    "places": ("location", "name", "place"),
+    "events": ("event", "name", "activity"),
+    "substances": ("substance", "name"),
+    "conditions": ("condition",),
+    "coping_strategies": ("strategy",),
+    "emotional_states": ("emotion",),
+    "therapeutic_goals": ("goal",),
+    "food_items": ("item",),
+    "nutritional_goals": ("goal",),
+    "eating_patterns": ("pattern",),
+    "dietary_restrictions": ("restriction",),
+    "meal_plans": ("meal_type",),
+    "body_responses": ("response",),
+    "activities": ("activity",),
+    "fitness_goals": ("goal",),
+    "physical_limitations": ("limitation",),
+    "workout_preferences": ("preference",),
+    "physical_responses": ("response",),
+    "fitness_environments": ("location",),
+    "performance_metrics": ("metric",)
+}
+
+# Field describing how a mention felt or how serious it was, recorded with each mention
+ENTITY_ATTRIBUTE_FIELDS = {
+    "people": ("emotional_charge", "emotional_impact"),
+    "places": ("emotional_association",),
+    "events": ("trauma_relevance",),
+    "substances": ("usage_pattern",),
+    "conditions": ("severity",),
+    "coping_strategies": ("effectiveness",),
+    "emotional_states": ("intensity",),
+    "food_items": ("satisfaction_level",),
+    "nutritional_goals": ("motivation_level",),
+    "dietary_restrictions": ("strictness",),
+    "body_responses": ("severity",),
+    "activities": ("intensity",),
+    "physical_limitations": ("severity",)
+}
+
+def entity_name(entity_type: str, entity) -> str:
+    """Name an entity is known by, e.g. a person's name or a food item"""
+    if not isinstance(entity, dict):
+        return str(entity)
+    for field in ENTITY_NAME_FIELDS.get(entity_type, ()):
+        if entity.get(field):
+            return entity[field]
+    return ""
+
+def entity_attribute(entity_type: str, entity) -> Optional[str]:
+    """Emotional charge or similar attribute of an entity mention, if its type has one"""
+    if not isinstance(entity, dict):
+        return None
+    for field in ENTITY_ATTRIBUTE_FIELDS.get(entity_type, ()):
+        if entity.get(field):
+            return str(entity[field])
+    return None
+
+def canonical_entity_name(name: str) -> str:
+    """Entity name with case and spacing differences removed"""
+    return " ".join(str(name).split()).lower()
+
+def entity_index_key(entity_type: str, entity) -> Optional[str]:
+    """Canonical "type:name" key of an entity, or None if it has no name"""
+    name = canonical_entity_name(entity_name(entity_type, entity))
+    return f"{entity_type}:{name}" if name else None
+
+def iter_user_files(base_dir: str = WELLNESS_DATA_DIR) -> Iterator[Tuple[str, str, str]]:
+    """Yield (user_id, suffix, path) for every per-user file in any layout"""
+    for root, dirs, files in os.walk(base_dir):
+        if os.path.abspath(root) == os.path.abspath(base_dir) and "archive" in dirs:
+            dirs.remove("archive")
+        for file_name in files:
+            for suffix in USER_FILE_SUFFIXES:
+                if file_name.endswith(suffix):
+                    yield file_name[:-len(suffix)], suffix, os.path.join(root, file_name)
+                    break
+
+def iter_wellness_files(base_dir: str = WELLNESS_DATA_DIR) -> Iterator[Tuple[str, str]]:
+    """Yield (user_id, path) for every wellness file in any layout"""
+    for user_id, suffix, path in iter_user_files(base_dir):
+        if suffix == WELLNESS_FILE_SUFFIX:
+            yield user_id, path
+
+def reshard_wellness_data(levels: int, base_dir: str = WELLNESS_DATA_DIR, dry_run: bool = False) -> Dict[str, int]:
+    """Move every per-user file into the layout for the given shard depth"""
+    if not 0 <= levels <= MAX_SHARD_LEVELS:
+        raise ValueError(f"Shard levels must be between 0 and {MAX_SHARD_LEVELS}")
+
+    stats = {"moved": 0, "unchanged": 0, "conflicts": 0}
+    for user_id, suffix, path in list(iter_user_files(base_dir)):
+        target = user_file_path(user_id, suffix, levels, base_dir)
+        if os.path.abspath(path) == os.path.abspath(target):
+            stats["unchanged"] += 1
+            continue
+
+        if os.path.exists(target):
+            # Written under both layouts while re-sharding: keep the newer copy
+            stats["conflicts"] += 1
+            if not dry_run:
+                if os.path.getmtime(path) > os.path.getmtime(target):
+                    os.replace(path, target)
+                else:
+                    os.remove(path)
+            continue
+
+        stats["moved"] += 1
+        if not dry_run:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(path, target)
+
+    if not dry_run:
+        _remove_empty_shard_dirs(base_dir)
+    return stats
+
+def _remove_empty_shard_dirs(base_dir: str):
+    """Remove shard directories left empty after a re-shard"""
+    for root, _dirs, _files in os.walk(base_dir, topdown=False):
+        if root != base_dir and not os.listdir(root):
+            try:
+                os.rmdir(root)
+            except OSError:
+                pass
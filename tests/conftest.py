@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Run a test against empty users_data.json, wellness_data and wellness_app.db in a temporary directory"""
+    import database
+    monkeypatch.chdir(tmp_path)
+    yield tmp_path
+    database.close_db_connections()
@@ -0,0 +1,8 @@
+from database_manager import run_concurrent_conversations
+from delta_checkpointer import PooledDeltaSqliteSaver
+
+def test_pooled_saver_handles_50_concurrent_threads(tmp_path):
+    result = run_concurrent_conversations(PooledDeltaSqliteSaver, str(tmp_path / "history.db"), threads=50, turns=3)
+    assert result["errors"] == []
+    assert result["mismatched"] == 0
+    assert result["integrity"] == "ok"
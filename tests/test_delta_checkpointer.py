@@ -0,0 +1,83 @@
+import operator
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Annotated, TypedDict
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.graph import StateGraph, START, END
+from langgraph.graph.message import add_messages
+
+from delta_checkpointer import CHECKPOINT_SNAPSHOT_INTERVAL, DeltaSqliteSaver
+from history_store import compact_history_db, prune_checkpoints
+
+START_TIME = datetime(2025, 1, 1, 9)
+
+class ChatState(TypedDict):
+    messages: Annotated[list, add_messages]
+    time_stamps: Annotated[list, operator.add]
+
+def _chat_node(state: ChatState):
+    turn = len(state["messages"]) // 2
+    return {"messages": [AIMessage(content=f"reply {turn}")],
+            "time_stamps": [START_TIME + timedelta(minutes=turn, seconds=30)]}
+
+def _build_graph(checkpointer):
+    graph = StateGraph(ChatState)
+    graph.add_node("chat", _chat_node)
+    graph.add_edge(START, "chat")
+    graph.add_edge("chat", END)
+    return graph.compile(checkpointer=checkpointer)
+
+def _connect(path):
+    return sqlite3.connect(str(path), check_same_thread=False)
+
+def _chat(chatbot, turns, first_turn=0):
+    for turn in range(first_turn, first_turn + turns):
+        chatbot.invoke({"messages": [HumanMessage(content=f"question {turn}")],
+                        "time_stamps": [START_TIME + timedelta(minutes=turn)]}, CONFIG)
+
+def _values(values):
+    """State values without the message IDs add_messages generates"""
+    return {"messages": [(message.type, message.content) for message in values.get("messages", [])],
+            "time_stamps": values.get("time_stamps", [])}
+
+CONFIG = {"configurable": {"thread_id": "delta_thread"}}
+TURNS = CHECKPOINT_SNAPSHOT_INTERVAL  # Several checkpoints per turn, so the chain passes a snapshot
+
+def test_delta_saver_matches_sqlite_saver(tmp_path):
+    plain = _build_graph(SqliteSaver(_connect(tmp_path / "plain.db")))
+    delta_path = tmp_path / "delta.db"
+    _chat(plain, TURNS)
+    _chat(_build_graph(DeltaSqliteSaver(_connect(delta_path))), TURNS)
+
+    with _connect(delta_path) as conn:
+        depths = [row[0] for row in conn.execute("SELECT delta_depth FROM checkpoints ORDER BY checkpoint_id")]
+    assert len(depths) > CHECKPOINT_SNAPSHOT_INTERVAL
+    assert max(depths) == CHECKPOINT_SNAPSHOT_INTERVAL - 1
+    assert depths.count(0) > 1
+
+    # Read back through a fresh saver, with nothing cached
+    delta = _build_graph(DeltaSqliteSaver(_connect(delta_path)))
+    assert _values(delta.get_state(CONFIG).values) == _values(plain.get_state(CONFIG).values)
+    assert len(delta.get_state(CONFIG).values["messages"]) == 2 * TURNS
+    assert [_values(state.values) for state in delta.get_state_history(CONFIG)] == \
+        [_values(state.values) for state in plain.get_state_history(CONFIG)]
+
+@pytest.mark.parametrize("keep", [1, 2])
+def test_pruned_delta_history_stays_readable_and_appendable(tmp_path, keep):
+    path = tmp_path / "history.db"
+    _chat(_build_graph(DeltaSqliteSaver(_connect(path))), TURNS)
+
+    result = prune_checkpoints(keep=keep, path=str(path))
+    assert result["success"] and result["deleted_checkpoints"] > 0
+    compact_history_db(str(path))
+
+    chatbot = _build_graph(DeltaSqliteSaver(_connect(path)))
+    assert len(chatbot.get_state(CONFIG).values["messages"]) == 2 * TURNS
+    _chat(chatbot, 1, first_turn=TURNS)
+    values = _values(_build_graph(DeltaSqliteSaver(_connect(path))).get_state(CONFIG).values)
+    assert values["messages"][-2:] == [("human", f"question {TURNS}"), ("ai", f"reply {TURNS}")]
+    assert len(values["messages"]) == 2 * (TURNS + 1)
+    assert len(values["time_stamps"]) == 2 * (TURNS + 1)
@@ -0,0 +1,40 @@
+from datetime import datetime
+
+import pytest
+
+import backend
+from backend import CopingStrategy, MentalHealthCondition, MentalHealthEntities, MentalHealthPerson
+
+def _normalized(entity_index):
+    """Entity index with each session's keys sorted, since their order depends on insertion"""
+    sessions = {session_id: sorted(keys) for session_id, keys in entity_index["sessions"].items()}
+    return {**entity_index, "sessions": sessions}
+
+@pytest.fixture
+def json_conversations(data_dir, monkeypatch):
+    """Store conversations and NER entities in JSON files only"""
+    monkeypatch.setattr(backend, "USE_SQL_FOR_CONVERSATIONS", False)
+
+def test_agent_entities_keep_index_in_step_with_sessions(json_conversations):
+    user_id = "index_user"
+    session_id = f"wellness_mental_health_{user_id}_1"
+    backend.initialize_user_wellness_data(user_id)
+
+    first = MentalHealthEntities(
+        people=[MentalHealthPerson(name="Ayesha", relationship="sister", emotional_impact="supportive", support_level="high")],
+        conditions=[MentalHealthCondition(condition="stress", severity="mild")],
+        coping_strategies=[CopingStrategy(strategy="walking", effectiveness="very_effective")]
+    )
+    second = MentalHealthEntities(
+        conditions=[MentalHealthCondition(condition="stress", severity="mild"),
+                    MentalHealthCondition(condition="insomnia", severity="moderate")]
+    )
+    backend.add_agent_specific_ner_to_session(first, session_id, datetime(2025, 1, 1, 10), user_id, "MENTAL_HEALTH")
+    backend.add_agent_specific_ner_to_session(second, session_id, datetime(2025, 1, 1, 11), user_id, "MENTAL_HEALTH")
+
+    wellness_data = backend.load_user_wellness_data(user_id)
+    assert _normalized(wellness_data["entity_index"]) == _normalized(backend.build_entity_index(wellness_data["sessions"]))
+
+    backend.dedupe_json_entities(user_id)
+    wellness_data = backend.load_user_wellness_data(user_id)
+    assert _normalized(wellness_data["entity_index"]) == _normalized(backend.build_entity_index(wellness_data["sessions"]))
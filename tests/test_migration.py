@@ -0,0 +1,34 @@
+import json
+import os
+
+import database
+import database_manager
+from storage import USERS_DATA_FILE, wellness_file_path
+
+def _write_users(users):
+    with open(USERS_DATA_FILE, "w", encoding="utf-8") as f:
+        json.dump(users, f)
+    for user_id in users:
+        path = wellness_file_path(user_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"user_id": user_id, "sessions": {}}, f)
+
+def test_incremental_migration_rewrites_changed_accounts(data_dir):
+    users = {
+        f"user_{i}": {"full_name": f"User {i}", "cnic": f"35202-000000{i}-1",
+                      "email": f"user{i}@example.pk", "password_hash": "hash"}
+        for i in range(3)
+    }
+    _write_users(users)
+    assert database_manager.full_migration(workers=1)
+
+    users["user_1"]["email"] = "changed@example.pk"
+    users["user_1"]["full_name"] = "Changed Name"
+    _write_users(users)
+    assert database_manager.full_migration(workers=1, since="last")
+
+    user = database.get_user_sql("user_1")
+    assert user["email"] == "changed@example.pk"
+    assert user["full_name"] == "Changed Name"
+    assert database_manager.verify_migration(workers=1)
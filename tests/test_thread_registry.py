@@ -0,0 +1,42 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+import backend
+from ids import new_thread_id
+import database
+
+class _CountingChatbot:
+    """Stand-in graph whose threads are all in the GENERAL state, counting get_state calls"""
+
+    def __init__(self):
+        self.get_state_calls = 0
+
+    def get_state(self, config):
+        self.get_state_calls += 1
+        return SimpleNamespace(values={"current_agent": "GENERAL"})
+
+@pytest.fixture(params=[True, False], ids=["sql", "json"])
+def chatbot(request, data_dir, monkeypatch):
+    """Counting chatbot, with conversations stored in SQL or in JSON files"""
+    monkeypatch.setattr(backend, "USE_SQL_FOR_CONVERSATIONS", request.param)
+    if request.param:
+        database.init_database()
+    counting_chatbot = _CountingChatbot()
+    monkeypatch.setattr(backend, "get_chatbot", lambda: counting_chatbot)
+    return counting_chatbot
+
+def test_threads_without_agent_are_resolved_once(chatbot):
+    user_id = "registry_user"
+    backend.add_message_to_session("support_thread_42", "hello", "human", datetime(2025, 1, 1, 10), user_id)
+    backend.add_message_to_session("chat_1700000000", "hi", "human", datetime(2025, 1, 1, 11), user_id)
+    backend.add_message_to_session(new_thread_id("DIET"), "lunch", "human", datetime(2025, 1, 1, 12), user_id)
+
+    first = backend.get_user_threads_by_agent(user_id)
+    assert first["MENTAL_HEALTH"] == ["support_thread_42", "chat_1700000000"]
+    assert len(first["DIET"]) == 1
+    assert chatbot.get_state_calls == 2
+
+    assert backend.get_user_threads_by_agent(user_id) == first
+    assert chatbot.get_state_calls == 2